@@ -0,0 +1,142 @@
+"""
+Atomic balance changes for GameHub Marketplace
+Every change is one conditional $inc on the user (debits only match while
+`balance >= amount`), tied to its `transactions` record: the record is written
+first as `processing`, the $inc tags the user with its id, the matching
+ledger entry is posted, and then both are finalized. A crash part way
+through is settled by `recover`.
+"""
+import asyncio
+import logging
+import uuid
+from datetime import datetime, timezone, timedelta
+from typing import Optional
+
+from pymongo import ReturnDocument
+
+from ledger import Ledger, user_account
+
+logger = logging.getLogger(__name__)
+
+
+class InsufficientBalance(Exception):
+    pass
+
+
+class AccountNotFound(LookupError):
+    pass
+
+
+class Balances:
+    """Concurrent changes to one user's balance never lose updates and never
+    overdraw it, without any per-user lock.
+
+    A transaction record goes processing -> its final status (completed, or
+    pending for withdrawals awaiting approval); one whose $inc never applied
+    (a refused debit, or a crash before it) is deleted rather than left in
+    the user's history. While it is being applied its id sits in the user's
+    ``pending_transactions``; that guard also makes the $inc idempotent.
+    """
+
+    def __init__(self, ledger: Ledger):
+        self.ledger = ledger
+        self.stats = {"applied": 0, "insufficient": 0, "recovered": 0, "abandoned": 0}
+
+    async def apply(self, db, user_id: str, amount: float, transaction: dict, counterparty: str,
+                    final_status: str = "completed") -> dict:
+        """Add ``amount`` (negative for a debit) and record it; returns the record,
+        with the new balance as ``balance_after``.
+
+        ``transaction`` holds the record's type/method/description; its
+        ``amount`` is stored unsigned. The money moves to or from the
+        ``counterparty`` ledger account. Raises InsufficientBalance or
+        AccountNotFound, removing the record again.
+        """
+        now = datetime.now(timezone.utc)
+        record = {
+            "id": str(uuid.uuid4()),
+            **transaction,
+            "user_id": user_id,
+            "amount": abs(amount),
+            "status": "processing",
+            "final_status": final_status,
+            "counterparty": counterparty,
+            "created_at": now
+        }
+        await db.transactions.insert_one(record)
+
+        query = {"id": user_id, "pending_transactions": {"$ne": record["id"]}}
+        if amount < 0:
+            query["balance"] = {"$gte": -amount}
+        user = await db.users.find_one_and_update(
+            query,
+            {"$inc": {"balance": amount}, "$push": {"pending_transactions": record["id"]}},
+            projection={"_id": 0, "balance": 1},
+            return_document=ReturnDocument.AFTER
+        )
+        if user is None:
+            await db.transactions.delete_one({"id": record["id"], "status": "processing"})
+            if not await db.users.count_documents({"id": user_id}, limit=1):
+                raise AccountNotFound(user_id)
+            self.stats["insufficient"] += 1
+            raise InsufficientBalance(user_id)
+
+        await self._post(db, record, amount)
+        await self._finalize(db, user_id, record["id"], final_status, user["balance"])
+        self.stats["applied"] += 1
+        record.pop("final_status")
+        record.update(status=final_status, balance_after=user["balance"])
+        return record
+
+    async def _post(self, db, record: dict, amount: float):
+        await self.ledger.transfer(
+            db, record["id"], record["type"], record["counterparty"], user_account(record["user_id"]), amount,
+            ref=record["id"]
+        )
+
+    async def _finalize(self, db, user_id: str, transaction_id: str, status: str, balance_after: Optional[float]):
+        update = {"status": status}
+        if balance_after is not None:
+            update["balance_after"] = balance_after
+        await asyncio.gather(
+            db.transactions.update_one(
+                {"id": transaction_id, "status": "processing"},
+                {"$set": update, "$unset": {"final_status": ""}}
+            ),
+            db.users.update_one({"id": user_id}, {"$pull": {"pending_transactions": transaction_id}})
+        )
+
+    async def recover(self, db, older_than_seconds: float = 60, batch: int = 500) -> int:
+        """Settle records left in processing by a crash; returns how many were settled.
+
+        If the user still carries the record's id the $inc happened: its ledger
+        entry is posted (a no-op if it already was) and the record finalized.
+        Otherwise it never applied and is deleted.
+        """
+        cutoff = datetime.now(timezone.utc) - timedelta(seconds=older_than_seconds)
+        settled = 0
+        while True:
+            stuck = await db.transactions.find(
+                {"status": "processing", "created_at": {"$lte": cutoff}},
+                {"_id": 0}
+            ).limit(batch).to_list(batch)
+            for record in stuck:
+                applied = await db.users.count_documents(
+                    {"id": record["user_id"], "pending_transactions": record["id"]}, limit=1
+                )
+                if applied:
+                    if record.get("counterparty"):
+                        signed = -record["amount"] if record["type"] == "withdrawal" else record["amount"]
+                        await self._post(db, record, signed)
+                    await self._finalize(db, record["user_id"], record["id"], record.get("final_status", "completed"), None)
+                    self.stats["recovered"] += 1
+                else:
+                    await db.transactions.delete_one({"id": record["id"], "status": "processing"})
+                    self.stats["abandoned"] += 1
+                logger.warning(f"Recovered balance transaction {record['id']} (applied={bool(applied)})")
+            settled += len(stuck)
+            if len(stuck) < batch:
+                return settled
+
+    def metrics(self) -> dict:
+        return dict(self.stats)
@@ -0,0 +1,128 @@
+"""
+Benchmark: concurrent balance traffic on a handful of hot accounts
+Deposits, withdrawals and admin adjustments race on the same users. "before"
+is the old read-modify-write ($set of a balance computed in Python), which
+loses updates and lets withdrawals overdraw; "after" is balances.Balances.
+After the run every balance must equal its opening amount plus the signed
+sum of the transactions that went through, none may be negative, and the
+ledger verifier must agree with every balance.
+Runs against MONGO_URL in a throwaway `<DB_NAME>_bench` database.
+
+Usage: python bench_balance.py [--operations 20000] [--users 10] [--concurrency 200]
+"""
+import argparse
+import asyncio
+import os
+import random
+import time
+import uuid
+from pathlib import Path
+
+from dotenv import load_dotenv
+from motor.motor_asyncio import AsyncIOMotorClient
+
+from balances import Balances, InsufficientBalance
+from ledger import Ledger, user_account
+
+load_dotenv(Path(__file__).parent / '.env')
+os.environ.setdefault('MONGO_URL', 'mongodb://localhost:27017')
+os.environ.setdefault('DB_NAME', 'test_database')
+
+OPENING_BALANCE = 100.0
+SIGNS = {"deposit": 1, "withdrawal": -1}
+
+
+async def read_modify_write(db, user_id: str, amount: float, transaction: dict, counterparty: str):
+    """What the endpoints did before: check and compute in Python, then $set"""
+    user = await db.users.find_one({"id": user_id}, {"_id": 0, "balance": 1})
+    new_balance = user["balance"] + amount
+    if new_balance < 0:
+        raise InsufficientBalance(user_id)
+    await db.transactions.insert_one({
+        "id": str(uuid.uuid4()), **transaction, "user_id": user_id, "amount": abs(amount), "status": "completed"
+    })
+    await db.users.update_one({"id": user_id}, {"$set": {"balance": new_balance}})
+
+
+async def run_variant(db, name: str, apply, operations: int, users: int, concurrency: int):
+    for collection in ("users", "transactions", "ledger_entries", "ledger_snapshots", "ledger_checkpoints"):
+        await db[collection].drop()
+    await db.users.create_index("id", unique=True)
+    await db.transactions.create_index("id", unique=True)
+    await db.transactions.create_index("user_id")
+    await db.ledger_entries.create_index([("entry_id", 1), ("account", 1)], unique=True)
+    user_ids = [f"user-{i}" for i in range(users)]
+    await db.users.insert_many([{"id": user_id, "balance": OPENING_BALANCE} for user_id in user_ids])
+    for user_id in user_ids:
+        await Ledger().transfer(db, f"opening:{user_id}", "opening", "equity:opening", user_account(user_id), OPENING_BALANCE)
+
+    rejected = 0
+    latencies = []
+    slots = asyncio.Semaphore(concurrency)
+
+    async def operation(n: int):
+        nonlocal rejected
+        kind = random.choices(["deposit", "withdrawal", "admin"], weights=[45, 45, 10])[0]
+        amount = round(random.uniform(1, 40), 2)
+        if kind == "admin":
+            amount = random.choice([amount, -amount])
+            kind = "deposit" if amount > 0 else "withdrawal"
+        else:
+            amount *= SIGNS[kind]
+        async with slots:
+            started = time.perf_counter()
+            try:
+                await apply(db, random.choice(user_ids), amount, {"type": kind, "method": "bench"}, "external:bench")
+            except InsufficientBalance:
+                rejected += 1
+            latencies.append(time.perf_counter() - started)
+
+    started = time.perf_counter()
+    await asyncio.gather(*(operation(n) for n in range(operations)))
+    elapsed = time.perf_counter() - started
+
+    expected = {user_id: OPENING_BALANCE for user_id in user_ids}
+    async for record in db.transactions.find({"status": {"$in": ["completed", "pending"]}}, {"_id": 0}):
+        expected[record["user_id"]] += SIGNS[record["type"]] * record["amount"]
+    lost = overdrawn = 0
+    async for user in db.users.find({}, {"_id": 0, "id": 1, "balance": 1}):
+        lost += abs(user["balance"] - expected[user["id"]]) > 0.005
+        overdrawn += user["balance"] < 0
+    stuck = await db.transactions.count_documents({"status": "processing"})
+    latencies.sort()
+
+    print(f"{name}")
+    print(f"  {operations / elapsed:,.0f} ops/s, p50/p99 {latencies[len(latencies) // 2] * 1000:.1f} / "
+          f"{latencies[int(len(latencies) * 0.99)] * 1000:.1f} ms, {rejected} rejected as insufficient")
+    print(f"  accounts off their ledger: {lost}/{users}, negative: {overdrawn}, records stuck processing: {stuck}")
+    return not lost and not overdrawn and not stuck
+
+
+async def run(operations: int, users: int, concurrency: int):
+    client = AsyncIOMotorClient(os.environ['MONGO_URL'], tz_aware=True)
+    bench_db = f"{os.environ['DB_NAME']}_bench"
+    db = client[bench_db]
+    balances = Balances(Ledger())
+
+    print(f"{operations} operations on {users} accounts (concurrency {concurrency})")
+    await run_variant(db, "before (read, compute, $set)", read_modify_write, operations, users, concurrency)
+    consistent = await run_variant(db, "after (conditional $inc + transaction record)", balances.apply,
+                                   operations, users, concurrency)
+    report = await balances.ledger.verify(db)
+    print(f"  ledger verification: {report['checked']} checked, {report['mismatched']} mismatched")
+    consistent = consistent and not report["mismatched"]
+
+    await client.drop_database(bench_db)
+    client.close()
+    if not consistent:
+        raise SystemExit("❌ Balances disagree with their transactions")
+    print("✅ Every balance matches its transactions; nothing overdrawn")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--operations", type=int, default=20000)
+    parser.add_argument("--users", type=int, default=10)
+    parser.add_argument("--concurrency", type=int, default=200)
+    args = parser.parse_args()
+    asyncio.run(run(args.operations, args.users, args.concurrency))
@@ -0,0 +1,132 @@
+"""
+Benchmark: the full checkout flow offline, against the stub payment provider
+Each buyer places an order, opens a checkout session, "pays" on the stub's
+hosted page and delivers the signed webhook, all through the real ASGI app.
+The run ends when the webhook inbox has fulfilled every order; stock and
+sales must then add up and every order must be paid exactly once.
+Runs against MONGO_URL in a throwaway `<DB_NAME>_bench` database.
+
+Usage: python bench_checkout.py [--orders 2000] [--buyers 50] [--products 20] [--concurrency 100]
+"""
+import argparse
+import asyncio
+import os
+import random
+import time
+from pathlib import Path
+
+from dotenv import load_dotenv
+
+load_dotenv(Path(__file__).parent / '.env')
+os.environ.setdefault('MONGO_URL', 'mongodb://localhost:27017')
+os.environ['DB_NAME'] = f"{os.environ.get('DB_NAME', 'test_database')}_bench"
+os.environ['PAYMENT_PROVIDER'] = 'stub'
+os.environ.setdefault('BCRYPT_ROUNDS', '4')
+os.environ.setdefault('BCRYPT_TARGET_MS', '0')
+os.environ.setdefault('WEBHOOK_POLL_SECONDS', '0.5')
+
+import httpx  # noqa: E402
+
+import server  # noqa: E402
+
+
+def percentile(samples, q: float) -> float:
+    samples = sorted(samples)
+    return samples[min(len(samples) - 1, int(len(samples) * q))] * 1000 if samples else 0.0
+
+
+async def run(orders: int, buyers: int, products: int, concurrency: int):
+    db = server.db
+    await server.client.drop_database(os.environ['DB_NAME'])
+    await server.startup()
+    transport = httpx.ASGITransport(app=server.app)
+    async with httpx.AsyncClient(transport=transport, base_url="http://bench") as http:
+        async def register(email: str) -> dict:
+            response = await http.post("/api/auth/register", json={
+                "email": email, "password": "bench-password", "full_name": email.split("@")[0]
+            })
+            response.raise_for_status()
+            return {"Authorization": f"Bearer {response.json()['access_token']}"}
+
+        seller = await register("seller@bench.example")
+        stock = orders * 3  # enough that no order is refused for stock
+        product_ids = []
+        for i in range(products):
+            response = await http.post("/api/products", headers=seller, json={
+                "title": f"Bench key {i}", "description": "bench", "price": round(random.uniform(1, 50), 2),
+                "product_type": "key", "images": [], "category_id": "bench", "stock": stock
+            })
+            response.raise_for_status()
+            product_ids.append(response.json()["id"])
+        buyer_headers = await asyncio.gather(*(register(f"buyer{i}@bench.example") for i in range(buyers)))
+
+        steps = {"order": [], "session": [], "pay": [], "webhook": []}
+        failures = []
+        slots = asyncio.Semaphore(concurrency)
+
+        async def timed(step: str, request):
+            started = time.perf_counter()
+            response = await request
+            steps[step].append(time.perf_counter() - started)
+            response.raise_for_status()
+            return response.json()
+
+        async def checkout(n: int):
+            headers = buyer_headers[n % buyers]
+            cart = [{"product_id": pid, "quantity": random.randint(1, 2)}
+                    for pid in random.sample(product_ids, random.randint(1, min(3, products)))]
+            async with slots:
+                try:
+                    order = await timed("order", http.post("/api/orders", headers=headers, json={"items": cart}))
+                    session = await timed("session", http.post(
+                        "/api/payments/checkout/session", headers=headers, json={"order_id": order["id"]}
+                    ))
+                    signed = await timed("pay", http.post(f"/api/payments/stub/{session['session_id']}"))
+                    await timed("webhook", http.post(
+                        "/api/webhook/stripe", content=signed["payload"],
+                        headers={"Stripe-Signature": signed["signature"]}
+                    ))
+                except httpx.HTTPStatusError as e:
+                    failures.append(f"{e.request.url.path}: {e.response.status_code}")
+
+        started = time.perf_counter()
+        await asyncio.gather(*(checkout(n) for n in range(orders)))
+        accepted = time.perf_counter() - started
+        while await db.orders.count_documents({"status": "pending"}):
+            await asyncio.sleep(0.05)
+        fulfilled = time.perf_counter() - started
+
+    docs = await db.products.find({"id": {"$in": product_ids}}, {"_id": 0, "stock": 1, "sales_count": 1}).to_list(products)
+    units_sold = sum(doc["sales_count"] for doc in docs)
+    units_left = sum(doc["stock"] for doc in docs)
+    ordered_units = 0
+    async for order in db.orders.find({"status": "paid"}, {"_id": 0, "items": 1}):
+        ordered_units += sum(item["quantity"] for item in order["items"])
+    paid = await db.orders.count_documents({"status": "paid"})
+    events_done = await db.webhook_events.count_documents({"status": "done"})
+
+    print(f"Checkouts:        {orders} orders by {buyers} buyers over {products} products (concurrency {concurrency})")
+    print(f"Accepted:         {accepted:.2f} s ({orders / accepted:,.0f} checkouts/s through the webhook ack)")
+    print(f"Fulfilled:        {fulfilled:.2f} s ({orders / fulfilled:,.0f} orders/s end to end)")
+    for step, samples in steps.items():
+        print(f"  {step:<8} p50/p99 {percentile(samples, 0.5):7.1f} / {percentile(samples, 0.99):7.1f} ms")
+    print(f"Orders paid:      {paid}, webhook events applied: {events_done}, failed requests: {len(failures)}")
+    print(f"Units:            sold {units_sold} (orders say {ordered_units}), left {units_left} of {products * stock}")
+    print(f"Payments:         {server.payment_gateway.metrics()}")
+
+    await server.client.drop_database(os.environ['DB_NAME'])
+    await server.shutdown_db_client()
+    if failures or paid != orders or events_done != orders or units_sold != ordered_units \
+            or units_left + units_sold != products * stock:
+        raise SystemExit(f"❌ Checkout accounting is off; first failures: {failures[:5]}")
+    print("✅ Every order paid once; stock and sales add up")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--orders", type=int, default=2000)
+    parser.add_argument("--buyers", type=int, default=50)
+    parser.add_argument("--products", type=int, default=20)
+    parser.add_argument("--concurrency", type=int, default=100)
+    args = parser.parse_args()
+    asyncio.run(run(args.orders, args.buyers, args.products, args.concurrency))
@@ -0,0 +1,86 @@
+"""
+Benchmark: product search index build and query latency
+Builds the index over a synthetic catalog with Zipf-distributed Russian and
+English vocabulary, then times typical, rare and misspelled queries.
+
+Usage: python bench_search.py [--products 1000000] [--repeat 50]
+"""
+import argparse
+import random
+import string
+import time
+
+from search import SearchIndex
+
+COMMON_TITLE_WORDS = ["steam", "key", "account", "gift", "игра", "ключ", "аккаунт", "подписка"]
+CYRILLIC = "абвгдежзиклмнопрстуфхцчшщыэюя"
+
+
+def make_vocabulary(alphabet: str, size: int):
+    return ["".join(random.choice(alphabet) for _ in range(random.randint(3, 10))) for _ in range(size)]
+
+
+def zipf_word(vocabulary):
+    return vocabulary[min(int(random.paretovariate(1.1)) - 1, len(vocabulary) - 1)]
+
+
+def synthetic_products(count: int, english, russian):
+    for i in range(count):
+        vocabulary = english if i % 2 else russian
+        yield {
+            "id": str(i),
+            "title": " ".join([random.choice(COMMON_TITLE_WORDS)] + [zipf_word(vocabulary) for _ in range(4)]),
+            "description": " ".join(zipf_word(vocabulary) for _ in range(25))
+        }
+
+
+def run(products: int, repeat: int):
+    random.seed(42)
+    english = make_vocabulary(string.ascii_lowercase, 50_000)
+    russian = make_vocabulary(CYRILLIC, 50_000)
+
+    index = SearchIndex()
+    builder = index.begin_rebuild()
+    started = time.perf_counter()
+    batch = []
+    for doc in synthetic_products(products, english, russian):
+        batch.append(doc)
+        if len(batch) == 5000:
+            builder.add_batch(batch)
+            batch = []
+    builder.add_batch(batch)
+    index.finish_rebuild(builder.finish())
+    print(f"Build:   {products:,} products in {time.perf_counter() - started:.1f} s ({index.metrics()['terms']:,} terms)")
+
+    rare = english[300]
+    queries = {
+        "common terms": "steam key",
+        "common terms (ru)": "аккаунт игра",
+        "mixed frequency": f"{english[3]} {english[400]}",
+        "rare term": rare,
+        "misspelled": rare[:-1] + ("a" if rare[-1] != "a" else "b"),
+        "no match": "zzzzqqqq"
+    }
+
+    started = time.perf_counter()
+    for _ in range(200):
+        index.add(next(synthetic_products(1, english, russian)) | {"id": f"new-{random.random()}"})
+    print(f"Updates: {(time.perf_counter() - started) / 200 * 1000:.3f} ms per incremental add")
+
+    for name, query in queries.items():
+        timings = []
+        for _ in range(repeat):
+            started = time.perf_counter()
+            results = index.search(query, limit=20)
+            timings.append(time.perf_counter() - started)
+        timings.sort()
+        print(f"{name:<18} p50 {timings[len(timings) // 2] * 1000:6.2f} ms   "
+              f"p99 {timings[int(len(timings) * 0.99)] * 1000:6.2f} ms   hits {len(results)}")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--products", type=int, default=1_000_000)
+    parser.add_argument("--repeat", type=int, default=50)
+    args = parser.parse_args()
+    run(args.products, args.repeat)
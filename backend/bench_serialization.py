@@ -0,0 +1,113 @@
+"""
+Benchmark: serializing 100-item product and order pages
+"before" is what FastAPI does with a plain list returned from the handler:
+validate every row against the route's response_model, then encode with the
+stdlib json encoder. "after" is the fast_json path the list endpoints now use.
+
+Usage: python bench_serialization.py [--items 100] [--rounds 200]
+"""
+import argparse
+import asyncio
+import os
+import random
+import time
+import uuid
+from datetime import datetime, timezone, timedelta
+
+os.environ.setdefault('MONGO_URL', 'mongodb://localhost:27017')
+os.environ.setdefault('DB_NAME', 'test_database')
+os.environ.setdefault('STRIPE_API_KEY', 'sk_test_bench')
+
+from fastapi.responses import JSONResponse  # noqa: E402
+from fastapi.routing import serialize_response  # noqa: E402
+
+import server  # noqa: E402
+from fast_json import fast_response, parse_fields, shape  # noqa: E402
+
+WORDS = "ключ активации steam игра аккаунт предмет скин редкий быстрая доставка гарантия".split()
+
+
+def synthetic_products(count: int):
+    now = datetime.now(timezone.utc)
+    return [{
+        "id": str(uuid.uuid4()),
+        "title": " ".join(random.choices(WORDS, k=5)),
+        "description": " ".join(random.choices(WORDS, k=300)),
+        "price": round(random.uniform(1, 5000), 2),
+        "product_type": random.choice(["key", "item", "account"]),
+        "images": [f"/uploads/{uuid.uuid4().hex}.jpg" for _ in range(random.randint(1, 4))],
+        "category_id": str(uuid.uuid4()),
+        "seller_id": str(uuid.uuid4()),
+        "stock": random.randint(0, 100),
+        "sales_count": random.randint(0, 1000),
+        "views_count": random.randint(0, 100000),
+        "created_at": now - timedelta(minutes=i),
+        "updated_at": now - timedelta(minutes=i)
+    } for i in range(count)]
+
+
+def synthetic_orders(count: int):
+    now = datetime.now(timezone.utc)
+    return [{
+        "id": str(uuid.uuid4()),
+        "user_id": str(uuid.uuid4()),
+        "items": [{
+            "product_id": str(uuid.uuid4()),
+            "title": " ".join(random.choices(WORDS, k=5)),
+            "price": round(random.uniform(1, 500), 2),
+            "quantity": random.randint(1, 3)
+        } for _ in range(random.randint(1, 4))],
+        "total": round(random.uniform(1, 2000), 2),
+        "currency": "usd",
+        "status": random.choice(["pending", "paid"]),
+        "payment_id": None,
+        "created_at": now - timedelta(minutes=i)
+    } for i in range(count)]
+
+
+def route_field(path: str):
+    return next(route.response_field for route in server.app.routes if getattr(route, "path", None) == path)
+
+
+async def timed(label: str, rounds: int, render) -> float:
+    body = await render()
+    started = time.perf_counter()
+    for _ in range(rounds):
+        await render()
+    per_page = (time.perf_counter() - started) / rounds * 1000
+    print(f"  {label:<40} {per_page:7.3f} ms/page  {len(body.body) / 1024:7.1f} KiB")
+    return per_page
+
+
+async def compare(name: str, path: str, model, docs: list, rounds: int, sparse: str):
+    field = route_field(path)
+    print(f"{name} ({len(docs)} items)")
+
+    async def before():
+        content = await serialize_response(field=field, response_content=docs, is_coroutine=True)
+        return JSONResponse(content)
+
+    async def after(fields=None):
+        return fast_response(shape(model, docs, parse_fields(model, fields)))
+
+    slow = await timed("before (validate + json)", rounds, before)
+    fast = await timed("after (shape + orjson)", rounds, after)
+    print(f"  speedup {slow / fast:.1f}x")
+    if sparse:
+        sparse_time = await timed(f"after, fields={sparse}", rounds, lambda: after(sparse))
+        print(f"  speedup {slow / sparse_time:.1f}x")
+
+
+async def run(items: int, rounds: int):
+    random.seed(1)
+    await compare("Products", "/api/products", server.Product, synthetic_products(items), rounds,
+                  "id,title,price,images")
+    await compare("Orders", "/api/orders/my", server.Order, synthetic_orders(items), rounds, "id,total,status,created_at")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--items", type=int, default=100)
+    parser.add_argument("--rounds", type=int, default=200)
+    args = parser.parse_args()
+    asyncio.run(run(args.items, args.rounds))
@@ -0,0 +1,77 @@
+"""
+Benchmark: item-to-item similarity build over synthetic order history
+Users draw products mostly from one "taste" cluster, so a good neighbour list
+stays inside the product's cluster. Baskets are fed exactly as the server job
+feeds them: one basket of purchased ids per user, plus favorites and views.
+
+Usage: python bench_similarity.py [--orders 1000000] [--users 250000] [--products 50000]
+"""
+import argparse
+import random
+import time
+
+import numpy as np
+
+from similarity import SIGNAL_WEIGHTS, CooccurrenceBuilder, iter_neighbors
+
+CLUSTERS = 500
+
+
+def synthetic_baskets(orders: int, users: int, products: int, rng: np.random.Generator):
+    cluster_size = products // CLUSTERS
+    taste = rng.integers(0, CLUSTERS, size=users)
+    owners = rng.integers(0, users, size=orders)
+    sizes = rng.integers(1, 4, size=orders)
+
+    def pick(user: int) -> str:
+        cluster = taste[user] if random.random() < 0.8 else random.randrange(CLUSTERS)
+        # Zipf-ish popularity inside the cluster
+        offset = min(int(random.paretovariate(1.2)) - 1, cluster_size - 1)
+        return f"p{cluster * cluster_size + offset}"
+
+    purchases = {}
+    for user, size in zip(owners.tolist(), sizes.tolist()):
+        purchases.setdefault(user, []).extend(pick(user) for _ in range(size))
+    favorites = [[pick(user) for _ in range(random.randint(1, 5))] for user in range(0, users, 3)]
+    views = [[pick(user) for _ in range(random.randint(3, 20))] for user in range(0, users, 2)]
+    return list(purchases.values()), favorites, views, cluster_size
+
+
+def run(orders: int, users: int, products: int, batch: int):
+    random.seed(7)
+    rng = np.random.default_rng(7)
+    started = time.perf_counter()
+    purchases, favorites, views, cluster_size = synthetic_baskets(orders, users, products, rng)
+    print(f"Generated: {orders:,} orders for {len(purchases):,} buyers in {time.perf_counter() - started:.1f} s")
+
+    builder = CooccurrenceBuilder()
+    started = time.perf_counter()
+    for baskets, signal in ((purchases, "purchase"), (favorites, "favorite"), (views, "view")):
+        for i in range(0, len(baskets), batch):
+            builder.add_baskets(baskets[i:i + batch], SIGNAL_WEIGHTS[signal])
+    accumulated = time.perf_counter() - started
+    built = builder.finish()
+    total = time.perf_counter() - started
+    print(f"Build:     {total:.1f} s ({accumulated:.1f} s accumulating pairs, {total - accumulated:.1f} s top-K)")
+
+    started = time.perf_counter()
+    lists = list(iter_neighbors(built))
+    print(f"Export:    {len(lists):,} neighbour lists in {time.perf_counter() - started:.1f} s")
+
+    same_cluster = checked = 0
+    for product_id, neighbors in lists:
+        cluster = int(product_id[1:]) // cluster_size
+        for neighbor in neighbors[:5]:
+            checked += 1
+            same_cluster += int(neighbor["product_id"][1:]) // cluster_size == cluster
+    print(f"Quality:   {same_cluster / max(checked, 1):.1%} of top-5 neighbours share the product's cluster")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--orders", type=int, default=1_000_000)
+    parser.add_argument("--users", type=int, default=250_000)
+    parser.add_argument("--products", type=int, default=50_000)
+    parser.add_argument("--batch", type=int, default=5000)
+    args = parser.parse_args()
+    run(args.orders, args.users, args.products, args.batch)
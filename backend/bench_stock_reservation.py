@@ -0,0 +1,125 @@
+"""
+Benchmark: concurrent checkouts against a handful of hot products
+Buyers race to reserve carts of the same few products; some pay, some cancel
+and the rest walk away and are swept when their hold expires. At the end
+every unit must be either sold or back in stock, and no stock may go negative.
+Runs against MONGO_URL in a throwaway `<DB_NAME>_bench` database.
+
+Usage: python bench_stock_reservation.py [--buyers 5000] [--products 5] [--stock 500] [--concurrency 200]
+"""
+import argparse
+import asyncio
+import os
+import random
+import time
+from pathlib import Path
+
+from dotenv import load_dotenv
+from motor.motor_asyncio import AsyncIOMotorClient
+
+from reservations import OutOfStock, StockReservations
+
+load_dotenv(Path(__file__).parent / '.env')
+os.environ.setdefault('MONGO_URL', 'mongodb://localhost:27017')
+os.environ.setdefault('DB_NAME', 'test_database')
+
+
+async def run(buyers: int, products: int, stock: int, concurrency: int, ttl: float):
+    client = AsyncIOMotorClient(os.environ['MONGO_URL'], tz_aware=True)
+    bench_db = f"{os.environ['DB_NAME']}_bench"
+    db = client[bench_db]
+    await db.products.drop()
+    await db.stock_reservations.drop()
+    await db.products.create_index("id", unique=True)
+    await db.stock_reservations.create_index("order_id", unique=True)
+    await db.stock_reservations.create_index([("status", 1), ("expires_at", 1)])
+
+    product_ids = [f"hot-{i}" for i in range(products)]
+    await db.products.insert_many([
+        {"id": product_id, "stock": stock, "sales_count": 0} for product_id in product_ids
+    ])
+    reservations = StockReservations(ttl_seconds=ttl)
+
+    outcomes = {"paid": 0, "cancelled": 0, "abandoned": 0, "rejected": 0}
+    sold_units = 0
+    shortfall_units = 0
+    latencies = []
+    slots = asyncio.Semaphore(concurrency)
+
+    async def checkout(buyer: int):
+        nonlocal sold_units, shortfall_units
+        cart = {
+            product_id: random.randint(1, 2)
+            for product_id in random.sample(product_ids, random.randint(1, min(3, products)))
+        }
+        order_id = f"order-{buyer}"
+        async with slots:
+            started = time.perf_counter()
+            try:
+                await reservations.reserve(db, order_id, f"user-{buyer}", cart)
+            except OutOfStock:
+                outcomes["rejected"] += 1
+                return
+            finally:
+                latencies.append(time.perf_counter() - started)
+
+        fate = random.random()
+        if fate < 0.6:
+            await asyncio.sleep(random.uniform(0, ttl / 4))
+            items = [{"product_id": pid, "quantity": qty} for pid, qty in cart.items()]
+            conversion = await reservations.convert(db, order_id, items)
+            # A duplicate payment notification must not sell the cart twice
+            assert await reservations.convert(db, order_id, items) is None
+            shortfall_units += sum(conversion.shortfall.values())
+            sold_units += sum(cart.values()) - sum(conversion.shortfall.values())
+            outcomes["paid"] += 1
+        elif fate < 0.75:
+            await reservations.release(db, order_id)
+            outcomes["cancelled"] += 1
+        else:
+            outcomes["abandoned"] += 1
+
+    async def sweeper():
+        while True:
+            await asyncio.sleep(ttl / 4)
+            await reservations.sweep(db)
+
+    sweeping = asyncio.create_task(sweeper())
+    started = time.perf_counter()
+    await asyncio.gather(*(checkout(buyer) for buyer in range(buyers)))
+    elapsed = time.perf_counter() - started
+    await asyncio.sleep(ttl)
+    sweeping.cancel()
+    await reservations.sweep(db)
+
+    docs = await db.products.find({}, {"_id": 0}).to_list(products)
+    final_stock = sum(doc["stock"] for doc in docs)
+    recorded_sales = sum(doc["sales_count"] for doc in docs)
+    active = await db.stock_reservations.count_documents({"status": "active"})
+    negative = [doc["id"] for doc in docs if doc["stock"] < 0]
+    latencies.sort()
+
+    print(f"Checkouts:         {buyers} buyers over {products} products x {stock} units (concurrency {concurrency})")
+    print(f"Elapsed:           {elapsed:.2f} s ({buyers / elapsed:,.0f} checkouts/s)")
+    print(f"Reserve p50/p99:   {latencies[len(latencies) // 2] * 1000:.1f} / {latencies[int(len(latencies) * 0.99)] * 1000:.1f} ms")
+    print(f"Outcomes:          {outcomes}")
+    print(f"Units sold:        {sold_units} (sales_count says {recorded_sales}), shortfall {shortfall_units}")
+    print(f"Units in stock:    {final_stock} of {products * stock}")
+    print(f"Open holds:        {active}")
+
+    await client.drop_database(bench_db)
+    client.close()
+    if negative or final_stock + sold_units != products * stock or recorded_sales != sold_units + shortfall_units or active:
+        raise SystemExit("❌ Stock accounting is off (oversold or leaked units)")
+    print("✅ No oversell: every unit is either sold or back in stock")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--buyers", type=int, default=5000)
+    parser.add_argument("--products", type=int, default=5)
+    parser.add_argument("--stock", type=int, default=500)
+    parser.add_argument("--concurrency", type=int, default=200)
+    parser.add_argument("--ttl", type=float, default=2.0, help="reservation TTL in seconds")
+    args = parser.parse_args()
+    asyncio.run(run(args.buyers, args.products, args.stock, args.concurrency, args.ttl))
@@ -0,0 +1,89 @@
+"""
+Benchmark: concurrent redemption of Telegram bot login tokens
+Every token is raced by several clients at once; exactly one redemption per
+token may succeed. Runs against MONGO_URL in a throwaway `<DB_NAME>_bench` database.
+
+Usage: python bench_telegram_tokens.py [--tokens 2000] [--contenders 4] [--concurrency 200]
+"""
+import argparse
+import asyncio
+import os
+import random
+import secrets
+import time
+from collections import Counter
+from datetime import datetime, timezone, timedelta
+
+os.environ.setdefault('MONGO_URL', 'mongodb://localhost:27017')
+os.environ.setdefault('DB_NAME', 'test_database')
+os.environ.setdefault('STRIPE_API_KEY', 'sk_test_bench')
+
+import server  # noqa: E402
+
+
+async def run(tokens: int, contenders: int, concurrency: int):
+    bench_db = f"{os.environ['DB_NAME']}_bench"
+    server.db = server.client[bench_db]
+    collection = server.db.telegram_auth_tokens
+    await collection.drop()
+    await collection.create_index("token", unique=True)
+    await collection.create_index("expires_at", expireAfterSeconds=0)
+
+    expires_at = datetime.now(timezone.utc) + timedelta(minutes=5)
+    token_values = [secrets.token_urlsafe(32) for _ in range(tokens)]
+    await collection.insert_many([
+        {
+            "token": token,
+            "user_id": f"bench-user-{i}",
+            "telegram_id": i,
+            "created_at": datetime.now(timezone.utc).isoformat(),
+            "expires_at": expires_at,
+            "used": False
+        }
+        for i, token in enumerate(token_values)
+    ])
+
+    attempts = [token for token in token_values for _ in range(contenders)]
+    random.shuffle(attempts)
+
+    wins = Counter()
+    latencies = []
+    slots = asyncio.Semaphore(concurrency)
+
+    async def redeem(token: str):
+        async with slots:
+            started = time.perf_counter()
+            doc = await server.consume_bot_token(token)
+            latencies.append(time.perf_counter() - started)
+            if doc:
+                wins[token] += 1
+
+    started = time.perf_counter()
+    await asyncio.gather(*(redeem(token) for token in attempts))
+    elapsed = time.perf_counter() - started
+
+    latencies.sort()
+    double_redeemed = sum(1 for count in wins.values() if count > 1)
+    never_redeemed = tokens - len(wins)
+
+    print(f"Tokens:            {tokens} x {contenders} contenders ({len(attempts)} attempts, concurrency {concurrency})")
+    print(f"Elapsed:           {elapsed:.2f} s")
+    print(f"Attempts/s:        {len(attempts) / elapsed:,.0f}")
+    print(f"Redemptions/s:     {sum(wins.values()) / elapsed:,.0f}")
+    print(f"Latency p50/p99:   {latencies[len(latencies) // 2] * 1000:.1f} / {latencies[int(len(latencies) * 0.99)] * 1000:.1f} ms")
+    print(f"Double redeemed:   {double_redeemed}")
+    print(f"Never redeemed:    {never_redeemed}")
+
+    await server.client.drop_database(bench_db)
+    if double_redeemed or never_redeemed:
+        raise SystemExit("❌ Token redemption is not exactly-once")
+    print("✅ Every token redeemed exactly once")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--tokens", type=int, default=2000)
+    parser.add_argument("--contenders", type=int, default=4)
+    parser.add_argument("--concurrency", type=int, default=200)
+    args = parser.parse_args()
+    asyncio.run(run(args.tokens, args.contenders, args.concurrency))
@@ -0,0 +1,221 @@
+"""
+Streaming product import/export for GameHub Marketplace
+Uploads are parsed line by line as they arrive, so a seller's catalogue of
+thousands of keys never sits in memory as one body; exports are written the
+same way, one row per product straight from the database cursor.
+"""
+import codecs
+import csv
+import io
+import json
+from datetime import datetime
+from typing import AsyncIterator, Iterable, List, Optional, Tuple
+
+import orjson
+
+FORMATS = ("ndjson", "csv")
+CONTENT_TYPES = {"ndjson": "application/x-ndjson", "csv": "text/csv; charset=utf-8"}
+# Multi-valued CSV cells are joined with this separator
+LIST_FIELDS = {"images"}
+LIST_SEPARATOR = "|"
+# Longest line (and CSV record, quoted newlines included) read before it's reported as a bad row
+MAX_LINE_CHARS = 1024 * 1024
+
+
+class ImportFormatError(ValueError):
+    """The upload can't be read at all (as opposed to a single bad row)"""
+
+
+def detect_format(content_type: Optional[str], requested: Optional[str] = None) -> str:
+    if requested:
+        if requested not in FORMATS:
+            raise ImportFormatError(f"Unknown format: {requested}")
+        return requested
+    media_type = (content_type or "").split(";")[0].strip().lower()
+    if media_type in ("text/csv", "application/csv"):
+        return "csv"
+    if media_type in ("application/x-ndjson", "application/jsonl", "application/json-seq", "application/ndjson"):
+        return "ndjson"
+    raise ImportFormatError("Send text/csv or application/x-ndjson, or pass ?format=csv|ndjson")
+
+
+async def iter_lines(chunks: AsyncIterator[bytes], max_line: int = MAX_LINE_CHARS) -> AsyncIterator[Optional[str]]:
+    """Decode a UTF-8 byte stream into lines without buffering the whole body.
+
+    A line longer than ``max_line`` characters is dropped as it streams in
+    and yielded as None, so a body without newlines can't fill memory.
+    """
+    decoder = codecs.getincrementaldecoder("utf-8-sig")()
+    pending, oversized = "", False
+    async for chunk in chunks:
+        try:
+            pending += decoder.decode(chunk)
+        except UnicodeDecodeError:
+            raise ImportFormatError("Upload is not valid UTF-8")
+        *lines, pending = pending.split("\n")
+        for line in lines:
+            if oversized or len(line) > max_line:
+                oversized = False
+                yield None
+            else:
+                yield line.removesuffix("\r")
+        if len(pending) > max_line:
+            pending, oversized = "", True
+    pending += decoder.decode(b"", final=True)
+    if oversized or len(pending) > max_line:
+        yield None
+    elif pending:
+        yield pending.removesuffix("\r")
+
+
+async def iter_ndjson_rows(lines: AsyncIterator[Optional[str]]) -> AsyncIterator[Tuple[int, Optional[dict], Optional[str]]]:
+    """(row number, object, error) for each non-blank line"""
+    row = 0
+    async for line in lines:
+        if line is None:
+            row += 1
+            yield row, None, f"Line longer than {MAX_LINE_CHARS} characters"
+            continue
+        if not line.strip():
+            continue
+        row += 1
+        try:
+            value = json.loads(line)
+        except ValueError as e:
+            yield row, None, f"Invalid JSON: {e}"
+            continue
+        if not isinstance(value, dict):
+            yield row, None, "Each line must be a JSON object"
+            continue
+        yield row, value, None
+
+
+def _csv_value(field: str, value: str):
+    if field in LIST_FIELDS:
+        return [item.strip() for item in value.split(LIST_SEPARATOR) if item.strip()]
+    return value
+
+
+# Where csv's reader (excel dialect) stands within a record
+_START, _FIELD, _QUOTED, _QUOTE_IN_QUOTED = range(4)
+
+
+def _quote_state(line: str, state: int) -> int:
+    """The reader's state after ``line`` given its state before it. A quote
+    opens a field only at the field's start; anywhere else it's a literal
+    character. The record runs on past the line only while still _QUOTED."""
+    if '"' not in line:
+        return state if state == _QUOTED or not line else _FIELD
+    for char in line:
+        if state == _QUOTED:
+            if char == '"':
+                state = _QUOTE_IN_QUOTED
+        elif char == ",":
+            state = _START
+        elif char == '"' and state != _FIELD:
+            state = _QUOTED  # an opening quote, or the second half of an escaped ""
+        else:
+            state = _FIELD
+    return state
+
+
+async def iter_csv_rows(lines: AsyncIterator[Optional[str]],
+                        max_record: int = MAX_LINE_CHARS) -> AsyncIterator[Tuple[int, Optional[dict], Optional[str]]]:
+    """(row number, object, error) for each CSV record after the header.
+
+    Lines are gathered into a record while a quoted cell is open, tracking
+    the quoting the way csv's reader does, which then parses the record. A
+    record over ``max_record`` characters is reported as one bad row.
+    Empty cells are left out so that model defaults apply (list cells become []).
+    """
+    header = None
+    row = 0
+    record: List[str] = []
+    size, state = 0, _START
+    async for line in lines:
+        if line is not None:
+            record.append(line)
+            size += len(line) + 1
+            state = _quote_state(line, state if state == _QUOTED else _START)
+        if line is None or size > max_record:
+            if header is None:
+                raise ImportFormatError(f"CSV header longer than {max_record} characters")
+            record, size, state = [], 0, _START
+            row += 1
+            yield row, None, f"Record longer than {max_record} characters"
+            continue
+        if state == _QUOTED:
+            continue
+        text, record, size = "\n".join(record), [], 0
+        if not text.strip():
+            continue
+        try:
+            [cells] = list(csv.reader(io.StringIO(text)))
+        except (csv.Error, ValueError) as e:
+            if header is None:
+                raise ImportFormatError(f"Unreadable CSV header: {e}")
+            row += 1
+            yield row, None, f"Invalid CSV: {e}"
+            continue
+        if header is None:
+            header = [cell.strip() for cell in cells]
+            continue
+        row += 1
+        if len(cells) > len(header):
+            yield row, None, f"Expected {len(header)} columns, got {len(cells)}"
+            continue
+        yield row, {
+            field: _csv_value(field, value)
+            for field, value in zip(header, cells)
+            if field and (value != "" or field in LIST_FIELDS)
+        }, None
+    if record:
+        row += 1
+        yield row, None, "Unterminated quoted field"
+
+
+def read_rows(fmt: str, chunks: AsyncIterator[bytes]) -> AsyncIterator[Tuple[int, Optional[dict], Optional[str]]]:
+    lines = iter_lines(chunks)
+    return iter_csv_rows(lines) if fmt == "csv" else iter_ndjson_rows(lines)
+
+
+def _csv_cell(value) -> str:
+    if value is None:
+        return ""
+    if isinstance(value, list):
+        return LIST_SEPARATOR.join(str(item) for item in value)
+    if isinstance(value, datetime):
+        return value.isoformat()
+    return str(value)
+
+
+async def _encode_rows(fmt: str, docs: AsyncIterator[dict], fields: List[str]) -> AsyncIterator[bytes]:
+    if fmt == "ndjson":
+        async for doc in docs:
+            yield orjson.dumps({field: doc.get(field) for field in fields}) + b"\n"
+        return
+
+    buffer = io.StringIO()
+    writer = csv.writer(buffer, lineterminator="\n")
+    writer.writerow(fields)
+    async for doc in docs:
+        writer.writerow([_csv_cell(doc.get(field)) for field in fields])
+        yield buffer.getvalue().encode("utf-8")
+        buffer.seek(0)
+        buffer.truncate()
+    if buffer.tell():  # header only: the catalogue is empty
+        yield buffer.getvalue().encode("utf-8")
+
+
+async def export_rows(fmt: str, docs: AsyncIterator[dict], fields: Iterable[str],
+                      chunk_bytes: int = 64 * 1024) -> AsyncIterator[bytes]:
+    """Encode documents row by row, sent in chunks of roughly ``chunk_bytes``"""
+    pending, size = [], 0
+    async for row in _encode_rows(fmt, docs, list(fields)):
+        pending.append(row)
+        size += len(row)
+        if size >= chunk_bytes:
+            yield b"".join(pending)
+            pending, size = [], 0
+    if pending:
+        yield b"".join(pending)
@@ -0,0 +1,80 @@
+"""
+Fast JSON list responses for GameHub Marketplace
+Documents read from Mongo were written through the API models already, so list
+endpoints project them to the model's fields and encode them with orjson
+instead of revalidating every row against ``response_model``.
+"""
+from functools import lru_cache
+from typing import Any, Dict, Iterable, List, Optional, Tuple, Type
+
+import orjson
+from fastapi import Response
+from fastapi.responses import ORJSONResponse
+from pydantic import BaseModel
+
+# Headers FastAPI's injected ``response`` carries that must not leak onto the real one
+_RESPONSE_OWN_HEADERS = {"content-length", "content-type"}
+
+
+class UTCZResponse(ORJSONResponse):
+    """ORJSONResponse writing UTC datetimes with a "Z" suffix, as pydantic does,
+    so an endpoint's timestamps read the same whichever path serves them"""
+
+    def render(self, content: Any) -> bytes:
+        return orjson.dumps(
+            content, option=orjson.OPT_NON_STR_KEYS | orjson.OPT_SERIALIZE_NUMPY | orjson.OPT_UTC_Z
+        )
+
+
+@lru_cache(maxsize=None)
+def model_defaults(model: Type[BaseModel]) -> Dict[str, object]:
+    """What validation would fill in for fields missing from an older document"""
+    return {
+        name: field.get_default(call_default_factory=True)
+        for name, field in model.model_fields.items()
+        if not field.is_required()
+    }
+
+
+def parse_fields(model: Type[BaseModel], fields: Optional[str]) -> Tuple[str, ...]:
+    """The model's fields, or the sparse subset asked for by ``?fields=a,b``.
+
+    Raises ValueError naming any field the model doesn't have.
+    """
+    if not fields:
+        return tuple(model.model_fields)
+    names = tuple(dict.fromkeys(name.strip() for name in fields.split(",") if name.strip()))
+    unknown = [name for name in names if name not in model.model_fields]
+    if unknown or not names:
+        raise ValueError(f"Unknown fields: {', '.join(unknown)}" if unknown else "No fields requested")
+    return names
+
+
+def fields_projection(fields: Iterable[str], *required: str) -> dict:
+    """Mongo projection for ``fields`` plus anything the handler itself reads (sort keys, ids)"""
+    return {"_id": 0, **{name: 1 for name in (*fields, *required)}}
+
+
+def shape(model: Type[BaseModel], docs: List[dict], fields: Tuple[str, ...]) -> List[dict]:
+    """Trim documents to ``fields``, filling model defaults for keys older rows lack"""
+    defaults = model_defaults(model)
+    shaped = []
+    for doc in docs:
+        row = {}
+        for name in fields:
+            if name in doc:
+                row[name] = doc[name]
+            elif name in defaults:
+                row[name] = defaults[name]
+        shaped.append(row)
+    return shaped
+
+
+def fast_response(content, response: Optional[Response] = None) -> UTCZResponse:
+    """Encode with orjson, keeping headers a handler already set on its injected ``response``"""
+    headers = None
+    if response is not None:
+        headers = {
+            key: value for key, value in response.headers.items() if key not in _RESPONSE_OWN_HEADERS
+        }
+    return UTCZResponse(content, headers=headers)
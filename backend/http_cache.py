@@ -0,0 +1,123 @@
+"""
+HTTP conditional requests for GameHub Marketplace
+Public read endpoints keep their serialized JSON body in memory next to a
+content-hash ETag, so a matching If-None-Match is answered with 304 before
+any database read or serialization, and a 200 is just the cached bytes.
+"""
+import hashlib
+from datetime import datetime, timezone
+from email.utils import format_datetime, parsedate_to_datetime
+from typing import Awaitable, Callable, Dict, NamedTuple, Optional, Tuple
+
+from cachetools import LRUCache, TTLCache
+from fastapi import Request, Response
+from fastapi.encoders import jsonable_encoder
+from fastapi.responses import JSONResponse
+
+
+class CachedBody(NamedTuple):
+    body: bytes
+    etag: str
+    last_modified: datetime
+    headers: Dict[str, str]
+
+
+def content_etag(body: bytes) -> str:
+    return '"' + hashlib.blake2b(body, digest_size=16).hexdigest() + '"'
+
+
+def etag_matches(if_none_match: str, etag: str) -> bool:
+    """Weak comparison, as RFC 9110 requires for If-None-Match"""
+    if if_none_match.strip() == "*":
+        return True
+    bare = etag.removeprefix("W/")
+    return any(tag.strip().removeprefix("W/") == bare for tag in if_none_match.split(","))
+
+
+def is_not_modified(request: Request, etag: str, last_modified: datetime) -> bool:
+    if_none_match = request.headers.get("if-none-match")
+    if if_none_match is not None:
+        return etag_matches(if_none_match, etag)
+    if_modified_since = request.headers.get("if-modified-since")
+    if if_modified_since:
+        try:
+            since = parsedate_to_datetime(if_modified_since)
+        except (TypeError, ValueError):
+            return False
+        if since.tzinfo is None:
+            since = since.replace(tzinfo=timezone.utc)
+        return last_modified.replace(microsecond=0) <= since
+    return False
+
+
+def validator_headers(etag: str, last_modified: datetime, cache_control: str) -> Dict[str, str]:
+    return {
+        "ETag": etag,
+        "Last-Modified": format_datetime(last_modified.astimezone(timezone.utc), usegmt=True),
+        "Cache-Control": cache_control
+    }
+
+
+def conditional_response(request: Request, body: Optional[bytes], etag: str, last_modified: datetime,
+                         cache_control: str, extra_headers: Optional[Dict[str, str]] = None,
+                         render: Optional[Callable[[], bytes]] = None) -> Response:
+    """304 if the client's copy is current, else the body (rendered lazily if needed)"""
+    headers = {**(extra_headers or {}), **validator_headers(etag, last_modified, cache_control)}
+    if is_not_modified(request, etag, last_modified):
+        return Response(status_code=304, headers=headers)
+    return Response(content=body if body is not None else render(), media_type="application/json", headers=headers)
+
+
+def render_json(content) -> bytes:
+    # Same bytes FastAPI would produce for a plain JSON response
+    return JSONResponse(content=jsonable_encoder(content)).body
+
+
+class ResponseCache:
+    """Serialized bodies keyed by ``(namespace, *params)``.
+
+    Writers call ``invalidate(namespace)``; the TTL bounds staleness from
+    writes made by other backend instances. Last-Modified only moves when
+    the content hash changes.
+    """
+
+    def __init__(self, maxsize: int = 1024, ttl: float = 30):
+        self._entries = TTLCache(maxsize=maxsize, ttl=ttl)
+        self._validators = LRUCache(maxsize=maxsize)  # key -> (etag, last_modified), outlives the TTL
+        self._generations: Dict[str, int] = {}
+        self.stats = {"hits": 0, "misses": 0, "not_modified": 0, "invalidations": 0}
+
+    async def respond(self, request: Request, key: Tuple, cache_control: str,
+                      build: Callable[[], Awaitable[Tuple[object, Dict[str, str]]]]) -> Response:
+        """Answer from the cache, building (content, extra headers) on a miss"""
+        entry = self._entries.get(key)
+        if entry is None:
+            self.stats["misses"] += 1
+            generation = self._generations.get(key[0], 0)
+            content, extra_headers = await build()
+            body = render_json(content)
+            etag = content_etag(body)
+            previous = self._validators.get(key)
+            last_modified = previous[1] if previous and previous[0] == etag else datetime.now(timezone.utc)
+            entry = CachedBody(body, etag, last_modified, extra_headers)
+            if generation == self._generations.get(key[0], 0):
+                self._entries[key] = entry
+                self._validators[key] = (etag, last_modified)
+        else:
+            self.stats["hits"] += 1
+
+        response = conditional_response(
+            request, entry.body, entry.etag, entry.last_modified, cache_control, entry.headers
+        )
+        if response.status_code == 304:
+            self.stats["not_modified"] += 1
+        return response
+
+    def invalidate(self, namespace: str):
+        self._generations[namespace] = self._generations.get(namespace, 0) + 1
+        for key in [key for key in list(self._entries.keys()) if key[0] == namespace]:
+            self._entries.pop(key, None)
+        self.stats["invalidations"] += 1
+
+    def metrics(self) -> dict:
+        return {**self.stats, "size": len(self._entries), "ttl_seconds": self._entries.ttl}
@@ -0,0 +1,132 @@
+"""
+Migration: convert ISO-string timestamps to native BSON dates
+Runs online in batches. Each update is guarded by the old string value, so a
+row the server rewrote in the meantime is left alone, and re-running the
+script picks up whatever is still a string.
+
+Usage: python migrate_datetimes.py [--batch 1000] [--pause 0.05] [--dry-run]
+"""
+import argparse
+import asyncio
+import os
+from datetime import datetime, timezone
+from pathlib import Path
+
+from dotenv import load_dotenv
+from motor.motor_asyncio import AsyncIOMotorClient
+from pymongo import UpdateOne
+
+ROOT_DIR = Path(__file__).parent
+load_dotenv(ROOT_DIR / '.env')
+
+# collection -> top-level fields that used to be written with .isoformat()
+DATE_FIELDS = {
+    "users": ["created_at"],
+    "products": ["created_at", "updated_at"],
+    "orders": ["created_at"],
+    "transactions": ["created_at"],
+    "payment_transactions": ["created_at", "updated_at"],
+    "favorites": ["created_at"],
+    "blog_posts": ["published_at"],
+    "giveaways": ["end_date"],
+    "chats": ["created_at", "last_message_at"],
+    "chat_messages": ["created_at"],
+    "telegram_auth_tokens": ["created_at"],
+}
+
+
+def parse_date(value: str) -> datetime:
+    parsed = datetime.fromisoformat(value)
+    # Naive strings were always written as UTC
+    return parsed if parsed.tzinfo else parsed.replace(tzinfo=timezone.utc)
+
+
+def field_update(doc: dict, fields: list):
+    """Guarded $set for the string fields of one document, or None if it can't be parsed"""
+    guard, changes = {"_id": doc["_id"]}, {}
+    for field in fields:
+        value = doc.get(field)
+        if not isinstance(value, str):
+            continue
+        try:
+            changes[field] = parse_date(value)
+        except ValueError:
+            return None
+        guard[field] = value
+    return UpdateOne(guard, {"$set": changes}) if changes else None
+
+
+def message_update(doc: dict):
+    """Convert sent_at inside the legacy embedded `chats.messages` array"""
+    changes, array_filters = {}, []
+    for message in doc.get("messages") or []:
+        value = message.get("sent_at")
+        if not isinstance(value, str) or "id" not in message:
+            continue
+        try:
+            sent_at = parse_date(value)
+        except ValueError:
+            continue
+        name = f"m{len(array_filters)}"
+        changes[f"messages.$[{name}].sent_at"] = sent_at
+        array_filters.append({f"{name}.id": message["id"], f"{name}.sent_at": value})
+    if not changes:
+        return None
+    return UpdateOne({"_id": doc["_id"]}, {"$set": changes}, array_filters=array_filters)
+
+
+async def convert(collection, query: dict, projection: dict, build, batch_size: int, pause: float,
+                  dry_run: bool) -> tuple:
+    """Walk ``query`` in _id order, writing one unordered bulk per batch"""
+    converted = skipped = 0
+    last_id = None
+    while True:
+        page_query = query if last_id is None else {"$and": [query, {"_id": {"$gt": last_id}}]}
+        docs = await collection.find(page_query, projection).sort("_id", 1).limit(batch_size).to_list(batch_size)
+        if not docs:
+            return converted, skipped
+        last_id = docs[-1]["_id"]
+        updates = []
+        for doc in docs:
+            update = build(doc)
+            if update is None:
+                skipped += 1
+            else:
+                updates.append(update)
+        if updates and not dry_run:
+            result = await collection.bulk_write(updates, ordered=False)
+            converted += result.modified_count
+        else:
+            converted += len(updates)
+        if pause:
+            await asyncio.sleep(pause)
+
+
+async def migrate(batch_size: int, pause: float, dry_run: bool):
+    client = AsyncIOMotorClient(os.environ['MONGO_URL'], tz_aware=True)
+    db = client[os.environ['DB_NAME']]
+
+    for name, fields in DATE_FIELDS.items():
+        query = {"$or": [{field: {"$type": "string"}} for field in fields]}
+        projection = {field: 1 for field in fields}
+        converted, skipped = await convert(
+            db[name], query, projection, lambda doc, fields=fields: field_update(doc, fields),
+            batch_size, pause, dry_run
+        )
+        print(f"{name}: converted {converted} documents" + (f", skipped {skipped} unparseable" if skipped else ""))
+
+    converted, _ = await convert(
+        db.chats, {"messages.sent_at": {"$type": "string"}}, {"messages.id": 1, "messages.sent_at": 1},
+        message_update, batch_size, pause, dry_run
+    )
+    print(f"chats.messages: converted {converted} documents")
+    client.close()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--batch", type=int, default=1000)
+    parser.add_argument("--pause", type=float, default=0.05, help="seconds to sleep between batches")
+    parser.add_argument("--dry-run", action="store_true", help="count what would change without writing")
+    args = parser.parse_args()
+    asyncio.run(migrate(args.batch, args.pause, args.dry_run))
@@ -0,0 +1,81 @@
+"""
+Migration: open every user's ledger account at their current balance
+Balances from before the ledger have no entries behind them. For each user
+this posts one `opening` entry (equity:opening -> user:<id>) for whatever
+users.balance holds beyond the ledger's lines, so the verifier starts from zero
+mismatches. Runs online: a user with a balance change in flight, or whose
+balance moves while it is being read, is skipped and picked up by a re-run.
+
+Usage: python migrate_ledger.py [--batch 1000] [--pause 0.05] [--dry-run]
+"""
+import argparse
+import asyncio
+import os
+from pathlib import Path
+
+from dotenv import load_dotenv
+from motor.motor_asyncio import AsyncIOMotorClient
+
+from ledger import TOLERANCE, Ledger, user_account
+
+ROOT_DIR = Path(__file__).parent
+load_dotenv(ROOT_DIR / '.env')
+
+OPENING_ACCOUNT = "equity:opening"
+
+
+async def migrate(batch_size: int, pause: float, dry_run: bool):
+    client = AsyncIOMotorClient(os.environ['MONGO_URL'], tz_aware=True)
+    db = client[os.environ['DB_NAME']]
+    ledger = Ledger()
+    await db.ledger_entries.create_index([("entry_id", 1), ("account", 1)], unique=True)
+    await db.ledger_entries.create_index([("account", 1), ("created_at", 1)])
+
+    opened = already = skipped = 0
+    last_id = None
+    while True:
+        query = {"id": {"$gt": last_id}} if last_id is not None else {}
+        users = await db.users.find(
+            query, {"_id": 0, "id": 1, "balance": 1, "pending_transactions": 1}
+        ).sort("id", 1).limit(batch_size).to_list(batch_size)
+        if not users:
+            break
+        last_id = users[-1]["id"]
+
+        for user in users:
+            account = user_account(user["id"])
+            entry_id = f"opening:{user['id']}"
+            if await db.ledger_entries.count_documents({"entry_id": entry_id}, limit=1):
+                already += 1
+                continue
+            if user.get("pending_transactions"):
+                skipped += 1
+                continue
+            balance = user.get("balance", 0.0)
+            opening = round(balance - await ledger.balance_as_of(db, account), 2)
+            # The balance must not have moved, or started moving, while the ledger was read
+            unchanged = await db.users.count_documents(
+                {"id": user["id"], "balance": balance, "pending_transactions.0": {"$exists": False}}, limit=1
+            )
+            if not unchanged:
+                skipped += 1
+                continue
+            if abs(opening) <= TOLERANCE:
+                continue
+            if not dry_run:
+                await ledger.transfer(db, entry_id, "opening", OPENING_ACCOUNT, account, opening)
+            opened += 1
+        await asyncio.sleep(pause)
+
+    verb = "would open" if dry_run else "opened"
+    print(f"users: {verb} {opened} accounts, {already} already open, {skipped} busy (re-run to pick them up)")
+    client.close()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--batch", type=int, default=1000)
+    parser.add_argument("--pause", type=float, default=0.05, help="seconds to sleep between batches")
+    parser.add_argument("--dry-run", action="store_true", help="count what would change without writing")
+    args = parser.parse_args()
+    asyncio.run(migrate(args.batch, args.pause, args.dry_run))
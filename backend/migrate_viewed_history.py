@@ -0,0 +1,93 @@
+"""
+Migration: compact `viewed_products` into per-user `recently_viewed` rings
+Streams the old history in (user_id, viewed_at desc) order and keeps each
+user's last N distinct products. Rings already written by the new endpoint
+are newer than any old history, so their entries stay in front.
+
+Usage: python migrate_viewed_history.py [--limit 20] [--batch 1000] [--drop]
+"""
+import argparse
+import asyncio
+import os
+from datetime import datetime, timezone
+from pathlib import Path
+
+from dotenv import load_dotenv
+from motor.motor_asyncio import AsyncIOMotorClient
+from pymongo import UpdateOne
+
+ROOT_DIR = Path(__file__).parent
+load_dotenv(ROOT_DIR / '.env')
+
+
+def ring_update(user_id: str, product_ids: list, limit: int) -> UpdateOne:
+    """Append older history behind whatever the ring already holds"""
+    return UpdateOne(
+        {"user_id": user_id},
+        [{"$set": {
+            "product_ids": {"$slice": [
+                {"$concatArrays": [
+                    {"$ifNull": ["$product_ids", []]},
+                    {"$filter": {
+                        "input": {"$literal": product_ids},
+                        "cond": {"$not": [{"$in": ["$$this", {"$ifNull": ["$product_ids", []]}]}]}
+                    }}
+                ]},
+                limit
+            ]},
+            "updated_at": {"$ifNull": ["$updated_at", datetime.now(timezone.utc)]}
+        }}],
+        upsert=True
+    )
+
+
+async def migrate(limit: int, batch_size: int, drop: bool):
+    client = AsyncIOMotorClient(os.environ['MONGO_URL'])
+    db = client[os.environ['DB_NAME']]
+
+    await db.recently_viewed.create_index("user_id", unique=True)
+    # Lets the sorted scan below stream instead of sorting the whole collection in memory
+    await db.viewed_products.create_index([("user_id", 1), ("viewed_at", -1)])
+
+    users = rows = 0
+    pending = []
+    current_user, recent = None, []
+
+    async def flush():
+        if pending:
+            await db.recently_viewed.bulk_write(pending, ordered=False)
+            pending.clear()
+
+    cursor = db.viewed_products.find({}, {"_id": 0, "user_id": 1, "product_id": 1}).sort(
+        [("user_id", 1), ("viewed_at", -1)]
+    )
+    async for doc in cursor:
+        rows += 1
+        if doc["user_id"] != current_user:
+            if current_user is not None:
+                pending.append(ring_update(current_user, recent, limit))
+                users += 1
+            current_user, recent = doc["user_id"], []
+        if len(recent) < limit and doc["product_id"] not in recent:
+            recent.append(doc["product_id"])
+        if len(pending) >= batch_size:
+            await flush()
+    if current_user is not None:
+        pending.append(ring_update(current_user, recent, limit))
+        users += 1
+    await flush()
+
+    print(f"Compacted {rows} history rows into {users} recently-viewed rings")
+    if drop:
+        await db.viewed_products.drop()
+        print("Dropped viewed_products")
+    client.close()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--limit", type=int, default=int(os.environ.get('RECENTLY_VIEWED_LIMIT', '20')))
+    parser.add_argument("--batch", type=int, default=1000)
+    parser.add_argument("--drop", action="store_true", help="drop viewed_products once compacted")
+    args = parser.parse_args()
+    asyncio.run(migrate(args.limit, args.batch, args.drop))
@@ -0,0 +1,72 @@
+"""
+Outgoing notification queue for GameHub Marketplace
+Request handlers enqueue messages and return; a few background workers do the
+slow external sends (Telegram), so a buyer's payment poll never waits on them.
+"""
+import asyncio
+import logging
+import time
+from typing import Awaitable, Callable, List, Tuple
+
+logger = logging.getLogger(__name__)
+
+
+class NotificationQueue:
+    def __init__(self, send: Callable[[int, str], Awaitable[bool]], maxsize: int = 10_000, workers: int = 4):
+        self._send = send
+        self._queue: "asyncio.Queue[Tuple[int, str, float]]" = asyncio.Queue(maxsize=maxsize)
+        self._workers: List[asyncio.Task] = []
+        self.worker_count = workers
+        self.stats = {
+            "enqueued": 0,
+            "sent": 0,
+            "failed": 0,
+            "dropped": 0,
+            "last_lag_ms": 0.0,
+            "max_lag_ms": 0.0
+        }
+
+    def enqueue(self, chat_id: int, message: str) -> bool:
+        """Queue a message without waiting; drops it (and says so) if the queue is full"""
+        if not chat_id:
+            return False
+        try:
+            self._queue.put_nowait((chat_id, message, time.monotonic()))
+        except asyncio.QueueFull:
+            self.stats["dropped"] += 1
+            logger.warning(f"Notification queue full, dropped message for {chat_id}")
+            return False
+        self.stats["enqueued"] += 1
+        return True
+
+    async def _work(self):
+        while True:
+            chat_id, message, queued_at = await self._queue.get()
+            try:
+                lag_ms = (time.monotonic() - queued_at) * 1000
+                self.stats["last_lag_ms"] = round(lag_ms, 1)
+                self.stats["max_lag_ms"] = max(self.stats["max_lag_ms"], round(lag_ms, 1))
+                sent = await self._send(chat_id, message)
+                self.stats["sent" if sent else "failed"] += 1
+            except Exception as e:
+                self.stats["failed"] += 1
+                logger.error(f"Notification to {chat_id} failed: {e}")
+            finally:
+                self._queue.task_done()
+
+    def start(self):
+        self._workers = [asyncio.create_task(self._work()) for _ in range(self.worker_count)]
+
+    async def stop(self, timeout: float = 5.0):
+        """Give queued messages up to ``timeout`` seconds to go out, then stop the workers"""
+        try:
+            await asyncio.wait_for(self._queue.join(), timeout)
+        except asyncio.TimeoutError:
+            logger.warning(f"Shutting down with {self._queue.qsize()} notifications unsent")
+        for worker in self._workers:
+            worker.cancel()
+        await asyncio.gather(*self._workers, return_exceptions=True)
+        self._workers = []
+
+    def metrics(self) -> dict:
+        return {**self.stats, "queued": self._queue.qsize(), "workers": len(self._workers)}
@@ -0,0 +1,114 @@
+"""
+Keyset pagination for GameHub Marketplace
+A cursor carries the sort key of the last item on a page, so the next page is
+an index seek past that key instead of a skip over every earlier row.
+"""
+import base64
+import binascii
+import json
+from datetime import datetime
+from typing import List, Optional, Tuple
+
+
+class InvalidCursor(ValueError):
+    pass
+
+
+def _encode_value(value):
+    if isinstance(value, datetime):
+        return {"d": value.isoformat()}
+    return value
+
+
+def _decode_value(value):
+    if isinstance(value, dict):
+        if set(value) != {"d"}:
+            raise InvalidCursor("Unexpected cursor value")
+        return datetime.fromisoformat(value["d"])
+    return value
+
+
+# BSON sort order of the value types a cursor can hold. Mongo sorts across types
+# in this order but $lt/$gt only ever match values of the operand's own type.
+_TYPE_ORDER = ("null", "number", "string", "date")
+
+
+def _bson_type(value) -> str:
+    if value is None:
+        return "null"
+    if isinstance(value, datetime):
+        return "date"
+    if isinstance(value, str):
+        return "string"
+    return "number"
+
+
+def encode_cursor(values: list) -> str:
+    raw = json.dumps([_encode_value(v) for v in values], separators=(",", ":"), ensure_ascii=False)
+    return base64.urlsafe_b64encode(raw.encode("utf-8")).decode("ascii").rstrip("=")
+
+
+def decode_cursor(cursor: str) -> list:
+    try:
+        raw = base64.urlsafe_b64decode(cursor + "=" * (-len(cursor) % 4))
+        values = json.loads(raw)
+    except (ValueError, binascii.Error):
+        raise InvalidCursor("Malformed cursor")
+    if not isinstance(values, list):
+        raise InvalidCursor("Malformed cursor")
+    return [_decode_value(v) for v in values]
+
+
+class Keyset:
+    """An ordering over unique keys, e.g. ``Keyset(("created_at", -1), ("id", -1))``.
+
+    The last field must be unique so that every row has exactly one position;
+    the matching compound index makes ``after()`` a single range seek. Other
+    fields may be missing on older rows, which sort (and page) as null, or
+    hold a different type, e.g. legacy ISO-string dates next to BSON dates;
+    the cursor keeps its value's type and paging carries on into the next.
+    """
+
+    def __init__(self, *fields: Tuple[str, int]):
+        self.fields = fields
+
+    @property
+    def sort(self) -> List[Tuple[str, int]]:
+        return list(self.fields)
+
+    def after(self, query: dict, cursor: Optional[str]) -> dict:
+        """Narrow ``query`` to rows strictly after the cursor position"""
+        if not cursor:
+            return query
+        values = decode_cursor(cursor)
+        if len(values) != len(self.fields):
+            raise InvalidCursor("Cursor does not match this ordering")
+
+        clauses = []
+        for i, (field, direction) in enumerate(self.fields):
+            equal = {name: value for (name, _), value in zip(self.fields[:i], values[:i])}
+            clauses.extend({**equal, field: condition} for condition in self._past(values[i], direction, i))
+        seek = clauses[0] if len(clauses) == 1 else {"$or": clauses}
+        return {"$and": [query, seek]} if query else seek
+
+    def _past(self, value, direction: int, position: int) -> list:
+        """Conditions on one field for rows that sort after ``value``.
+
+        Past the values of its own type come whole types: those Mongo sorts
+        below it when descending, above it when ascending. A missing key
+        sorts as null, the lowest, and null is never compared with $lt/$gt.
+        The last field is unique, always set and of one type.
+        """
+        if position == len(self.fields) - 1:
+            return [{"$lt" if direction < 0 else "$gt": value}]
+        rank = _TYPE_ORDER.index(_bson_type(value))
+        later = reversed(_TYPE_ORDER[:rank]) if direction < 0 else _TYPE_ORDER[rank + 1:]
+        conditions = [] if value is None else [{"$lt" if direction < 0 else "$gt": value}]
+        return conditions + [None if name == "null" else {"$type": name} for name in later]
+
+    def next_cursor(self, items: List[dict], limit: int) -> Optional[str]:
+        """Cursor for the page after ``items``, or None if this was the last page"""
+        if not items or len(items) < limit:
+            return None
+        last = items[-1]
+        return encode_cursor([last.get(field) for field, _ in self.fields])
@@ -0,0 +1,161 @@
+"""
+Password hashing for GameHub Marketplace
+Runs bcrypt in a bounded thread pool so logins never block the event loop
+"""
+import asyncio
+import logging
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import Optional
+
+import bcrypt
+
+logger = logging.getLogger(__name__)
+
+MIN_ROUNDS = 10
+MAX_ROUNDS = 16
+
+
+class PasswordHasherBusy(Exception):
+    """Raised when too many hash/verify calls are already waiting for a worker"""
+
+
+def get_rounds(hashed: str) -> Optional[int]:
+    """Read the cost factor from a modular-crypt bcrypt hash ($2b$12$...)"""
+    parts = hashed.split("$")
+    if len(parts) < 4 or not parts[2].isdigit():
+        return None
+    return int(parts[2])
+
+
+class PasswordHasher:
+    """bcrypt behind a fixed-size thread pool with a capped wait queue.
+
+    bcrypt releases the GIL while hashing, so threads give real parallelism
+    up to ``max_workers``. Calls beyond that wait on a semaphore; once
+    ``max_pending`` calls are waiting, new ones fail fast with
+    ``PasswordHasherBusy`` instead of piling up behind a login storm.
+
+    ``rounds`` is a floor: calibration may raise the cost on a slow host
+    but never lowers it below the configured value.
+    """
+
+    def __init__(self, max_workers: int = 4, max_pending: int = 64, rounds: int = 12):
+        self.rounds = rounds
+        self.min_rounds = rounds
+        self.max_workers = max_workers
+        self.max_pending = max_pending
+        self._executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="bcrypt")
+        self._slots = asyncio.Semaphore(max_workers)
+        self.stats = {
+            "queued": 0,
+            "max_queued": 0,
+            "in_flight": 0,
+            "completed": 0,
+            "rejected": 0,
+            "wait_ms_total": 0.0,
+            "run_ms_total": 0.0
+        }
+
+    async def _run(self, fn, *args):
+        if self.stats["queued"] >= self.max_pending:
+            self.stats["rejected"] += 1
+            raise PasswordHasherBusy()
+
+        self.stats["queued"] += 1
+        self.stats["max_queued"] = max(self.stats["max_queued"], self.stats["queued"])
+        enqueued = time.perf_counter()
+        try:
+            await self._slots.acquire()
+        finally:
+            self.stats["queued"] -= 1
+
+        started = time.perf_counter()
+        self.stats["wait_ms_total"] += (started - enqueued) * 1000
+        self.stats["in_flight"] += 1
+        try:
+            loop = asyncio.get_running_loop()
+            return await loop.run_in_executor(self._executor, fn, *args)
+        finally:
+            self.stats["in_flight"] -= 1
+            self.stats["completed"] += 1
+            self.stats["run_ms_total"] += (time.perf_counter() - started) * 1000
+            self._slots.release()
+
+    async def hash(self, password: str) -> str:
+        return await self._run(self._hash_sync, password, self.rounds)
+
+    async def verify(self, password: str, hashed: str) -> bool:
+        if not hashed:
+            return False
+        return await self._run(self._verify_sync, password, hashed)
+
+    def needs_rehash(self, hashed: str) -> bool:
+        """True when a stored hash was made with a lower (or unreadable) cost factor.
+
+        Workers may calibrate to different costs; only upgrading keeps them
+        from rehashing the same password back and forth.
+        """
+        if not hashed:
+            return False
+        rounds = get_rounds(hashed)
+        return rounds is None or rounds < self.rounds
+
+    async def calibrate(self, target_ms: float) -> int:
+        """Pick the highest cost factor whose hash time fits ``target_ms``.
+
+        Each extra round doubles the work, so one timed hash at MIN_ROUNDS is
+        enough to extrapolate; the chosen cost is then confirmed with a real
+        measurement and stepped down if the extrapolation was optimistic. The
+        result is never below the configured ``min_rounds``.
+        """
+        loop = asyncio.get_running_loop()
+        base_ms = await loop.run_in_executor(self._executor, self._time_hash, MIN_ROUNDS)
+
+        floor = max(MIN_ROUNDS, self.min_rounds)
+        rounds = floor
+        while rounds < MAX_ROUNDS and base_ms * (2 ** (rounds + 1 - MIN_ROUNDS)) <= target_ms:
+            rounds += 1
+
+        while rounds > floor:
+            measured_ms = await loop.run_in_executor(self._executor, self._time_hash, rounds)
+            if measured_ms <= target_ms * 1.25:
+                break
+            rounds -= 1
+
+        logger.info(f"bcrypt calibrated to cost {rounds} ({base_ms:.1f} ms at cost {MIN_ROUNDS}, target {target_ms} ms)")
+        self.rounds = rounds
+        return rounds
+
+    def metrics(self) -> dict:
+        completed = self.stats["completed"]
+        return {
+            **self.stats,
+            "rounds": self.rounds,
+            "min_rounds": self.min_rounds,
+            "max_workers": self.max_workers,
+            "max_pending": self.max_pending,
+            "avg_wait_ms": self.stats["wait_ms_total"] / completed if completed else 0.0,
+            "avg_run_ms": self.stats["run_ms_total"] / completed if completed else 0.0
+        }
+
+    def shutdown(self):
+        self._executor.shutdown(wait=False)
+
+    @staticmethod
+    def _hash_sync(password: str, rounds: int) -> str:
+        return bcrypt.hashpw(password.encode('utf-8'), bcrypt.gensalt(rounds)).decode('utf-8')
+
+    @staticmethod
+    def _verify_sync(password: str, hashed: str) -> bool:
+        try:
+            return bcrypt.checkpw(password.encode('utf-8'), hashed.encode('utf-8'))
+        except ValueError:
+            # Malformed or non-bcrypt hash stored for this account
+            return False
+
+    @staticmethod
+    def _time_hash(rounds: int) -> float:
+        started = time.perf_counter()
+        bcrypt.hashpw(b"calibration-password", bcrypt.gensalt(rounds))
+        return (time.perf_counter() - started) * 1000
@@ -0,0 +1,308 @@
+"""
+Payment gateway for GameHub Marketplace
+One process-wide client per provider, with a timeout and a circuit breaker
+around every provider call. PAYMENT_PROVIDER=stub swaps Stripe for a local
+fake (sessions in Mongo, HMAC-signed webhooks) for offline load tests.
+"""
+import asyncio
+import hashlib
+import hmac
+import json
+import logging
+import secrets
+import time
+from datetime import datetime, timedelta, timezone
+from typing import Dict, NamedTuple, Optional
+
+logger = logging.getLogger(__name__)
+
+PROVIDERS = ("stripe", "stub")
+
+
+class PaymentUnavailable(Exception):
+    """The provider timed out or is failing; the breaker may be open"""
+
+
+class PaymentRejected(Exception):
+    """The provider refused the request itself (4xx, unknown session, bad input)"""
+
+
+class InvalidWebhook(ValueError):
+    """A webhook whose signature or body doesn't check out"""
+
+
+class CheckoutSession(NamedTuple):
+    session_id: str
+    url: str
+
+
+class CheckoutStatus(NamedTuple):
+    status: str
+    payment_status: str
+    amount_total: int
+    currency: str
+    metadata: Dict[str, str]
+
+
+class WebhookEvent(NamedTuple):
+    event_id: str
+    event_type: str
+    session_id: str
+    payment_status: str
+
+
+class CircuitBreaker:
+    """closed -> open after ``failure_threshold`` consecutive failures; after
+    ``reset_seconds`` one trial call is let through (half-open) and its
+    outcome closes or re-opens the circuit."""
+
+    def __init__(self, failure_threshold: int = 5, reset_seconds: float = 30):
+        self.failure_threshold = failure_threshold
+        self.reset_seconds = reset_seconds
+        self._failures = 0
+        self._opened_at: Optional[float] = None
+        self._trial_running = False
+
+    @property
+    def state(self) -> str:
+        if self._opened_at is None:
+            return "closed"
+        if time.monotonic() - self._opened_at >= self.reset_seconds:
+            return "half-open"
+        return "open"
+
+    def allow(self) -> bool:
+        state = self.state
+        if state == "closed":
+            return True
+        if state == "half-open" and not self._trial_running:
+            self._trial_running = True
+            return True
+        return False
+
+    def record_success(self):
+        self._failures = 0
+        self._opened_at = None
+        self._trial_running = False
+
+    def release(self):
+        """An outcome that says nothing about the provider's health: a trial
+        call gives its slot back without closing or re-opening the circuit"""
+        self._trial_running = False
+
+    def record_failure(self):
+        self._failures += 1
+        if self._trial_running or self._failures >= self.failure_threshold:
+            self._opened_at = time.monotonic()
+        self._trial_running = False
+
+
+# Transport-level errors of the clients providers are reached through (httpx,
+# aiohttp, stripe; pymongo for the stub), by class name so none of them has to
+# be installed to recognise the others
+_TRANSPORT_ERRORS = {"TransportError", "ConnectError", "ClientConnectionError", "APIConnectionError",
+                     "ConnectionFailure"}
+
+
+def _http_status(error: Exception) -> Optional[int]:
+    """Status of the provider response behind ``error``, if it carries one
+    (stripe: ``http_status``; HTTPException: ``status_code``; httpx/requests:
+    ``response.status_code``)"""
+    for status in (getattr(error, "http_status", None), getattr(error, "status_code", None),
+                   getattr(getattr(error, "response", None), "status_code", None)):
+        if isinstance(status, int):
+            return status
+    return None
+
+
+def _is_provider_failure(error: Exception) -> bool:
+    """Whether ``error`` means the provider is unreachable or failing: a
+    transport error or a 5xx (429 and 408 included), as opposed to it
+    rejecting a bad request, which is the caller's problem."""
+    status = _http_status(error)
+    if status is not None:
+        return status >= 500 or status in (408, 429)
+    if isinstance(error, OSError):  # sockets, DNS, ConnectionError, TimeoutError
+        return True
+    return any(cls.__name__ in _TRANSPORT_ERRORS for cls in type(error).__mro__)
+
+
+class PaymentGateway:
+    """What the API needs from a payment provider.
+
+    Subclasses implement the ``_create``/``_status`` provider calls;
+    ``create_session`` and ``get_status`` add the timeout and the breaker.
+    Only timeouts, transport errors and 5xx count against the breaker (and
+    raise PaymentUnavailable); a request the provider turns down raises
+    PaymentRejected and leaves it alone. Webhook parsing is local (signature
+    check) and isn't guarded.
+    """
+
+    name = ""
+
+    def __init__(self, timeout: float = 10.0, failure_threshold: int = 5, reset_seconds: float = 30):
+        self.timeout = timeout
+        self.breaker = CircuitBreaker(failure_threshold, reset_seconds)
+        self.stats = {"calls": 0, "failures": 0, "timeouts": 0, "rejected": 0, "refused": 0}
+
+    async def _call(self, operation: str, coro):
+        if not self.breaker.allow():
+            coro.close()
+            self.stats["rejected"] += 1
+            raise PaymentUnavailable(f"{self.name} circuit is open")
+        self.stats["calls"] += 1
+        try:
+            result = await asyncio.wait_for(coro, self.timeout)
+        except asyncio.TimeoutError:
+            self.stats["timeouts"] += 1
+            self.breaker.record_failure()
+            raise PaymentUnavailable(f"{self.name} {operation} timed out after {self.timeout}s")
+        except Exception as e:
+            if not _is_provider_failure(e):
+                self.stats["refused"] += 1
+                if _http_status(e) is None:
+                    self.breaker.release()
+                else:
+                    self.breaker.record_success()  # the provider answered
+                logger.warning(f"Payment provider {self.name} refused {operation}: {e}")
+                raise PaymentRejected(f"{self.name} {operation} refused: {e}") from e
+            self.stats["failures"] += 1
+            self.breaker.record_failure()
+            logger.error(f"Payment provider {self.name} {operation} failed: {e}")
+            raise PaymentUnavailable(f"{self.name} {operation} failed") from e
+        self.breaker.record_success()
+        return result
+
+    async def create_session(self, amount: float, currency: str, success_url: str, cancel_url: str,
+                             metadata: Dict[str, str]) -> CheckoutSession:
+        return await self._call("create_session", self._create(amount, currency, success_url, cancel_url, metadata))
+
+    async def get_status(self, session_id: str) -> CheckoutStatus:
+        return await self._call("get_status", self._status(session_id))
+
+    async def _create(self, amount, currency, success_url, cancel_url, metadata) -> CheckoutSession:
+        raise NotImplementedError
+
+    async def _status(self, session_id: str) -> CheckoutStatus:
+        raise NotImplementedError
+
+    async def parse_webhook(self, body: bytes, signature: Optional[str]) -> WebhookEvent:
+        raise NotImplementedError
+
+    def metrics(self) -> dict:
+        return {"provider": self.name, **self.stats, "breaker": self.breaker.state}
+
+
+class StripeGateway(PaymentGateway):
+    name = "stripe"
+
+    def __init__(self, api_key: str, webhook_url: str, **kwargs):
+        super().__init__(**kwargs)
+        from emergentintegrations.payments.stripe.checkout import StripeCheckout
+        self._checkout = StripeCheckout(api_key=api_key, webhook_url=webhook_url)
+
+    async def _create(self, amount, currency, success_url, cancel_url, metadata) -> CheckoutSession:
+        from emergentintegrations.payments.stripe.checkout import CheckoutSessionRequest
+        session = await self._checkout.create_checkout_session(CheckoutSessionRequest(
+            amount=amount, currency=currency, success_url=success_url, cancel_url=cancel_url, metadata=metadata
+        ))
+        return CheckoutSession(session.session_id, session.url)
+
+    async def _status(self, session_id: str) -> CheckoutStatus:
+        status = await self._checkout.get_checkout_status(session_id)
+        return CheckoutStatus(status.status, status.payment_status, status.amount_total, status.currency,
+                              dict(status.metadata or {}))
+
+    async def parse_webhook(self, body: bytes, signature: Optional[str]) -> WebhookEvent:
+        try:
+            event = await self._checkout.handle_webhook(body, signature)
+        except Exception as e:
+            raise InvalidWebhook(str(e)) from e
+        return WebhookEvent(event.event_id, event.event_type, event.session_id, event.payment_status)
+
+
+class StubGateway(PaymentGateway):
+    """Local stand-in for Stripe Checkout.
+
+    Sessions are kept in the ``sessions`` Mongo collection (expiring after a
+    day through its TTL index), so a status poll or payment can land on any
+    worker. ``pay`` marks one paid and returns the webhook Stripe would send,
+    signed the same way (``t=<ts>,v1=<hmac-sha256>``). With more than one
+    worker, ``secret`` must be set so they all sign and verify alike.
+    """
+
+    name = "stub"
+    SIGNATURE_TOLERANCE_SECONDS = 300
+    SESSION_TTL = timedelta(hours=24)
+
+    def __init__(self, base_url: str, sessions, secret: Optional[str] = None, **kwargs):
+        super().__init__(**kwargs)
+        self.base_url = base_url.rstrip("/")
+        self.secret = (secret or secrets.token_hex(32)).encode()
+        self._sessions = sessions
+
+    async def _create(self, amount, currency, success_url, cancel_url, metadata) -> CheckoutSession:
+        session_id = f"cs_stub_{secrets.token_hex(12)}"
+        await self._sessions.insert_one({
+            "session_id": session_id,
+            "amount_total": int(round(amount * 100)),
+            "currency": currency,
+            "metadata": dict(metadata),
+            "status": "open",
+            "payment_status": "unpaid",
+            "expires_at": datetime.now(timezone.utc) + self.SESSION_TTL
+        })
+        return CheckoutSession(session_id, f"{self.base_url}/api/payments/stub/{session_id}")
+
+    async def _status(self, session_id: str) -> CheckoutStatus:
+        session = await self._sessions.find_one({"session_id": session_id}, {"_id": 0})
+        if session is None:
+            raise KeyError(f"No such checkout session: {session_id}")
+        return CheckoutStatus(session["status"], session["payment_status"], session["amount_total"],
+                              session["currency"], session["metadata"])
+
+    def _digest(self, body: bytes, timestamp: int) -> str:
+        return hmac.new(self.secret, f"{timestamp}.".encode() + body, hashlib.sha256).hexdigest()
+
+    def sign(self, body: bytes) -> str:
+        timestamp = int(time.time())
+        return f"t={timestamp},v1={self._digest(body, timestamp)}"
+
+    async def pay(self, session_id: str) -> Optional[tuple]:
+        """Complete a session; returns the (body, signature) of its webhook, or None if unknown"""
+        session = await self._sessions.find_one_and_update(
+            {"session_id": session_id}, {"$set": {"status": "complete", "payment_status": "paid"}},
+            projection={"_id": 0, "metadata": 1}
+        )
+        if session is None:
+            return None
+        body = json.dumps({
+            "id": f"evt_stub_{secrets.token_hex(12)}",
+            "type": "checkout.session.completed",
+            "data": {"object": {"id": session_id, "payment_status": "paid", "metadata": session["metadata"]}}
+        }).encode()
+        return body, self.sign(body)
+
+    async def parse_webhook(self, body: bytes, signature: Optional[str]) -> WebhookEvent:
+        parts = dict(part.split("=", 1) for part in (signature or "").split(",") if "=" in part)
+        if not parts.get("t", "").isdigit() or "v1" not in parts:
+            raise InvalidWebhook("Missing or malformed signature")
+        if abs(time.time() - int(parts["t"])) > self.SIGNATURE_TOLERANCE_SECONDS:
+            raise InvalidWebhook("Signature timestamp outside tolerance")
+        if not hmac.compare_digest(self._digest(body, int(parts["t"])), parts["v1"]):
+            raise InvalidWebhook("Signature mismatch")
+        try:
+            event = json.loads(body)
+            session = event["data"]["object"]
+            return WebhookEvent(event["id"], event["type"], session["id"], session["payment_status"])
+        except (ValueError, KeyError, TypeError) as e:
+            raise InvalidWebhook(f"Unreadable event: {e}") from e
+
+
+def create_gateway(provider: str, **config) -> PaymentGateway:
+    """Build the gateway for PAYMENT_PROVIDER; ``config`` holds that provider's settings"""
+    if provider == "stripe":
+        return StripeGateway(**config)
+    if provider == "stub":
+        return StubGateway(**config)
+    raise ValueError(f"Unknown payment provider {provider!r}, expected one of {', '.join(PROVIDERS)}")
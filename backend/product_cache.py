@@ -0,0 +1,93 @@
+"""
+Product read cache for GameHub Marketplace
+Parsed products by id in a bounded LRU with a TTL. Writers invalidate the
+ids they touch (or adjust counters such as stock); the TTL bounds staleness
+from writes made by other backend instances.
+"""
+from typing import Callable, Dict, Iterable, List
+
+from cachetools import TTLCache
+
+
+class _Entry:
+    """Holds the current product for an id; swapping it keeps the TTL slot's expiry"""
+    __slots__ = ("product",)
+
+    def __init__(self, product):
+        self.product = product
+
+
+class ProductCache:
+    def __init__(self, parse: Callable[[dict], object], maxsize: int = 10_000, ttl: float = 60):
+        self._parse = parse
+        self._entries = TTLCache(maxsize=maxsize, ttl=ttl)
+        # Bumped on invalidation so a read that raced a write doesn't cache the old document
+        self._generation = 0
+        self.stats = {"hits": 0, "misses": 0, "invalidations": 0, "adjustments": 0}
+
+    async def get(self, collection, product_id: str):
+        return (await self.get_many(collection, [product_id])).get(product_id)
+
+    async def get_many(self, collection, product_ids: Iterable[str]) -> Dict[str, object]:
+        """Products for the given ids; ids that don't exist are simply absent"""
+        found, missing = {}, []
+        for product_id in dict.fromkeys(product_ids):
+            entry = self._entries.get(product_id)
+            if entry is None:
+                missing.append(product_id)
+            else:
+                found[product_id] = entry.product
+        self.stats["hits"] += len(found)
+        self.stats["misses"] += len(missing)
+
+        if missing:
+            generation = self._generation
+            docs = await collection.find({"id": {"$in": missing}}, {"_id": 0}).to_list(len(missing))
+            for doc in docs:
+                product = self._parse(doc)
+                found[doc["id"]] = product
+                if generation == self._generation:
+                    self._entries[doc["id"]] = _Entry(product)
+        return found
+
+    async def get_list(self, collection, product_ids: List[str]) -> List[object]:
+        """Like get_many, but as a list in the order of ``product_ids``"""
+        products = await self.get_many(collection, product_ids)
+        return [products[pid] for pid in dict.fromkeys(product_ids) if pid in products]
+
+    def adjust(self, deltas: Dict[str, int], field: str = "stock"):
+        """Apply a counter change this process just wrote to the cached copies.
+
+        Hot products stay cached through stock movements instead of being
+        evicted on every order. The cached product is replaced by an updated
+        copy, never changed in place, since earlier callers may still hold
+        it. Entries keep their original expiry, so the rest of the document
+        (``updated_at`` included) catches up with the database within the TTL.
+        """
+        self._generation += 1
+        for product_id, delta in deltas.items():
+            entry = self._entries.get(product_id)
+            if entry is not None:
+                product = entry.product
+                entry.product = product.model_copy(update={field: getattr(product, field) + delta})
+                self.stats["adjustments"] += 1
+
+    def invalidate(self, product_ids: Iterable[str]):
+        self._generation += 1
+        for product_id in product_ids:
+            self.stats["invalidations"] += self._entries.pop(product_id, None) is not None
+
+    def clear(self):
+        self._generation += 1
+        self.stats["invalidations"] += len(self._entries)
+        self._entries.clear()
+
+    def metrics(self) -> dict:
+        lookups = self.stats["hits"] + self.stats["misses"]
+        return {
+            **self.stats,
+            "size": len(self._entries),
+            "maxsize": self._entries.maxsize,
+            "ttl_seconds": self._entries.ttl,
+            "hit_rate": self.stats["hits"] / lookups if lookups else 0.0
+        }
@@ -0,0 +1,239 @@
+"""
+Personalized recommendations for GameHub Marketplace
+Implicit-feedback ALS (Hu, Koren & Volinsky) over purchases, favorites and
+views, in plain NumPy. Training runs in a worker process; the top products
+for recently active users are stored in `user_recommendations` so a request
+is a single key lookup.
+
+Usage: python recommendations.py
+"""
+import asyncio
+import logging
+import os
+from datetime import datetime, timezone, timedelta
+from typing import Dict, Iterable, List
+
+import numpy as np
+from pymongo import ReplaceOne
+
+logger = logging.getLogger(__name__)
+
+SIGNAL_WEIGHTS = {"purchase": 3.0, "favorite": 2.0, "view": 1.0}
+FACTORS = 32
+ITERATIONS = 10
+REGULARIZATION = 0.1
+ALPHA = 10.0              # confidence = 1 + ALPHA * weight
+TOP_N = 50
+ACTIVE_DAYS = 30
+SOLVE_CHUNK_NNZ = 16_384  # padded interactions per batched solve
+
+
+class InteractionBuilder:
+    """Maps user and product ids to rows/columns and sums signal weights per pair"""
+
+    def __init__(self):
+        self.user_ids: List[str] = []
+        self.product_ids: List[str] = []
+        self._users: Dict[str, int] = {}
+        self._products: Dict[str, int] = {}
+        self._rows: List[int] = []
+        self._cols: List[int] = []
+        self._weights: List[float] = []
+        self.purchased: Dict[int, set] = {}
+
+    def _row(self, user_id: str) -> int:
+        row = self._users.get(user_id)
+        if row is None:
+            row = self._users[user_id] = len(self.user_ids)
+            self.user_ids.append(user_id)
+        return row
+
+    def add(self, user_id: str, product_ids: Iterable[str], signal: str):
+        row = self._row(user_id)
+        for product_id in product_ids:
+            col = self._products.get(product_id)
+            if col is None:
+                col = self._products[product_id] = len(self.product_ids)
+                self.product_ids.append(product_id)
+            self._rows.append(row)
+            self._cols.append(col)
+            self._weights.append(SIGNAL_WEIGHTS[signal])
+            if signal != "view":
+                # Bought and favorited products are not recommended back
+                self.purchased.setdefault(row, set()).add(col)
+
+    def matrix(self) -> dict:
+        n_items = max(len(self.product_ids), 1)
+        keys = np.array(self._rows, dtype=np.int64) * n_items + np.array(self._cols, dtype=np.int64)
+        keys, inverse = np.unique(keys, return_inverse=True)
+        weights = np.bincount(inverse, weights=np.array(self._weights)) if keys.size else np.zeros(0)
+        return {
+            "rows": keys // n_items,
+            "cols": keys % n_items,
+            "weights": weights,
+            "shape": (len(self.user_ids), len(self.product_ids))
+        }
+
+
+def _compress(rows: np.ndarray, cols: np.ndarray, values: np.ndarray, n_rows: int):
+    order = np.argsort(rows, kind="stable")
+    indptr = np.zeros(n_rows + 1, dtype=np.int64)
+    np.cumsum(np.bincount(rows, minlength=n_rows), out=indptr[1:])
+    return indptr, cols[order], values[order]
+
+
+def _solve_side(indptr, indices, confidence, other: np.ndarray, reg: float) -> np.ndarray:
+    """Least-squares factors for every row given the fixed factors of the other side.
+
+    Rows are solved in batches of similar interaction counts, zero-padded to a
+    common length so each batch is one stacked matmul and one stacked solve.
+    """
+    n_rows, k = len(indptr) - 1, other.shape[1]
+    gram = other.T @ other + reg * np.eye(k, dtype=other.dtype)
+    result = np.zeros((n_rows, k), dtype=other.dtype)
+
+    counts = np.diff(indptr)
+    order = np.argsort(counts, kind="stable")
+    order = order[counts[order] > 0]
+    sorted_counts = counts[order]
+    start = 0
+    while start < order.size:
+        end = min(order.size, start + max(1, SOLVE_CHUNK_NNZ // int(sorted_counts[start])))
+        while end - start > 1 and (end - start) * int(sorted_counts[end - 1]) > SOLVE_CHUNK_NNZ:
+            end = start + max(1, SOLVE_CHUNK_NNZ // int(sorted_counts[end - 1]))
+        rows = order[start:end]
+        width = int(sorted_counts[end - 1])
+
+        offsets = np.arange(width)
+        mask = offsets[None, :] < counts[rows][:, None]
+        positions = np.where(mask, indptr[rows][:, None] + offsets[None, :], 0)
+        vectors = other[indices[positions]] * mask[..., None]  # (rows, width, k)
+        conf = np.where(mask, confidence[positions], 0.0).astype(other.dtype)
+        transposed = vectors.transpose(0, 2, 1)
+        a = gram + np.matmul(transposed * (conf - mask)[:, None, :], vectors)
+        b = np.matmul(transposed, conf[..., None])
+        result[rows] = np.linalg.solve(a, b)[..., 0]
+        start = end
+    return result
+
+
+def train_als(matrix: dict, factors: int = FACTORS, iterations: int = ITERATIONS,
+              reg: float = REGULARIZATION, alpha: float = ALPHA, seed: int = 0):
+    n_users, n_items = matrix["shape"]
+    confidence = (1.0 + alpha * matrix["weights"]).astype(np.float32)
+    by_user = _compress(matrix["rows"], matrix["cols"], confidence, n_users)
+    by_item = _compress(matrix["cols"], matrix["rows"], confidence, n_items)
+
+    rng = np.random.default_rng(seed)
+    user_factors = np.zeros((n_users, factors), dtype=np.float32)
+    item_factors = (rng.standard_normal((n_items, factors)) * 0.01).astype(np.float32)
+    for _ in range(iterations):
+        user_factors = _solve_side(*by_user, item_factors, reg)
+        item_factors = _solve_side(*by_item, user_factors, reg)
+    return user_factors, item_factors
+
+
+def top_n(user_factors, item_factors, rows: np.ndarray, exclude: Dict[int, set], n: int = TOP_N) -> Dict[int, np.ndarray]:
+    """Highest-scoring unseen items for each of ``rows``"""
+    n = min(n, item_factors.shape[0])
+    result = {}
+    for chunk_start in range(0, len(rows), 1024):
+        chunk = rows[chunk_start:chunk_start + 1024]
+        scores = user_factors[chunk] @ item_factors.T
+        for i, row in enumerate(chunk):
+            seen = exclude.get(int(row))
+            if seen:
+                scores[i, list(seen)] = -np.inf
+        best = np.argpartition(-scores, n - 1, axis=1)[:, :n]
+        ordered = np.take_along_axis(best, np.argsort(-np.take_along_axis(scores, best, axis=1), axis=1), axis=1)
+        for i, row in enumerate(chunk):
+            result[int(row)] = ordered[i][np.isfinite(scores[i, ordered[i]])]
+    return result
+
+
+def compute_recommendations(matrix: dict, active_rows: np.ndarray, exclude: Dict[int, set], n: int = TOP_N):
+    """Train and score in one call so it can run in a worker process"""
+    user_factors, item_factors = train_als(matrix)
+    return top_n(user_factors, item_factors, active_rows, exclude, n)
+
+
+async def refresh_recommendations(db, executor=None) -> dict:
+    """Retrain the model and rewrite `user_recommendations` for active users"""
+    started = datetime.now(timezone.utc)
+    active_since = started - timedelta(days=ACTIVE_DAYS)
+    builder = InteractionBuilder()
+    active = set()
+
+    async for doc in db.orders.aggregate([
+        {"$match": {"status": "paid"}},
+        {"$unwind": "$items"},
+        {"$group": {
+            "_id": "$user_id",
+            "product_ids": {"$addToSet": "$items.product_id"},
+            "last_order": {"$max": "$created_at"}
+        }}
+    ], allowDiskUse=True):
+        builder.add(doc["_id"], doc["product_ids"], "purchase")
+        last_order = doc["last_order"]
+        if isinstance(last_order, str):  # not yet converted by migrate_datetimes.py
+            last_order = datetime.fromisoformat(last_order)
+        if last_order and last_order >= active_since:
+            active.add(doc["_id"])
+    async for doc in db.favorites.aggregate([
+        {"$group": {"_id": "$user_id", "product_ids": {"$push": "$product_id"}}}
+    ], allowDiskUse=True):
+        builder.add(doc["_id"], doc["product_ids"], "favorite")
+    async for doc in db.recently_viewed.find({}, {"_id": 0, "user_id": 1, "product_ids": 1, "updated_at": 1}):
+        builder.add(doc["user_id"], doc["product_ids"], "view")
+        if doc.get("updated_at") and doc["updated_at"].replace(tzinfo=timezone.utc) >= active_since:
+            active.add(doc["user_id"])
+
+    matrix = builder.matrix()
+    if not matrix["rows"].size:
+        return {"users": 0, "products": 0, "active": 0}
+    active_rows = np.array(sorted(builder._users[user_id] for user_id in active), dtype=np.int64)
+    exclude = {row: builder.purchased[row] for row in active_rows.tolist() if row in builder.purchased}
+
+    loop = asyncio.get_running_loop()
+    recommended = await loop.run_in_executor(executor, compute_recommendations, matrix, active_rows, exclude)
+
+    batch = []
+    for row, cols in recommended.items():
+        batch.append(ReplaceOne(
+            {"user_id": builder.user_ids[row]},
+            {
+                "user_id": builder.user_ids[row],
+                "product_ids": [builder.product_ids[col] for col in cols.tolist()],
+                "updated_at": started
+            },
+            upsert=True
+        ))
+        if len(batch) >= 1000:
+            await db.user_recommendations.bulk_write(batch, ordered=False)
+            batch = []
+    if batch:
+        await db.user_recommendations.bulk_write(batch, ordered=False)
+    # Users who went quiet get the popularity fallback again
+    await db.user_recommendations.delete_many({"updated_at": {"$lt": started}})
+
+    stats = {"users": len(builder.user_ids), "products": len(builder.product_ids), "active": len(recommended)}
+    logger.info(f"Recommendations refreshed: {stats}")
+    return stats
+
+
+if __name__ == "__main__":
+    from pathlib import Path
+
+    from dotenv import load_dotenv
+    from motor.motor_asyncio import AsyncIOMotorClient
+
+    load_dotenv(Path(__file__).parent / '.env')
+
+    async def main():
+        client = AsyncIOMotorClient(os.environ['MONGO_URL'], tz_aware=True)
+        db = client[os.environ['DB_NAME']]
+        await db.user_recommendations.create_index("user_id", unique=True)
+        print(await refresh_recommendations(db))
+        client.close()
+
+    asyncio.run(main())
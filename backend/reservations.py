@@ -0,0 +1,281 @@
+"""
+Stock reservations for GameHub Marketplace
+An order takes its stock up front with one conditional $inc per product
+(`stock >= qty`), so concurrent checkouts never oversell and never lock each
+other out. Unpaid reservations expire and are swept back into stock; a
+payment converts the reservation into sales.
+"""
+import asyncio
+import logging
+from datetime import datetime, timezone, timedelta
+from typing import Dict, Iterable, List, NamedTuple, Optional
+
+from pymongo import ReturnDocument, UpdateOne
+from pymongo.errors import DuplicateKeyError
+
+logger = logging.getLogger(__name__)
+
+
+class OutOfStock(Exception):
+    def __init__(self, product_ids: List[str]):
+        super().__init__(f"Not enough stock for: {', '.join(product_ids)}")
+        self.product_ids = product_ids
+
+
+class HoldExists(Exception):
+    """A concurrent reserve for the same order won; ``status`` and
+    ``expires_at`` describe the hold it left"""
+
+    def __init__(self, order_id: str, status: str, expires_at: Optional[datetime]):
+        super().__init__(f"Order {order_id} already has a {status} stock hold")
+        self.order_id = order_id
+        self.status = status
+        self.expires_at = expires_at
+
+
+class ConversionBusy(Exception):
+    """Another call is converting this order's hold right now"""
+
+
+def merge_quantities(items: Iterable[dict]) -> Dict[str, int]:
+    """Total quantity per product for order items ({product_id, quantity})"""
+    quantities: Dict[str, int] = {}
+    for item in items:
+        quantities[item["product_id"]] = quantities.get(item["product_id"], 0) + item["quantity"]
+    return quantities
+
+
+class Conversion(NamedTuple):
+    """What converting a hold did: stock taken at payment time (late conversions
+    only) and the units that were no longer there to take"""
+    taken: Dict[str, int]
+    shortfall: Dict[str, int]
+
+
+class StockReservations:
+    """Reservations live in `stock_reservations`, one per order.
+
+    status: active -> converting -> converted (paid) | expired (swept) |
+    released (cancelled). Every transition is a compare-and-set on
+    ``status``, so the sweeper, a cancellation and a payment racing for the
+    same order resolve to one winner.
+    """
+
+    def __init__(self, ttl_seconds: float = 900, convert_lease_seconds: float = 60):
+        self.ttl = timedelta(seconds=ttl_seconds)
+        self.convert_lease = timedelta(seconds=convert_lease_seconds)
+        self.stats = {
+            "reserved": 0,
+            "rejected": 0,
+            "released": 0,
+            "expired": 0,
+            "converted": 0,
+            "late_conversions": 0,
+            "shortfall_units": 0
+        }
+
+    async def _take(self, products, quantities: Dict[str, int]) -> Dict[str, int]:
+        """Conditionally decrement stock for every product at once; returns what was taken.
+
+        Stock moves are bookkeeping, not catalogue edits: ``updated_at`` is left alone.
+        """
+        results = await asyncio.gather(*(
+            products.update_one({"id": product_id, "stock": {"$gte": quantity}}, {"$inc": {"stock": -quantity}})
+            for product_id, quantity in quantities.items()
+        ), return_exceptions=True)
+        taken = {
+            product_id: quantity
+            for (product_id, quantity), result in zip(quantities.items(), results)
+            if not isinstance(result, BaseException) and result.modified_count
+        }
+        failure = next((result for result in results if isinstance(result, BaseException)), None)
+        if failure is not None:
+            await self._restock(products, taken)
+            raise failure
+        return taken
+
+    async def _restock(self, products, quantities: Dict[str, int]):
+        if not quantities:
+            return
+        await products.bulk_write([
+            UpdateOne({"id": product_id}, {"$inc": {"stock": quantity}})
+            for product_id, quantity in quantities.items()
+        ], ordered=False)
+
+    async def reserve(self, db, order_id: str, user_id: str, quantities: Dict[str, int]) -> datetime:
+        """Take stock for an order and return when the hold expires.
+
+        Raises OutOfStock, with nothing held, if any product is short, and
+        HoldExists, having given its stock back, if the order already holds
+        (or has converted) a reservation, e.g. two checkouts racing.
+        """
+        now = datetime.now(timezone.utc)
+        taken = await self._take(db.products, quantities)
+        if len(taken) < len(quantities):
+            # Compensate: give back what this order did get
+            await self._restock(db.products, taken)
+            self.stats["rejected"] += 1
+            raise OutOfStock([product_id for product_id in quantities if product_id not in taken])
+
+        expires_at = now + self.ttl
+        try:
+            # Replaces a lapsed hold when checkout restarts; a live or paid one is a duplicate key
+            await db.stock_reservations.replace_one(
+                {"order_id": order_id, "status": {"$in": ["expired", "released"]}},
+                {
+                    "order_id": order_id,
+                    "user_id": user_id,
+                    "items": [{"product_id": pid, "quantity": qty} for pid, qty in quantities.items()],
+                    "status": "active",
+                    "expires_at": expires_at,
+                    "created_at": now
+                },
+                upsert=True
+            )
+        except DuplicateKeyError:
+            await self._restock(db.products, taken)
+            existing = await db.stock_reservations.find_one(
+                {"order_id": order_id}, {"_id": 0, "status": 1, "expires_at": 1}
+            )
+            if existing is None:
+                raise
+            raise HoldExists(order_id, existing["status"], existing.get("expires_at"))
+        except BaseException:
+            await self._restock(db.products, taken)
+            raise
+        self.stats["reserved"] += 1
+        return expires_at
+
+    async def extend(self, db, order_id: str) -> Optional[datetime]:
+        """Push an active hold's expiry out by one TTL (e.g. when checkout starts)"""
+        expires_at = datetime.now(timezone.utc) + self.ttl
+        result = await db.stock_reservations.update_one(
+            {"order_id": order_id, "status": "active"}, {"$set": {"expires_at": expires_at}}
+        )
+        return expires_at if result.modified_count else None
+
+    async def release(self, db, order_id: str, status: str = "released") -> Dict[str, int]:
+        """Return an active hold's stock; a no-op if it was already closed"""
+        doc = await db.stock_reservations.find_one_and_update(
+            {"order_id": order_id, "status": "active"},
+            {"$set": {"status": status, "closed_at": datetime.now(timezone.utc)}}
+        )
+        if doc is None:
+            return {}
+        quantities = merge_quantities(doc["items"])
+        await self._restock(db.products, quantities)
+        self.stats["expired" if status == "expired" else "released"] += 1
+        return quantities
+
+    async def _claim_conversion(self, db, order_id: str, quantities: Dict[str, int]) -> Optional[dict]:
+        """Move the hold to converting under a lease, recording whether its
+        stock is held; None if it is already converted"""
+        now = datetime.now(timezone.utc)
+        lease = {"status": "converting", "leased_until": now + self.convert_lease}
+        for query, update in (
+            ({"status": "active"}, {**lease, "held": True}),
+            ({"status": {"$in": ["expired", "released"]}}, {**lease, "held": False}),
+            ({"status": "converting", "leased_until": {"$lte": now}}, lease),  # resume an attempt that stopped
+        ):
+            doc = await db.stock_reservations.find_one_and_update(
+                {"order_id": order_id, **query}, {"$set": update}, return_document=ReturnDocument.AFTER
+            )
+            if doc is not None:
+                return doc
+        try:
+            # Orders placed before reservations existed have no hold to convert
+            doc = {
+                "order_id": order_id,
+                "items": [{"product_id": pid, "quantity": qty} for pid, qty in quantities.items()],
+                "created_at": now,
+                **lease,
+                "held": False
+            }
+            await db.stock_reservations.insert_one(doc)
+            return doc
+        except DuplicateKeyError:
+            pass
+        existing = await db.stock_reservations.find_one({"order_id": order_id}, {"_id": 0, "status": 1})
+        if existing is not None and existing["status"] == "converted":
+            return None
+        raise ConversionBusy(order_id)
+
+    async def _apply(self, db, order_id: str, product_id: str, quantity: int, held: bool) -> str:
+        """Count one product's sales, taking its stock too unless it was held;
+        returns the outcome (held, taken or short), recorded on the reservation"""
+        outcome = "held"
+        if not held:
+            result = await db.products.update_one(
+                {"id": product_id, "stock": {"$gte": quantity}}, {"$inc": {"stock": -quantity, "sales_count": quantity}}
+            )
+            outcome = "taken" if result.modified_count else "short"
+        if outcome != "taken":
+            await db.products.update_one({"id": product_id}, {"$inc": {"sales_count": quantity}})
+        await db.stock_reservations.update_one({"order_id": order_id}, {"$set": {f"applied.{product_id}": outcome}})
+        return outcome
+
+    async def convert(self, db, order_id: str, items: List[dict]) -> Optional[Conversion]:
+        """Turn an order's hold into sales once it is paid.
+
+        Exactly-once per order: a call that finds the reservation already
+        converted does nothing and returns None, and one that finds another
+        call converting it raises ConversionBusy. Each product's $inc is
+        marked on the reservation once applied, and the status only becomes
+        converted after all of them, so a call that fails part way leaves the
+        rest for a retry (at once if it raised, after the lease if it died;
+        dying between an $inc and its mark is the one gap). If the hold had
+        expired (or the order predates reservations) the stock is taken again
+        conditionally; units that are no longer there are reported as a
+        shortfall instead of driving stock negative.
+        """
+        quantities = merge_quantities(items)
+        doc = await self._claim_conversion(db, order_id, quantities)
+        if doc is None:
+            return None
+        applied = dict(doc.get("applied") or {})
+        pending = [(pid, qty) for pid, qty in quantities.items() if pid not in applied]
+        try:
+            outcomes = await asyncio.gather(*(
+                self._apply(db, order_id, pid, qty, doc["held"]) for pid, qty in pending
+            ))
+        except BaseException:
+            # Let a retry pick the rest up straight away rather than after the lease
+            await db.stock_reservations.update_one(
+                {"order_id": order_id, "status": "converting"},
+                {"$set": {"leased_until": datetime.now(timezone.utc)}}
+            )
+            raise
+        applied.update(zip((pid for pid, _ in pending), outcomes))
+
+        result = await db.stock_reservations.update_one(
+            {"order_id": order_id, "status": "converting"},
+            {"$set": {"status": "converted", "closed_at": datetime.now(timezone.utc)}, "$unset": {"leased_until": ""}}
+        )
+        if not result.modified_count:
+            return None  # a concurrent resume finished first
+        taken = {pid: quantities[pid] for pid, outcome in applied.items() if outcome == "taken"}
+        shortfall = {pid: quantities[pid] for pid, outcome in applied.items() if outcome == "short"}
+        if not doc["held"]:
+            self.stats["late_conversions"] += 1
+        if shortfall:
+            self.stats["shortfall_units"] += sum(shortfall.values())
+            logger.warning(f"Order {order_id} was paid without stock for {shortfall}")
+        self.stats["converted"] += 1
+        return Conversion(taken, shortfall)
+
+    async def sweep(self, db, batch: int = 500) -> Dict[str, int]:
+        """Expire overdue holds; returns the units put back per product"""
+        restocked: Dict[str, int] = {}
+        while True:
+            overdue = await db.stock_reservations.find(
+                {"status": "active", "expires_at": {"$lte": datetime.now(timezone.utc)}},
+                {"_id": 0, "order_id": 1}
+            ).limit(batch).to_list(batch)
+            for doc in overdue:
+                for product_id, quantity in (await self.release(db, doc["order_id"], status="expired")).items():
+                    restocked[product_id] = restocked.get(product_id, 0) + quantity
+            if len(overdue) < batch:
+                return restocked
+
+    def metrics(self) -> dict:
+        return {**self.stats, "ttl_seconds": self.ttl.total_seconds()}
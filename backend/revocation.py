@@ -0,0 +1,160 @@
+"""
+JWT revocation for GameHub Marketplace
+A Bloom filter answers "definitely not revoked" for almost every token without
+touching the exact sets behind it; the sets are rebuilt from `revoked_tokens`.
+"""
+import hashlib
+import math
+import time
+from datetime import datetime, timezone
+from typing import Optional
+
+
+class BloomFilter:
+    """Fixed-size Bloom filter using double hashing over one blake2b digest"""
+
+    def __init__(self, capacity: int, error_rate: float = 0.001):
+        self.capacity = capacity
+        self.num_bits = max(8, int(-capacity * math.log(error_rate) / (math.log(2) ** 2)))
+        self.num_hashes = max(1, round(self.num_bits / capacity * math.log(2)))
+        self._bits = bytearray((self.num_bits + 7) // 8)
+        self.count = 0
+
+    def _positions(self, key: str):
+        digest = hashlib.blake2b(key.encode('utf-8'), digest_size=16).digest()
+        h1 = int.from_bytes(digest[:8], 'little')
+        h2 = int.from_bytes(digest[8:], 'little') | 1
+        for i in range(self.num_hashes):
+            yield (h1 + i * h2) % self.num_bits
+
+    def add(self, key: str):
+        for pos in self._positions(key):
+            self._bits[pos >> 3] |= 1 << (pos & 7)
+        self.count += 1
+
+    def __contains__(self, key: str) -> bool:
+        return all(self._bits[pos >> 3] & (1 << (pos & 7)) for pos in self._positions(key))
+
+
+class RevocationList:
+    """Revoked token ids and per-user "issued before" cutoffs.
+
+    Token-level entries come from logout and refresh rotation; user-level
+    entries come from role changes and account deletion and revoke every
+    token for that user issued before the cutoff.
+    """
+
+    def __init__(self, capacity: int = 100_000, error_rate: float = 0.001):
+        self.capacity = capacity
+        self.error_rate = error_rate
+        self._reset()
+        self._local = []  # (revoked_at, kind, key, not_before) since the last rebuild started
+        self.stats = {"checks": 0, "filter_passes": 0, "exact_misses": 0, "revoked_hits": 0, "rebuilds": 0}
+
+    def _reset(self):
+        self._filter = BloomFilter(self.capacity, self.error_rate)
+        self._tokens = set()
+        self._users = {}
+
+    def _add_token(self, jti: str):
+        self._filter.add(f"t:{jti}")
+        self._tokens.add(jti)
+
+    def _add_user(self, user_id: str, not_before: float):
+        self._filter.add(f"u:{user_id}")
+        self._users[user_id] = max(not_before, self._users.get(user_id, 0.0))
+
+    def _remember(self, kind: str, key: str, not_before: Optional[float]):
+        # Stamped after the write lands, so a rebuild that started earlier
+        # (and may have missed the row) still carries the entry over
+        self._local.append((time.monotonic(), kind, key, not_before))
+        if kind == "token":
+            self._add_token(key)
+        else:
+            self._add_user(key, not_before)
+
+    def is_revoked(self, jti: Optional[str], user_id: str, issued_at: float) -> bool:
+        self.stats["checks"] += 1
+        token_key = f"t:{jti}" if jti else None
+        user_key = f"u:{user_id}"
+        maybe_token = token_key is not None and token_key in self._filter
+        maybe_user = user_key in self._filter
+        if not maybe_token and not maybe_user:
+            return False
+
+        self.stats["filter_passes"] += 1
+        if maybe_token and jti in self._tokens:
+            self.stats["revoked_hits"] += 1
+            return True
+        cutoff = self._users.get(user_id) if maybe_user else None
+        if cutoff is not None and issued_at < cutoff:
+            self.stats["revoked_hits"] += 1
+            return True
+        self.stats["exact_misses"] += 1
+        return False
+
+    async def revoke_token(self, collection, jti: str, expires_at: datetime):
+        """Revoke one token until it would have expired anyway"""
+        self._add_token(jti)
+        await collection.update_one(
+            {"kind": "token", "key": jti},
+            {"$set": {"expires_at": expires_at}},
+            upsert=True
+        )
+        self._remember("token", jti, None)
+
+    async def revoke_user(self, collection, user_id: str, expires_at: datetime):
+        """Revoke all tokens issued to a user up to now.
+
+        ``expires_at`` should be the latest expiry of any token issued
+        before now; after that the entry is pure dead weight.
+        """
+        now = datetime.now(timezone.utc)
+        self._add_user(user_id, now.timestamp())
+        await collection.update_one(
+            {"kind": "user", "key": user_id},
+            {"$set": {"not_before": now.timestamp(), "expires_at": expires_at}},
+            upsert=True
+        )
+        self._remember("user", user_id, now.timestamp())
+
+    async def load(self, collection):
+        """Rebuild the filter and exact sets from unexpired revocation rows"""
+        started = time.monotonic()
+        now = datetime.now(timezone.utc)
+        count = await collection.count_documents({"expires_at": {"$gt": now}})
+        # Grow rather than saturate the filter when revocations pile up
+        while count > self.capacity:
+            self.capacity *= 2
+
+        tokens, users = set(), {}
+        async for doc in collection.find({"expires_at": {"$gt": now}}, {"_id": 0}):
+            if doc["kind"] == "token":
+                tokens.add(doc["key"])
+            else:
+                users[doc["key"]] = max(doc["not_before"], users.get(doc["key"], 0.0))
+
+        # Revocations made locally while loading may not have been visible to the query
+        self._local = [entry for entry in self._local if entry[0] >= started]
+        for _, kind, key, not_before in self._local:
+            if kind == "token":
+                tokens.add(key)
+            else:
+                users[key] = max(not_before, users.get(key, 0.0))
+
+        self._reset()
+        for jti in tokens:
+            self._add_token(jti)
+        for user_id, cutoff in users.items():
+            self._add_user(user_id, cutoff)
+        self.stats["rebuilds"] += 1
+
+    def metrics(self) -> dict:
+        return {
+            **self.stats,
+            "revoked_tokens": len(self._tokens),
+            "revoked_users": len(self._users),
+            "filter_bits": self._filter.num_bits,
+            "filter_hashes": self._filter.num_hashes,
+            "filter_capacity": self.capacity
+        }
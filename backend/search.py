@@ -0,0 +1,488 @@
+"""
+Full-text product search for GameHub Marketplace
+In-process inverted index over stemmed title/description terms (Russian and
+English) with BM25 ranking and trigram-based typo tolerance.
+"""
+import math
+import re
+from array import array
+from collections import Counter
+from functools import lru_cache
+from typing import Dict, Iterable, List, Optional, Tuple
+
+import numpy as np
+
+TOKEN_RE = re.compile(r"[0-9a-zа-я]+")
+CYRILLIC_RE = re.compile(r"[а-я]")
+
+STOPWORDS = {
+    # English
+    "a", "an", "and", "are", "as", "at", "be", "by", "for", "from", "in", "is",
+    "it", "of", "on", "or", "the", "to", "with",
+    # Russian
+    "а", "без", "в", "во", "да", "для", "до", "же", "за", "и", "из", "или", "к",
+    "как", "на", "не", "но", "о", "об", "от", "по", "при", "с", "со", "то", "у",
+}
+
+TITLE_BOOST = 3  # a title occurrence counts as this many description occurrences
+BM25_K1 = 1.2
+BM25_B = 0.75
+FUZZY_MIN_LENGTH = 4
+FUZZY_MAX_EXPANSIONS = 3
+FUZZY_WEIGHT = 0.6
+FUZZY_MAX_TRIGRAM_POSTINGS = 50_000
+# Only the best-scoring postings of each term from the last rebuild are scored
+# ("champion lists"); very common terms would otherwise dominate query time
+CHAMPION_LIST_SIZE = 20_000
+
+
+# === Text analysis ===
+def normalize(text: str) -> str:
+    return text.lower().replace("ё", "е")
+
+
+def _ru_regions(word: str) -> Tuple[int, int]:
+    """Start offsets of RV and R2 as defined by the Snowball Russian stemmer"""
+    vowels = "аеиоуыэюя"
+    rv = len(word)
+    for i, ch in enumerate(word):
+        if ch in vowels:
+            rv = i + 1
+            break
+
+    def next_region(start: int) -> int:
+        for i in range(start + 1, len(word)):
+            if word[i] not in vowels and word[i - 1] in vowels:
+                return i + 1
+        return len(word)
+
+    return rv, next_region(next_region(0))
+
+
+_RU_PERFECTIVE_GERUND = re.compile(r"((?<=[ая])(в|вши|вшись)|(ив|ивши|ившись|ыв|ывши|ывшись))$")
+_RU_REFLEXIVE = re.compile(r"(ся|сь)$")
+_RU_ADJECTIVAL = re.compile(
+    r"((ивш|ывш|ующ)|(?<=[ая])(ем|нн|вш|ющ|щ))?"
+    r"(ее|ие|ые|ое|ими|ыми|ей|ий|ый|ой|ем|им|ым|ом|его|ого|ему|ому|их|ых|ую|юю|ая|яя|ою|ею)$"
+)
+_RU_VERB = re.compile(
+    r"((?<=[ая])(ла|на|ете|йте|ли|й|л|ем|н|ло|но|ет|ют|ны|ть|ешь|нно)|"
+    r"(ила|ыла|ена|ейте|уйте|ите|или|ыли|ей|уй|ил|ыл|им|ым|ен|ило|ыло|ено|ят|ует|уют|ит|ыт|ены|ить|ыть|ишь|ую|ю))$"
+)
+_RU_NOUN = re.compile(
+    r"(а|ев|ов|ие|ье|е|иями|ями|ами|еи|ии|и|ией|ей|ой|ий|й|иям|ям|ием|ем|ам|ом|о|у|ах|иях|ях|ы|ь|ию|ью|ю|ия|ья|я)$"
+)
+_RU_DERIVATIONAL = re.compile(r"ость?$")
+_RU_SUPERLATIVE = re.compile(r"(ейше|ейш)$")
+
+
+def stem_russian(word: str) -> str:
+    """Snowball Russian stemmer (steps 1-4) over a normalized word"""
+    rv_start, r2_start = _ru_regions(word)
+    prefix, rv = word[:rv_start], word[rv_start:]
+
+    # Step 1
+    stripped = _RU_PERFECTIVE_GERUND.sub("", rv, count=1)
+    if stripped == rv:
+        rv = _RU_REFLEXIVE.sub("", rv, count=1)
+        stripped = _RU_ADJECTIVAL.sub("", rv, count=1)
+        if stripped == rv:
+            stripped = _RU_VERB.sub("", rv, count=1)
+            if stripped == rv:
+                stripped = _RU_NOUN.sub("", rv, count=1)
+    rv = stripped
+
+    # Step 2
+    if rv.endswith("и"):
+        rv = rv[:-1]
+
+    # Step 3: derivational suffix must lie in R2
+    match = _RU_DERIVATIONAL.search(rv)
+    if match and rv_start + match.start() >= r2_start:
+        rv = rv[:match.start()]
+
+    # Step 4
+    if rv.endswith("нн"):
+        rv = rv[:-1]
+    else:
+        superlative = _RU_SUPERLATIVE.sub("", rv, count=1)
+        if superlative != rv:
+            rv = superlative[:-1] if superlative.endswith("нн") else superlative
+        elif rv.endswith("ь"):
+            rv = rv[:-1]
+
+    return prefix + rv
+
+
+def _has_vowel(word: str) -> bool:
+    return any(ch in "aeiouy" for ch in word)
+
+
+def stem_english(word: str) -> str:
+    """Light English stemmer: plurals, -ed/-ing and possessives (Porter step 1)"""
+    if len(word) <= 3:
+        return word
+    if word.endswith("sses"):
+        word = word[:-2]
+    elif word.endswith("ies"):
+        word = word[:-2]
+    elif word.endswith("s") and not word.endswith(("ss", "us", "is")):
+        word = word[:-1]
+
+    for suffix in ("ingly", "edly", "ing", "ed"):
+        if word.endswith(suffix) and _has_vowel(word[:-len(suffix)]) and len(word) - len(suffix) >= 3:
+            word = word[:-len(suffix)]
+            if word.endswith(("at", "bl", "iz")):
+                word += "e"
+            elif len(word) > 3 and word[-1] == word[-2] and word[-1] not in "lsz":
+                word = word[:-1]
+            break
+    return word
+
+
+@lru_cache(maxsize=500_000)
+def stem(token: str) -> str:
+    return stem_russian(token) if CYRILLIC_RE.search(token) else stem_english(token)
+
+
+def analyze(text: str) -> List[str]:
+    """Normalize, tokenize, drop stopwords and stem"""
+    return [stem(token) for token in TOKEN_RE.findall(normalize(text)) if token not in STOPWORDS]
+
+
+def trigrams(term: str) -> List[str]:
+    padded = f"${term}$"
+    return [padded[i:i + 3] for i in range(len(padded) - 2)]
+
+
+def within_edit_distance(a: str, b: str, max_distance: int) -> bool:
+    """Damerau-Levenshtein (optimal string alignment) bounded by max_distance"""
+    if abs(len(a) - len(b)) > max_distance:
+        return False
+    prev2, prev = None, list(range(len(b) + 1))
+    for i in range(1, len(a) + 1):
+        current = [i] + [0] * len(b)
+        for j in range(1, len(b) + 1):
+            cost = 0 if a[i - 1] == b[j - 1] else 1
+            current[j] = min(prev[j] + 1, current[j - 1] + 1, prev[j - 1] + cost)
+            if prev2 is not None and i > 1 and j > 1 and a[i - 1] == b[j - 2] and a[i - 2] == b[j - 1]:
+                current[j] = min(current[j], prev2[j - 2] + 1)
+        if min(current) > max_distance:
+            return False
+        prev2, prev = prev, current
+    return prev[-1] <= max_distance
+
+
+def bm25_impact(tf, doc_length, avg_length: float):
+    """The tf/length-normalization part of BM25; idf is applied at query time"""
+    return tf * (BM25_K1 + 1) / (tf + BM25_K1 * (1 - BM25_B + BM25_B * doc_length / avg_length))
+
+
+def _document_terms(doc: dict) -> Counter:
+    counts = Counter()
+    for term in analyze(doc.get("title") or ""):
+        counts[term] += TITLE_BOOST
+    for term in analyze(doc.get("description") or ""):
+        counts[term] += 1
+    return counts
+
+
+# === Index ===
+class IndexBuilder:
+    """Accumulates postings for a full rebuild in flat arrays, off the live index"""
+
+    def __init__(self):
+        self.vocabulary: Dict[str, int] = {}
+        self.doc_ids: List[str] = []
+        self.doc_lengths = array("f")
+        self._term_ids = array("i")
+        self._slots = array("i")
+        self._tfs = array("H")
+
+    def add_batch(self, docs: Iterable[dict]):
+        vocabulary = self.vocabulary
+        for doc in docs:
+            slot = len(self.doc_ids)
+            self.doc_ids.append(doc["id"])
+            counts = _document_terms(doc)
+            self.doc_lengths.append(sum(counts.values()))
+            for term, tf in counts.items():
+                term_id = vocabulary.setdefault(term, len(vocabulary))
+                self._term_ids.append(term_id)
+                self._slots.append(slot)
+                self._tfs.append(min(tf, 65535))
+
+    def finish(self) -> dict:
+        """Sort postings by term into one contiguous block with per-term offsets"""
+        term_ids = np.frombuffer(self._term_ids, dtype=np.int32)
+        slots = np.frombuffer(self._slots, dtype=np.int32)
+        tfs = np.frombuffer(self._tfs, dtype=np.uint16).astype(np.float32)
+        doc_lengths = np.frombuffer(self.doc_lengths, dtype=np.float32).copy()
+        avg_length = float(doc_lengths.mean()) if len(doc_lengths) else 0.0
+        impacts = bm25_impact(tfs, doc_lengths[slots], avg_length or 1.0)
+
+        # Group by term, best impact first within each term
+        order = np.lexsort((-impacts, term_ids))
+        counts = np.bincount(term_ids, minlength=len(self.vocabulary))
+        offsets = np.zeros(len(self.vocabulary) + 1, dtype=np.int64)
+        np.cumsum(counts, out=offsets[1:])
+
+        trigram_index: Dict[str, List[int]] = {}
+        for term, term_id in self.vocabulary.items():
+            for gram in trigrams(term):
+                trigram_index.setdefault(gram, []).append(term_id)
+
+        return {
+            "vocabulary": self.vocabulary,
+            "terms": list(self.vocabulary),
+            "doc_ids": self.doc_ids,
+            "doc_lengths": doc_lengths,
+            "avg_length": avg_length,
+            "postings_slots": slots[order],
+            "postings_impacts": impacts[order],
+            "offsets": offsets,
+            "trigrams": trigram_index
+        }
+
+
+class SearchIndex:
+    """BM25 index over products, updated in place between full rebuilds.
+
+    Postings from the last rebuild sit in one contiguous NumPy block; products
+    added since then go to small per-term delta lists. Updates re-add the
+    product under a fresh slot and tombstone the old one, so postings are
+    never edited in place; the periodic rebuild compacts tombstones away.
+    """
+
+    def __init__(self):
+        self.ready = False
+        self._replay: Optional[list] = None
+        self._load(IndexBuilder().finish())
+        self.stats = {"queries": 0, "fuzzy_expansions": 0, "rebuilds": 0}
+
+    def _load(self, built: dict):
+        self._vocabulary = built["vocabulary"]
+        self._terms = built["terms"]
+        self._doc_ids: List[Optional[str]] = built["doc_ids"]
+        self._slots = {doc_id: slot for slot, doc_id in enumerate(self._doc_ids)}
+        self._base_slots = built["postings_slots"]
+        self._base_impacts = built["postings_impacts"]
+        self._avg_length = built["avg_length"]
+        self._offsets = built["offsets"]
+        self._base_terms = len(self._offsets) - 1
+        self._trigrams = built["trigrams"]
+        self._delta: Dict[int, Tuple[List[int], List[float]]] = {}
+        self._compiled: Dict[int, Tuple[np.ndarray, np.ndarray]] = {}
+        self._doc_terms: Dict[int, List[int]] = {}  # term ids for slots added since the rebuild
+
+        size = max(1024, len(self._doc_ids) * 5 // 4)
+        self._doc_lengths = np.zeros(size, dtype=np.float32)
+        self._doc_lengths[:len(self._doc_ids)] = built["doc_lengths"]
+        self._alive = np.zeros(size, dtype=bool)
+        self._alive[:len(self._doc_ids)] = True
+        self._scores = np.zeros(size, dtype=np.float32)
+        self._live_docs = len(self._doc_ids)
+        self._total_length = float(built["doc_lengths"].sum())
+
+    def __len__(self) -> int:
+        return self._live_docs
+
+    # --- Rebuild ---
+    def begin_rebuild(self) -> IndexBuilder:
+        """Start recording writes so they can be replayed onto the rebuilt index"""
+        self._replay = []
+        return IndexBuilder()
+
+    @property
+    def rebuilding(self) -> bool:
+        return self._replay is not None
+
+    def abort_rebuild(self):
+        self._replay = None
+
+    def finish_rebuild(self, built: dict):
+        replay, self._replay = self._replay or [], None
+        self._load(built)
+        for op, payload in replay:
+            if op == "add":
+                self.add(payload)
+            else:
+                self.remove(payload)
+        self.ready = True
+        self.stats["rebuilds"] += 1
+
+    # --- Incremental updates ---
+    def _grow(self, needed: int):
+        if needed <= len(self._alive):
+            return
+        size = max(needed, len(self._alive) * 2)
+        for name in ("_doc_lengths", "_alive", "_scores"):
+            old = getattr(self, name)
+            grown = np.zeros(size, dtype=old.dtype)
+            grown[:len(old)] = old
+            setattr(self, name, grown)
+
+    def add(self, doc: dict):
+        """Index (or re-index) a product document with id/title/description"""
+        if self._replay is not None:
+            self._replay.append(("add", {"id": doc["id"], "title": doc.get("title"), "description": doc.get("description")}))
+        self.remove(doc["id"], record=False)
+
+        slot = len(self._doc_ids)
+        self._grow(slot + 1)
+        self._doc_ids.append(doc["id"])
+        self._slots[doc["id"]] = slot
+
+        counts = _document_terms(doc)
+        length = sum(counts.values())
+        # An index that started empty has no rebuild-time average to normalize against
+        avg_length = self._avg_length or (self._total_length + length) / (self._live_docs + 1)
+        term_ids = []
+        for term, tf in counts.items():
+            term_id = self._vocabulary.get(term)
+            if term_id is None:
+                term_id = self._vocabulary[term] = len(self._terms)
+                self._terms.append(term)
+                for gram in trigrams(term):
+                    self._trigrams.setdefault(gram, []).append(term_id)
+            slots, impacts = self._delta.setdefault(term_id, ([], []))
+            slots.append(slot)
+            impacts.append(bm25_impact(tf, length, avg_length))
+            self._compiled.pop(term_id, None)
+            term_ids.append(term_id)
+        self._doc_terms[slot] = term_ids
+
+        self._doc_lengths[slot] = length
+        self._alive[slot] = True
+        self._live_docs += 1
+        self._total_length += length
+
+    def remove(self, doc_id: str, record: bool = True):
+        if record and self._replay is not None:
+            self._replay.append(("remove", doc_id))
+        slot = self._slots.pop(doc_id, None)
+        if slot is None:
+            return
+        self._alive[slot] = False
+        self._doc_ids[slot] = None
+        self._live_docs -= 1
+        self._total_length -= float(self._doc_lengths[slot])
+        # Postings added since the rebuild are cheap to drop outright
+        for term_id in self._doc_terms.pop(slot, ()):
+            slots, impacts = self._delta[term_id]
+            index = slots.index(slot)
+            del slots[index]
+            del impacts[index]
+            self._compiled.pop(term_id, None)
+
+    # --- Querying ---
+    def _postings(self, term_id: int) -> Tuple[np.ndarray, np.ndarray]:
+        compiled = self._compiled.get(term_id)
+        if compiled is not None:
+            return compiled
+
+        if term_id < self._base_terms:
+            start, end = self._offsets[term_id], self._offsets[term_id + 1]
+            end = min(end, start + CHAMPION_LIST_SIZE)
+            base_slots, base_impacts = self._base_slots[start:end], self._base_impacts[start:end]
+        else:
+            base_slots = np.empty(0, dtype=np.int32)
+            base_impacts = np.empty(0, dtype=np.float32)
+
+        delta = self._delta.get(term_id)
+        if not delta or not delta[0]:
+            return base_slots, base_impacts
+        compiled = (
+            np.concatenate([base_slots, np.asarray(delta[0], dtype=np.int32)]),
+            np.concatenate([base_impacts, np.asarray(delta[1], dtype=np.float32)])
+        )
+        self._compiled[term_id] = compiled
+        return compiled
+
+    def _document_frequency(self, term_id: int) -> int:
+        base = int(self._offsets[term_id + 1] - self._offsets[term_id]) if term_id < self._base_terms else 0
+        delta = self._delta.get(term_id)
+        return base + (len(delta[0]) if delta else 0)
+
+    def _fuzzy_terms(self, term: str) -> List[Tuple[int, float]]:
+        """Vocabulary terms within a small edit distance, found via shared trigrams"""
+        grams = trigrams(term)
+        shared = Counter()
+        for gram in grams:
+            postings = self._trigrams.get(gram)
+            if postings and len(postings) <= FUZZY_MAX_TRIGRAM_POSTINGS:
+                shared.update(postings)
+
+        max_distance = 1 if len(term) <= 5 else 2
+        expansions = []
+        for term_id, overlap in shared.most_common(50):
+            candidate = self._terms[term_id]
+            # Jaccard over padded trigrams; a term of length n has n of them
+            similarity = overlap / (len(grams) + len(candidate) - overlap)
+            if similarity < 0.25:
+                break
+            if within_edit_distance(term, candidate, max_distance):
+                expansions.append((term_id, FUZZY_WEIGHT * similarity))
+                if len(expansions) == FUZZY_MAX_EXPANSIONS:
+                    break
+        return expansions
+
+    def search(self, query: str, limit: int = 20) -> List[str]:
+        """Product ids ranked by BM25 relevance, best first"""
+        self.stats["queries"] += 1
+        weighted_terms: Dict[int, float] = {}
+        for term in set(analyze(query)):
+            term_id = self._vocabulary.get(term)
+            if term_id is not None and len(self._postings(term_id)[0]):
+                weighted_terms[term_id] = 1.0
+            elif len(term) >= FUZZY_MIN_LENGTH:
+                for fuzzy_id, weight in self._fuzzy_terms(term):
+                    self.stats["fuzzy_expansions"] += 1
+                    weighted_terms[fuzzy_id] = max(weight, weighted_terms.get(fuzzy_id, 0.0))
+        if not weighted_terms or not self._live_docs:
+            return []
+
+        scores = self._scores
+        touched = []
+        for term_id, weight in weighted_terms.items():
+            slots, impacts = self._postings(term_id)
+            if not len(slots):
+                continue
+            df = self._document_frequency(term_id)
+            idf = math.log(1 + (max(self._live_docs - df, 0) + 0.5) / (df + 0.5))
+            # A slot appears at most once per term, so fancy-index += is exact here
+            scores[slots] += np.float32(weight * idf) * impacts
+            touched.append(slots)
+        if not touched:
+            return []
+
+        candidates = np.concatenate(touched)
+        candidate_scores = np.where(self._alive[candidates], scores[candidates], 0.0)
+        scores[candidates] = 0.0  # reset the shared accumulator for the next query
+
+        # Candidates may repeat (one entry per matched term), so over-select then dedupe
+        wanted = min(len(candidates), limit * len(touched))
+        top = np.argpartition(-candidate_scores, wanted - 1)[:wanted]
+        top = top[np.argsort(-candidate_scores[top], kind="stable")]
+
+        results, seen = [], set()
+        for index in top:
+            if candidate_scores[index] <= 0:
+                break
+            slot = int(candidates[index])
+            if slot in seen:
+                continue
+            seen.add(slot)
+            results.append(self._doc_ids[slot])
+            if len(results) == limit:
+                break
+        return results
+
+    def metrics(self) -> dict:
+        return {
+            **self.stats,
+            "ready": self.ready,
+            "documents": self._live_docs,
+            "tombstones": len(self._doc_ids) - self._live_docs,
+            "terms": len(self._terms)
+        }
@@ -1,34 +1,154 @@
-from fastapi import FastAPI, APIRouter, HTTPException, Depends, status, Request, UploadFile, File
+from fastapi import FastAPI, APIRouter, HTTPException, Depends, status, Request, Response, UploadFile, File
 from fastapi.security import HTTPBearer, HTTPAuthorizationCredentials
 from fastapi.staticfiles import StaticFiles
+from fastapi.responses import StreamingResponse
 from dotenv import load_dotenv
 from starlette.middleware.cors import CORSMiddleware
 from motor.motor_asyncio import AsyncIOMotorClient
+from pymongo import InsertOne, ReturnDocument
+from pymongo.errors import BulkWriteError, DuplicateKeyError
 import os
+import re
 import logging
 from pathlib import Path
-from pydantic import BaseModel, Field, ConfigDict, EmailStr
-from typing import List, Optional, Dict, Any
+from pydantic import BaseModel, Field, ConfigDict, EmailStr, ValidationError
+from typing import List, Literal, Optional, Dict, Any, Union
 import uuid
+import asyncio
+import multiprocessing
+import time
+from concurrent.futures import ProcessPoolExecutor
 from datetime import datetime, timezone, timedelta, timedelta
-import bcrypt
 import jwt
 import shutil
 import httpx
-from emergentintegrations.payments.stripe.checkout import StripeCheckout, CheckoutSessionResponse, CheckoutStatusResponse, CheckoutSessionRequest
+from cachetools import TTLCache
+from passwords import PasswordHasher, PasswordHasherBusy
+from revocation import RevocationList
+from search import SearchIndex
+from suggest import SuggestIndex
+from pagination import Keyset, InvalidCursor, encode_cursor, decode_cursor
+from view_counter import ViewCounter
+from similarity import build_product_similarity
+from recommendations import refresh_recommendations
+from product_cache import ProductCache
+from http_cache import ResponseCache, conditional_response, render_json
+from fast_json import fast_response, parse_fields, fields_projection, shape
+from bulk_import import CONTENT_TYPES, ImportFormatError, detect_format, export_rows, read_rows
+from reservations import ConversionBusy, HoldExists, OutOfStock, StockReservations, merge_quantities
+from notifications import NotificationQueue
+from webhook_inbox import WebhookInbox
+from payments import InvalidWebhook, PaymentRejected, PaymentUnavailable, StubGateway, create_gateway
+from balances import AccountNotFound, Balances, InsufficientBalance
+from ledger import Ledger, user_account
 
 ROOT_DIR = Path(__file__).parent
 load_dotenv(ROOT_DIR / '.env')
 
 # MongoDB connection
 mongo_url = os.environ['MONGO_URL']
-client = AsyncIOMotorClient(mongo_url)
+client = AsyncIOMotorClient(mongo_url, tz_aware=True)
 db = client[os.environ['DB_NAME']]
 
 # JWT Config
 JWT_SECRET = os.environ.get('JWT_SECRET', 'your-secret-key-change-in-production')
 JWT_ALGORITHM = os.environ.get('JWT_ALGORITHM', 'HS256')
-ACCESS_TOKEN_EXPIRE_MINUTES = 60 * 24 * 7  # 7 days
+# Role-carrying tokens let role checks skip the user lookup; they pair a
+# short-lived access token with a refresh token, which the frontend trades
+# for a new pair whenever a request comes back 401
+JWT_ROLE_CLAIMS = os.environ.get('JWT_ROLE_CLAIMS', 'false').lower() == 'true'
+ACCESS_TOKEN_EXPIRE_MINUTES = int(os.environ.get(
+    'ACCESS_TOKEN_EXPIRE_MINUTES', 15 if JWT_ROLE_CLAIMS else 60 * 24 * 7  # 15 minutes / 7 days
+))
+REFRESH_TOKEN_EXPIRE_MINUTES = int(os.environ.get('REFRESH_TOKEN_EXPIRE_MINUTES', 60 * 24 * 7))  # 7 days
+REVOCATION_REFRESH_SECONDS = int(os.environ.get('REVOCATION_REFRESH_SECONDS', '30'))
+revocation_list = RevocationList()
+
+# Principal cache (users resolved by get_current_user)
+USER_CACHE_MAXSIZE = int(os.environ.get('USER_CACHE_MAXSIZE', '10000'))
+USER_CACHE_TTL_SECONDS = int(os.environ.get('USER_CACHE_TTL_SECONDS', '60'))
+user_cache = TTLCache(maxsize=USER_CACHE_MAXSIZE, ttl=USER_CACHE_TTL_SECONDS)
+user_cache_stats = {"hits": 0, "misses": 0, "invalidations": 0}
+
+# Password hashing (bcrypt runs off the event loop)
+BCRYPT_TARGET_MS = float(os.environ.get('BCRYPT_TARGET_MS', '250'))  # 0 disables calibration
+password_hasher = PasswordHasher(
+    max_workers=int(os.environ.get('BCRYPT_WORKERS', '4')),
+    max_pending=int(os.environ.get('BCRYPT_MAX_PENDING', '64')),
+    rounds=int(os.environ.get('BCRYPT_ROUNDS', '12'))
+)
+
+# Full-text product search (in-process index, $regex only as a fallback)
+SEARCH_REBUILD_SECONDS = int(os.environ.get('SEARCH_REBUILD_SECONDS', '600'))
+SEARCH_MAX_RESULTS = int(os.environ.get('SEARCH_MAX_RESULTS', '1000'))
+search_index = SearchIndex()
+suggest_index = SuggestIndex()
+
+# Keyset pagination: list endpoints return the next page's cursor in X-Next-Cursor
+MAX_PAGE_SIZE = 100
+NEWEST_FIRST = Keyset(("created_at", -1), ("id", -1))
+BLOG_NEWEST_FIRST = Keyset(("published_at", -1), ("id", -1))
+PRODUCT_SORTS = {
+    "new": NEWEST_FIRST,
+    "price": Keyset(("price", 1), ("id", 1)),
+    "popular": Keyset(("sales_count", -1), ("id", -1))
+}
+
+# Catalog facets; counts for unfiltered category pages are cached until a product write
+PRODUCT_FACETS = ("category", "product_type", "price")
+PRICE_BUCKETS = [0, 100, 500, 1000, 5000]
+FACET_CACHE_TTL_SECONDS = int(os.environ.get('FACET_CACHE_TTL_SECONDS', '300'))
+facet_cache = TTLCache(maxsize=1024, ttl=FACET_CACHE_TTL_SECONDS)
+
+# Product views are counted in memory and written back in batches
+VIEW_FLUSH_SECONDS = float(os.environ.get('VIEW_FLUSH_SECONDS', '5'))
+view_counter = ViewCounter(max_pending=int(os.environ.get('VIEW_FLUSH_MAX_PENDING', '5000')))
+RECENTLY_VIEWED_LIMIT = int(os.environ.get('RECENTLY_VIEWED_LIMIT', '20'))
+
+# Item-to-item similarity (product_similarity) is recomputed in the background; 0 disables
+SIMILARITY_REBUILD_SECONDS = int(os.environ.get('SIMILARITY_REBUILD_SECONDS', '3600'))
+
+# Personalized feed: ALS retrains in a worker process; 0 disables the refresh job
+RECOMMENDATIONS_REFRESH_SECONDS = int(os.environ.get('RECOMMENDATIONS_REFRESH_SECONDS', '3600'))
+recommendation_executor = ProcessPoolExecutor(max_workers=1, mp_context=multiprocessing.get_context("spawn"))
+recommendation_cache = TTLCache(maxsize=USER_CACHE_MAXSIZE, ttl=300)
+popular_cache = TTLCache(maxsize=1, ttl=300)
+
+# Conditional GETs: public endpoints send validators and a CDN-friendly Cache-Control
+PUBLIC_CACHE_MAX_AGE = int(os.environ.get('PUBLIC_CACHE_MAX_AGE', '60'))
+PUBLIC_CACHE_CONTROL = f"public, max-age={PUBLIC_CACHE_MAX_AGE}, stale-while-revalidate={PUBLIC_CACHE_MAX_AGE * 5}"
+# Product pages always revalidate so every hit still reaches the view counter (as a cheap 304)
+PRODUCT_CACHE_CONTROL = "public, max-age=0, must-revalidate"
+response_cache = ResponseCache(ttl=int(os.environ.get('RESPONSE_CACHE_TTL_SECONDS', '30')))
+
+# Seller catalogue import: rows are validated and inserted in chunks as the upload streams in
+BULK_IMPORT_MAX_ROWS = int(os.environ.get('BULK_IMPORT_MAX_ROWS', '10000'))
+BULK_IMPORT_CHUNK = int(os.environ.get('BULK_IMPORT_CHUNK', '500'))
+BULK_IMPORT_MAX_ERRORS = 100  # per-row errors reported back; the rest are only counted
+
+MAX_ORDER_ITEMS = 100
+
+# Orders hold their stock until paid; unpaid holds are swept back into stock
+RESERVATION_SWEEP_SECONDS = float(os.environ.get('RESERVATION_SWEEP_SECONDS', '30'))
+stock_reservations = StockReservations(ttl_seconds=int(os.environ.get('RESERVATION_TTL_SECONDS', '900')))
+
+# Checkouts nobody polled are settled by asking the provider in the background
+PAYMENT_RECONCILE_SECONDS = float(os.environ.get('PAYMENT_RECONCILE_SECONDS', '60'))
+PAYMENT_RECONCILE_AFTER_SECONDS = int(os.environ.get('PAYMENT_RECONCILE_AFTER_SECONDS', '120'))
+PAYMENT_RECONCILE_MAX_AGE_HOURS = int(os.environ.get('PAYMENT_RECONCILE_MAX_AGE_HOURS', '48'))
+PAYMENT_RECONCILE_BATCH = 200
+PAYMENT_RECONCILE_CONCURRENCY = int(os.environ.get('PAYMENT_RECONCILE_CONCURRENCY', '8'))
+payment_reconcile_stats = {
+    "runs": 0, "skipped": 0, "checked": 0, "fulfilled": 0, "resumed": 0, "expired": 0, "unavailable": 0, "refused": 0
+}
+
+# Balance changes are conditional $inc updates tied to their transaction record and ledger entry
+ledger = Ledger(lag_seconds=float(os.environ.get('LEDGER_CHECKPOINT_LAG_SECONDS', '300')))
+balances = Balances(ledger)
+BALANCE_RECOVERY_SECONDS = float(os.environ.get('BALANCE_RECOVERY_SECONDS', '60'))
+LEDGER_CHECKPOINT_SECONDS = float(os.environ.get('LEDGER_CHECKPOINT_SECONDS', '600'))
+# The verifier reads every user and every account's tail; 0 disables the scheduled run
+LEDGER_VERIFY_SECONDS = float(os.environ.get('LEDGER_VERIFY_SECONDS', '3600'))
 
 # Telegram Bot Config
 TELEGRAM_BOT_TOKEN = os.environ.get('TELEGRAM_BOT_TOKEN', '')
@@ -54,8 +174,35 @@ async def send_telegram_notification(telegram_id: int, message: str):
         logging.error(f"Failed to send Telegram notification: {e}")
         return False
 
-# Stripe Config
-stripe_api_key = os.environ['STRIPE_API_KEY']
+# Telegram sends run on background workers so handlers never wait on the Bot API
+notification_queue = NotificationQueue(
+    send_telegram_notification,
+    maxsize=int(os.environ.get('NOTIFICATION_QUEUE_SIZE', '10000')),
+    workers=int(os.environ.get('NOTIFICATION_WORKERS', '4'))
+)
+
+# Payments: one gateway per process. PAYMENT_PROVIDER=stub runs checkout against a
+# local fake (sessions in Mongo, shared by all workers) so the whole flow can be
+# load-tested offline; with several workers, set STUB_WEBHOOK_SECRET
+PAYMENT_PROVIDER = os.environ.get('PAYMENT_PROVIDER', 'stripe')
+PAYMENT_PUBLIC_URL = os.environ.get('REACT_APP_BACKEND_URL', 'http://localhost:8001')
+_payment_timeouts = {
+    "timeout": float(os.environ.get('PAYMENT_TIMEOUT_SECONDS', '10')),
+    "failure_threshold": int(os.environ.get('PAYMENT_BREAKER_FAILURES', '5')),
+    "reset_seconds": float(os.environ.get('PAYMENT_BREAKER_RESET_SECONDS', '30'))
+}
+if PAYMENT_PROVIDER == "stub":
+    payment_gateway = create_gateway(
+        "stub", base_url=PAYMENT_PUBLIC_URL, sessions=db.stub_payment_sessions,
+        secret=os.environ.get('STUB_WEBHOOK_SECRET'), **_payment_timeouts
+    )
+else:
+    payment_gateway = create_gateway(
+        PAYMENT_PROVIDER,
+        api_key=os.environ['STRIPE_API_KEY'],
+        webhook_url=f"{PAYMENT_PUBLIC_URL}/api/webhook/stripe",
+        **_payment_timeouts
+    )
 
 # Security
 security = HTTPBearer()
@@ -98,9 +245,16 @@ class User(BaseModel):
 
 class TokenResponse(BaseModel):
     access_token: str
+    refresh_token: Optional[str] = None
     token_type: str = "bearer"
     user: User
 
+class RefreshRequest(BaseModel):
+    refresh_token: str
+
+class LogoutRequest(BaseModel):
+    refresh_token: Optional[str] = None
+
 # === Product Models ===
 class ProductCreate(BaseModel):
     title: str
@@ -125,6 +279,22 @@ class Product(BaseModel):
     sales_count: int = 0
     views_count: int = 0
     created_at: datetime
+    updated_at: Optional[datetime] = None
+
+product_cache = ProductCache(
+    Product.model_validate,
+    maxsize=int(os.environ.get('PRODUCT_CACHE_MAXSIZE', '10000')),
+    ttl=int(os.environ.get('PRODUCT_CACHE_TTL_SECONDS', '60'))
+)
+
+class FacetCount(BaseModel):
+    value: Optional[str] = None
+    count: int
+
+class ProductFacetPage(BaseModel):
+    items: List[Product]
+    facets: Dict[str, List[FacetCount]]
+    total: int
 
 # === Category Models ===
 class CategoryCreate(BaseModel):
@@ -149,10 +319,16 @@ class OrderItem(BaseModel):
     product_id: str
     title: str
     price: float
-    quantity: int
+    quantity: int = Field(gt=0)
+    seller_id: Optional[str] = None
+
+class OrderItemCreate(BaseModel):
+    product_id: str
+    quantity: int = Field(gt=0)
 
 class OrderCreate(BaseModel):
-    items: List[OrderItem]
+    # Titles and prices are looked up server-side; anything else the client sends is ignored
+    items: List[OrderItemCreate] = Field(min_length=1, max_length=MAX_ORDER_ITEMS)
     currency: str = "usd"
 
 class Order(BaseModel):
@@ -164,6 +340,7 @@ class Order(BaseModel):
     currency: str
     status: str  # pending, paid, completed, cancelled
     payment_id: Optional[str] = None
+    reserved_until: Optional[datetime] = None
     created_at: datetime
 
 # === Payment Models ===
@@ -230,13 +407,14 @@ class Transaction(BaseModel):
     description: Optional[str] = None
     created_at: datetime
 
+# The method names the external ledger account the money moves through, so only known ones are accepted
 class DepositRequest(BaseModel):
-    amount: float
-    method: str = "stripe"  # stripe, card, etc.
+    amount: float = Field(gt=0)
+    method: Literal["stripe", "card"] = "stripe"
 
 class WithdrawalRequest(BaseModel):
-    amount: float
-    method: str = "bank_transfer"
+    amount: float = Field(gt=0)
+    method: Literal["bank_transfer", "card"] = "bank_transfer"
     account_details: Optional[str] = None
 
 # === Chat Models ===
@@ -309,39 +487,171 @@ class Review(BaseModel):
     product_title: Optional[str] = None
 
 # === Helper Functions ===
-def hash_password(password: str) -> str:
-    return bcrypt.hashpw(password.encode('utf-8'), bcrypt.gensalt()).decode('utf-8')
+async def hash_password(password: str) -> str:
+    try:
+        return await password_hasher.hash(password)
+    except PasswordHasherBusy:
+        raise HTTPException(status_code=503, detail="Server is busy, please try again")
 
-def verify_password(password: str, hashed: str) -> bool:
-    return bcrypt.checkpw(password.encode('utf-8'), hashed.encode('utf-8'))
+async def verify_password(password: str, hashed: str) -> bool:
+    try:
+        return await password_hasher.verify(password, hashed)
+    except PasswordHasherBusy:
+        raise HTTPException(status_code=503, detail="Server is busy, please try again")
 
-def create_access_token(data: dict) -> str:
+def create_access_token(data: dict, token_type: str = "access", expire_minutes: Optional[int] = None) -> str:
     to_encode = data.copy()
-    expire = datetime.now(timezone.utc) + timedelta(minutes=ACCESS_TOKEN_EXPIRE_MINUTES)
-    to_encode.update({"exp": expire})
+    expire = datetime.now(timezone.utc) + timedelta(minutes=expire_minutes or ACCESS_TOKEN_EXPIRE_MINUTES)
+    # iat is kept fractional so a revocation cutoff doesn't catch tokens issued in the same second
+    to_encode.update({"exp": expire, "iat": time.time(), "jti": uuid.uuid4().hex, "type": token_type})
     return jwt.encode(to_encode, JWT_SECRET, algorithm=JWT_ALGORITHM)
 
-async def get_current_user(credentials: HTTPAuthorizationCredentials = Depends(security)) -> dict:
+def issue_tokens(user: dict) -> tuple:
+    """Create an access/refresh token pair for a user document"""
+    claims = {"sub": user["id"], "ver": user.get("token_version", 0)}
+    access_claims = {**claims, "role": user.get("role")} if JWT_ROLE_CLAIMS else claims
+    access_token = create_access_token(access_claims)
+    refresh_token = create_access_token(claims, token_type="refresh", expire_minutes=REFRESH_TOKEN_EXPIRE_MINUTES)
+    return access_token, refresh_token
+
+def decode_token(token: str, token_type: str = "access") -> dict:
+    """Verify signature, expiry, type and revocation of a token"""
     try:
-        token = credentials.credentials
         payload = jwt.decode(token, JWT_SECRET, algorithms=[JWT_ALGORITHM])
-        user_id = payload.get("sub")
-        if not user_id:
-            raise HTTPException(status_code=401, detail="Invalid token")
-        user = await db.users.find_one({"id": user_id}, {"_id": 0})
-        if not user:
-            raise HTTPException(status_code=401, detail="User not found")
-        return user
     except jwt.ExpiredSignatureError:
         raise HTTPException(status_code=401, detail="Token expired")
     except jwt.InvalidTokenError:
         raise HTTPException(status_code=401, detail="Invalid token")
+    
+    # Tokens issued before typed tokens existed are access tokens
+    if not payload.get("sub") or payload.get("type", "access") != token_type:
+        raise HTTPException(status_code=401, detail="Invalid token")
+    if revocation_list.is_revoked(payload.get("jti"), payload["sub"], payload.get("iat", 0)):
+        raise HTTPException(status_code=401, detail="Token revoked")
+    return payload
+
+async def revoke_user_tokens(user_id: str):
+    """Invalidate every token issued to a user so far (role change, deletion)"""
+    expires_at = datetime.now(timezone.utc) + timedelta(
+        minutes=max(ACCESS_TOKEN_EXPIRE_MINUTES, REFRESH_TOKEN_EXPIRE_MINUTES)
+    )
+    await revocation_list.revoke_user(db.revoked_tokens, user_id, expires_at)
+
+async def get_cached_user(user_id: str) -> Optional[dict]:
+    """Resolve a user by id, serving from the principal cache when possible.
+
+    Returns a shallow copy so handlers can mutate the result freely.
+    """
+    cached = user_cache.get(user_id)
+    if cached is not None:
+        user_cache_stats["hits"] += 1
+        return dict(cached)
+    
+    user_cache_stats["misses"] += 1
+    epoch = user_cache_stats["invalidations"]
+    user = await db.users.find_one({"id": user_id}, {"_id": 0})
+    if not user:
+        return None
+    # Don't store a document that was invalidated while we were reading it
+    if epoch == user_cache_stats["invalidations"]:
+        user_cache[user_id] = user
+    return dict(user)
+
+async def get_cached_users(user_ids) -> Dict[str, dict]:
+    """Like get_cached_user for many ids, with one $in query for the misses"""
+    found, missing = {}, []
+    for user_id in dict.fromkeys(user_ids):
+        cached = user_cache.get(user_id)
+        if cached is not None:
+            found[user_id] = dict(cached)
+        else:
+            missing.append(user_id)
+    user_cache_stats["hits"] += len(found)
+    user_cache_stats["misses"] += len(missing)
+    
+    if missing:
+        epoch = user_cache_stats["invalidations"]
+        async for user in db.users.find({"id": {"$in": missing}}, {"_id": 0}):
+            if epoch == user_cache_stats["invalidations"]:
+                user_cache[user["id"]] = user
+            found[user["id"]] = dict(user)
+    return found
+
+def invalidate_user_cache(user_id: str):
+    """Drop a user from the principal cache after any write to their document"""
+    user_cache_stats["invalidations"] += 1
+    user_cache.pop(user_id, None)
+
+async def get_token_claims(credentials: HTTPAuthorizationCredentials = Depends(security)) -> dict:
+    return decode_token(credentials.credentials)
+
+async def get_current_user(claims: dict = Depends(get_token_claims)) -> dict:
+    user = await get_cached_user(claims["sub"])
+    if not user:
+        raise HTTPException(status_code=401, detail="User not found")
+    if claims.get("ver", 0) != user.get("token_version", 0):
+        raise HTTPException(status_code=401, detail="Token revoked")
+    return user
+
+async def require_admin(claims: dict = Depends(get_token_claims)) -> dict:
+    """The admin making the request: ``id`` and ``role`` only when the token
+    carries its role, the full user otherwise.
 
-async def require_admin(user: dict = Depends(get_current_user)) -> dict:
+    A role claim is trusted without loading the user (role changes revoke
+    the user's tokens); handlers that need more of the admin load it.
+    """
+    if "role" in claims:
+        if claims["role"] != "admin":
+            raise HTTPException(status_code=403, detail="Admin access required")
+        return {"id": claims["sub"], "role": "admin"}
+    user = await get_current_user(claims)
     if user.get("role") != "admin":
         raise HTTPException(status_code=403, detail="Admin access required")
     return user
 
+def keyset_query(keyset: Keyset, query: dict, cursor: Optional[str]) -> dict:
+    try:
+        return keyset.after(query, cursor)
+    except InvalidCursor:
+        raise HTTPException(status_code=400, detail="Invalid cursor")
+
+def date_range(field: str, **bounds: datetime) -> dict:
+    """Range filter on a date field, e.g. ``date_range("created_at", gte=start)``.
+
+    BSON never compares a date with a string, so rows that migrate_datetimes.py
+    has not converted yet are matched by their ISO string form as well.
+    """
+    dates = {f"${op}": value for op, value in bounds.items()}
+    strings = {f"${op}": value.isoformat() for op, value in bounds.items()}
+    return {"$or": [{field: dates}, {field: strings}]}
+
+def parse_response_fields(model, fields: Optional[str]) -> tuple:
+    try:
+        return parse_fields(model, fields)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+
+def set_next_cursor(response: Response, cursor: Optional[str]):
+    if cursor:
+        response.headers["X-Next-Cursor"] = cursor
+
+async def find_page(
+    collection, query: dict, projection: dict, keyset: Keyset,
+    response: Response, cursor: Optional[str] = None, skip: int = 0, limit: int = 20
+) -> List[dict]:
+    """One page of ``collection`` in keyset order.
+
+    ``skip`` is still honoured for clients that have not moved to cursors,
+    but only on the first page: a cursor already encodes the position.
+    """
+    limit = max(1, min(limit, MAX_PAGE_SIZE))
+    find = collection.find(keyset_query(keyset, query, cursor), projection).sort(keyset.sort)
+    if skip and not cursor:
+        find = find.skip(skip)
+    docs = await find.limit(limit).to_list(limit)
+    set_next_cursor(response, keyset.next_cursor(docs, limit))
+    return docs
+
 async def require_seller(user: dict = Depends(get_current_user)) -> dict:
     # Allow all authenticated users to sell
     return user
@@ -411,36 +721,75 @@ async def register(data: UserRegister):
     user_doc = {
         "id": user_id,
         "email": data.email,
-        "password_hash": hash_password(data.password),
+        "password_hash": await hash_password(data.password),
         "full_name": data.full_name,
         "role": data.role,
         "avatar": None,
         "balance": 0.0,
-        "created_at": datetime.now(timezone.utc).isoformat()
+        "created_at": datetime.now(timezone.utc)
     }
     await db.users.insert_one(user_doc)
     
     user_doc.pop("password_hash")
-    user_doc["created_at"] = datetime.fromisoformat(user_doc["created_at"])
     
-    access_token = create_access_token({"sub": user_id})
-    return TokenResponse(access_token=access_token, user=User(**user_doc))
+    access_token, refresh_token = issue_tokens(user_doc)
+    return TokenResponse(access_token=access_token, refresh_token=refresh_token, user=User(**user_doc))
 
 @api_router.post("/auth/login", response_model=TokenResponse)
 async def login(data: UserLogin):
     user = await db.users.find_one({"email": data.email}, {"_id": 0})
-    if not user or not verify_password(data.password, user["password_hash"]):
+    if not user or not await verify_password(data.password, user.get("password_hash", "")):
         raise HTTPException(status_code=401, detail="Invalid credentials")
     
+    # Upgrade hashes made with a lower bcrypt cost on successful login
+    if password_hasher.needs_rehash(user["password_hash"]):
+        new_hash = await hash_password(data.password)
+        await db.users.update_one({"id": user["id"]}, {"$set": {"password_hash": new_hash}})
+        invalidate_user_cache(user["id"])
+    
     user.pop("password_hash")
-    user["created_at"] = datetime.fromisoformat(user["created_at"])
     
-    access_token = create_access_token({"sub": user["id"]})
-    return TokenResponse(access_token=access_token, user=User(**user))
+    access_token, refresh_token = issue_tokens(user)
+    return TokenResponse(access_token=access_token, refresh_token=refresh_token, user=User(**user))
+
+@api_router.post("/auth/refresh", response_model=TokenResponse)
+async def refresh_access_token(data: RefreshRequest):
+    """Exchange a refresh token for a new token pair (the old refresh token is revoked)"""
+    payload = decode_token(data.refresh_token, token_type="refresh")
+    user = await get_cached_user(payload["sub"])
+    if not user or payload.get("ver", 0) != user.get("token_version", 0):
+        raise HTTPException(status_code=401, detail="Token revoked")
+    
+    await revocation_list.revoke_token(
+        db.revoked_tokens, payload["jti"], datetime.fromtimestamp(payload["exp"], tz=timezone.utc)
+    )
+    
+    user.pop("password_hash", None)
+    access_token, refresh_token = issue_tokens(user)
+    return TokenResponse(access_token=access_token, refresh_token=refresh_token, user=User(**user))
+
+@api_router.post("/auth/logout")
+async def logout(data: Optional[LogoutRequest] = None, claims: dict = Depends(get_token_claims)):
+    """Revoke the current access token and, if given, its refresh token"""
+    if claims.get("jti"):
+        await revocation_list.revoke_token(
+            db.revoked_tokens, claims["jti"], datetime.fromtimestamp(claims["exp"], tz=timezone.utc)
+        )
+    
+    if data and data.refresh_token:
+        try:
+            refresh = decode_token(data.refresh_token, token_type="refresh")
+        except HTTPException:
+            refresh = None
+        if refresh and refresh["sub"] == claims["sub"]:
+            await revocation_list.revoke_token(
+                db.revoked_tokens, refresh["jti"], datetime.fromtimestamp(refresh["exp"], tz=timezone.utc)
+            )
+    
+    return {"message": "Logged out"}
 
 @api_router.get("/auth/me", response_model=User)
 async def get_me(user: dict = Depends(get_current_user)):
-    user["created_at"] = datetime.fromisoformat(user["created_at"])
     return User(**user)
 
 # === Telegram Auth Routes ===
@@ -518,11 +867,11 @@ async def telegram_widget_auth(data: TelegramWidgetData):
                 {"telegram_id": telegram_id},
                 {"$set": {"telegram_username": data.username}}
             )
+            invalidate_user_cache(user["id"])
             user["telegram_username"] = data.username
         
-        access_token = create_access_token(data={"sub": user["id"]})
-        user["created_at"] = datetime.fromisoformat(user["created_at"])
-        return TokenResponse(access_token=access_token, user=User(**user))
+        access_token, refresh_token = issue_tokens(user)
+        return TokenResponse(access_token=access_token, refresh_token=refresh_token, user=User(**user))
     else:
         # New user - auto-register
         user_id = str(uuid.uuid4())
@@ -536,16 +885,15 @@ async def telegram_widget_auth(data: TelegramWidgetData):
             "balance": 0.0,
             "telegram_id": telegram_id,
             "telegram_username": data.username,
-            "created_at": datetime.now(timezone.utc).isoformat()
+            "created_at": datetime.now(timezone.utc)
         }
         
         await db.users.insert_one(new_user)
         
         # Create JWT token
-        access_token = create_access_token(data={"sub": user_id})
-        new_user["created_at"] = datetime.fromisoformat(new_user["created_at"])
+        access_token, refresh_token = issue_tokens(new_user)
         
-        return TokenResponse(access_token=access_token, user=User(**new_user))
+        return TokenResponse(access_token=access_token, refresh_token=refresh_token, user=User(**new_user))
 
 @api_router.post("/auth/telegram/link")
 async def link_telegram_account(data: TelegramWidgetData, user: dict = Depends(get_current_user)):
@@ -585,6 +933,7 @@ async def link_telegram_account(data: TelegramWidgetData, user: dict = Depends(g
             "telegram_username": data.username
         }}
     )
+    invalidate_user_cache(user["id"])
     
     return {"message": "Telegram account linked successfully"}
 
@@ -602,42 +951,43 @@ async def unlink_telegram_account(user: dict = Depends(get_current_user)):
         {"id": user["id"]},
         {"$unset": {"telegram_id": "", "telegram_username": ""}}
     )
+    invalidate_user_cache(user["id"])
     
     return {"message": "Telegram account unlinked successfully"}
 
+async def consume_bot_token(token: str) -> Optional[dict]:
+    """Atomically mark a bot login token as used and return it.
+
+    A single find-and-modify, so two concurrent redemptions of the same
+    token can never both succeed. Expired rows are purged by the TTL index.
+    """
+    now = datetime.now(timezone.utc)
+    return await db.telegram_auth_tokens.find_one_and_update(
+        {"token": token, "used": False, "expires_at": {"$gt": now}},
+        {"$set": {"used": True, "used_at": now}},
+        projection={"_id": 0, "user_id": 1}
+    )
+
 @api_router.post("/auth/telegram/bot-token", response_model=TokenResponse)
 async def auth_with_bot_token(token: str):
     """
     Authenticate user with one-time token from Telegram bot
     Token is generated by the bot when user sends /start
     """
-    # Find token in database
-    token_doc = await db.telegram_auth_tokens.find_one({"token": token, "used": False}, {"_id": 0})
-    
+    token_doc = await consume_bot_token(token)
     if not token_doc:
         raise HTTPException(status_code=401, detail="Invalid or expired token")
     
-    # Check expiration
-    expires_at = datetime.fromisoformat(token_doc["expires_at"])
-    if datetime.now(timezone.utc) > expires_at:
-        # Mark as used to cleanup
-        await db.telegram_auth_tokens.update_one({"token": token}, {"$set": {"used": True}})
-        raise HTTPException(status_code=401, detail="Token expired")
-    
-    # Mark token as used (one-time use)
-    await db.telegram_auth_tokens.update_one({"token": token}, {"$set": {"used": True}})
-    
     # Find user
-    user = await db.users.find_one({"id": token_doc["user_id"]}, {"_id": 0})
+    user = await get_cached_user(token_doc["user_id"])
     
     if not user:
         raise HTTPException(status_code=404, detail="User not found")
     
     # Create JWT token
-    access_token = create_access_token(data={"sub": user["id"]})
-    user["created_at"] = datetime.fromisoformat(user["created_at"])
+    access_token, refresh_token = issue_tokens(user)
     
-    return TokenResponse(access_token=access_token, user=User(**user))
+    return TokenResponse(access_token=access_token, refresh_token=refresh_token, user=User(**user))
 
 # === Balance & Transactions Routes ===
 @api_router.get("/balance")
@@ -648,118 +998,251 @@ async def get_balance(user: dict = Depends(get_current_user)):
 @api_router.post("/balance/deposit")
 async def deposit_balance(request: DepositRequest, user: dict = Depends(get_current_user)):
     """Deposit money to user balance"""
-    # Create transaction record
     transaction = {
-        "id": str(uuid.uuid4()),
-        "user_id": user["id"],
-        "amount": request.amount,
         "type": "deposit",
-        "status": "completed",  # In real app, would be "pending" until payment confirmed
         "method": request.method,
-        "description": f"Deposit via {request.method}",
-        "created_at": datetime.now(timezone.utc).isoformat()
+        "description": f"Deposit via {request.method}"
     }
-    await db.transactions.insert_one(transaction)
-    
-    # Update user balance
-    new_balance = user.get("balance", 0.0) + request.amount
-    await db.users.update_one(
-        {"id": user["id"]},
-        {"$set": {"balance": new_balance}}
-    )
+    # In real app, would stay "pending" until payment confirmed
+    transaction = await balances.apply(db, user["id"], request.amount, transaction, f"external:{request.method}")
+    invalidate_user_cache(user["id"])
     
     return {
         "message": "Deposit successful",
         "transaction_id": transaction["id"],
-        "new_balance": new_balance
+        "new_balance": transaction["balance_after"]
     }
 
 @api_router.post("/balance/withdrawal")
 async def withdraw_balance(request: WithdrawalRequest, user: dict = Depends(get_current_user)):
     """Withdraw money from user balance"""
-    current_balance = user.get("balance", 0.0)
-    
-    # Check if user has sufficient balance
-    if current_balance < request.amount:
-        raise HTTPException(status_code=400, detail="Insufficient balance")
-    
-    # Create transaction record
     transaction = {
-        "id": str(uuid.uuid4()),
-        "user_id": user["id"],
-        "amount": request.amount,
         "type": "withdrawal",
-        "status": "pending",  # Pending admin approval
         "method": request.method,
-        "description": f"Withdrawal via {request.method}",
-        "created_at": datetime.now(timezone.utc).isoformat()
+        "description": f"Withdrawal via {request.method}"
     }
-    await db.transactions.insert_one(transaction)
-    
-    # Update user balance (deduct immediately)
-    new_balance = current_balance - request.amount
-    await db.users.update_one(
-        {"id": user["id"]},
-        {"$set": {"balance": new_balance}}
-    )
+    # Deducted immediately, only while the balance covers it; the record stays pending for admin approval
+    try:
+        transaction = await balances.apply(
+            db, user["id"], -request.amount, transaction, f"external:{request.method}", final_status="pending"
+        )
+    except InsufficientBalance:
+        raise HTTPException(status_code=400, detail="Insufficient balance")
+    invalidate_user_cache(user["id"])
     
     return {
         "message": "Withdrawal request submitted",
         "transaction_id": transaction["id"],
-        "new_balance": new_balance,
+        "new_balance": transaction["balance_after"],
         "status": "pending"
     }
 
 @api_router.get("/transactions", response_model=List[Transaction])
 async def get_transactions(
+    response: Response,
     user: dict = Depends(get_current_user),
+    cursor: Optional[str] = None,
     skip: int = 0,
     limit: int = 20
 ):
     """Get user transaction history"""
-    transactions = await db.transactions.find(
-        {"user_id": user["id"]},
-        {"_id": 0}
-    ).sort("created_at", -1).skip(skip).limit(limit).to_list(limit)
-    
-    for t in transactions:
-        t["created_at"] = datetime.fromisoformat(t["created_at"])
-    
+    transactions = await find_page(
+        db.transactions, {"user_id": user["id"]}, {"_id": 0},
+        NEWEST_FIRST, response, cursor=cursor, skip=skip, limit=limit
+    )
     return transactions
 
 # === Product Routes ===
-@api_router.get("/products", response_model=List[Product])
+def parse_facet_names(facets: Optional[str]) -> tuple:
+    if not facets:
+        return ()
+    if facets in ("all", "true", "1"):
+        return PRODUCT_FACETS
+    names = tuple(dict.fromkeys(name.strip() for name in facets.split(",") if name.strip()))
+    unknown = [name for name in names if name not in PRODUCT_FACETS]
+    if unknown:
+        raise HTTPException(status_code=400, detail=f"Unknown facets: {', '.join(unknown)}")
+    return names
+
+def facet_stages(names: tuple) -> dict:
+    """$facet branches counting the matched products per facet value"""
+    stages = {"total": [{"$count": "count"}]}
+    for name in names:
+        if name == "price":
+            stages[name] = [{"$bucket": {
+                "groupBy": "$price",
+                "boundaries": PRICE_BUCKETS,
+                "default": "other",
+                "output": {"count": {"$sum": 1}}
+            }}]
+        else:
+            field = "$category_id" if name == "category" else f"${name}"
+            stages[name] = [
+                {"$group": {"_id": field, "count": {"$sum": 1}}},
+                {"$sort": {"count": -1, "_id": 1}}
+            ]
+    return stages
+
+def read_facet_counts(result: dict, names: tuple) -> tuple:
+    facets = {}
+    for name in names:
+        if name == "price":
+            labels = {low: f"{low}-{high}" for low, high in zip(PRICE_BUCKETS, PRICE_BUCKETS[1:])}
+            labels["other"] = f"{PRICE_BUCKETS[-1]}+"
+            facets[name] = [{"value": labels[row["_id"]], "count": row["count"]} for row in result[name]]
+        else:
+            facets[name] = [{"value": row["_id"], "count": row["count"]} for row in result[name]]
+    total = result["total"][0]["count"] if result["total"] else 0
+    return facets, total
+
+def invalidate_facet_cache():
+    facet_cache.clear()
+
+@api_router.get("/products", response_model=Union[List[Product], ProductFacetPage])
 async def get_products(
+    response: Response,
     category: Optional[str] = None,
     search: Optional[str] = None,
+    product_type: Optional[str] = None,
+    min_price: Optional[float] = None,
+    max_price: Optional[float] = None,
+    in_stock: Optional[bool] = None,
+    sort: Optional[str] = None,
+    facets: Optional[str] = None,
+    fields: Optional[str] = None,
+    cursor: Optional[str] = None,
     skip: int = 0,
     limit: int = 20
 ):
+    """Catalog listing with filters, sorting and opt-in facet counts.
+
+    ``facets=category,product_type,price`` (or ``facets=all``) wraps the page
+    in a ProductFacetPage; otherwise the response is the plain product list.
+    Searches are ordered by relevance unless ``sort`` is given.
+    ``fields=id,title,price,images`` returns only those product fields.
+    """
+    if sort is not None and sort not in PRODUCT_SORTS:
+        raise HTTPException(status_code=400, detail=f"Unknown sort: {sort}")
+    facet_names = parse_facet_names(facets)
+    field_names = parse_response_fields(Product, fields)
+    keyset = PRODUCT_SORTS[sort or "new"]
+    # Cursors and relevance ordering read the sort keys and id even when they aren't returned
+    product_projection = fields_projection(field_names, "id", *(field for field, _ in keyset.fields))
+    limit = max(1, min(limit, MAX_PAGE_SIZE))
+
     query = {}
     if category:
         query["category_id"] = category
-    if search:
-        # Search in both title and description
-        query["$or"] = [
-            {"title": {"$regex": search, "$options": "i"}},
-            {"description": {"$regex": search, "$options": "i"}}
-        ]
+    if product_type:
+        query["product_type"] = product_type
+    if min_price is not None or max_price is not None:
+        query["price"] = {}
+        if min_price is not None:
+            query["price"]["$gte"] = min_price
+        if max_price is not None:
+            query["price"]["$lte"] = max_price
+    if in_stock is not None:
+        query["stock"] = {"$gt": 0} if in_stock else {"$lte": 0}
+    
+    facet_counts, total = {}, 0
+    if search and search_index.ready and sort is None:
+        # Rank with the search index, then let Mongo apply the remaining filters
+        ranked_ids = search_index.search(search, limit=SEARCH_MAX_RESULTS)
+        if query or facet_names:
+            stages = {"ids": [{"$project": {"_id": 0, "id": 1}}], **(facet_stages(facet_names) if facet_names else {})}
+            [result] = await db.products.aggregate([
+                {"$match": {**query, "id": {"$in": ranked_ids}}},
+                {"$facet": stages}
+            ]).to_list(1)
+            allowed = {p["id"] for p in result["ids"]}
+            ranked_ids = [pid for pid in ranked_ids if pid in allowed]
+            if facet_names:
+                facet_counts, total = read_facet_counts(result, facet_names)
+        
+        # Ranked ids are already in memory, so a search cursor is just an offset
+        start = skip
+        if cursor:
+            try:
+                (start,) = decode_cursor(cursor)
+            except (InvalidCursor, ValueError):
+                raise HTTPException(status_code=400, detail="Invalid cursor")
+            if not isinstance(start, int) or start < 0:
+                raise HTTPException(status_code=400, detail="Invalid cursor")
+        page_ids = ranked_ids[start:start + limit]
+        products = await db.products.find({"id": {"$in": page_ids}}, product_projection).to_list(limit)
+        rank = {pid: i for i, pid in enumerate(page_ids)}
+        products.sort(key=lambda p: rank[p["id"]])
+        if start + limit < len(ranked_ids):
+            set_next_cursor(response, encode_cursor([start + limit]))
+    else:
+        if search and search_index.ready:
+            # An explicit sort replaces relevance; the index only selects
+            query["id"] = {"$in": search_index.search(search, limit=SEARCH_MAX_RESULTS)}
+        elif search:
+            # Search in both title and description until the index is built
+            query["$or"] = [
+                {"title": {"$regex": re.escape(search), "$options": "i"}},
+                {"description": {"$regex": re.escape(search), "$options": "i"}}
+            ]
+        
+        cache_key = (category, facet_names) if facet_names and set(query) <= {"category_id"} else None
+        cached = facet_cache.get(cache_key) if cache_key else None
+        if facet_names and cached is None:
+            # One round trip for the page and every facet count
+            items = [{"$match": keyset_query(keyset, {}, cursor)}] if cursor else []
+            items.append({"$sort": dict(keyset.sort)})
+            if skip and not cursor:
+                items.append({"$skip": skip})
+            items += [{"$limit": limit}, {"$project": product_projection}]
+            [result] = await db.products.aggregate([
+                {"$match": query},
+                {"$facet": {"items": items, **facet_stages(facet_names)}}
+            ]).to_list(1)
+            products = result["items"]
+            set_next_cursor(response, keyset.next_cursor(products, limit))
+            facet_counts, total = read_facet_counts(result, facet_names)
+            if cache_key:
+                facet_cache[cache_key] = (facet_counts, total)
+        else:
+            if cached:
+                facet_counts, total = cached
+            products = await find_page(
+                db.products, query, product_projection, keyset, response, cursor=cursor, skip=skip, limit=limit
+            )
     
-    products = await db.products.find(query, {"_id": 0}).skip(skip).limit(limit).to_list(limit)
-    for p in products:
-        p["created_at"] = datetime.fromisoformat(p["created_at"])
-    return products
+    products = shape(Product, products, field_names)
+    if facet_names:
+        return fast_response({"items": products, "facets": facet_counts, "total": total}, response)
+    return fast_response(products, response)
+
+@api_router.get("/products/suggest")
+async def suggest_products(q: str, limit: int = 8):
+    """Title completions and matching categories for a search-box prefix"""
+    limit = max(1, min(limit, 20))
+    return {
+        "products": suggest_index.suggest(q, limit=limit),
+        "categories": suggest_index.suggest_categories(q, limit=5)
+    }
 
 @api_router.get("/products/{product_id}", response_model=Product)
-async def get_product(product_id: str):
-    product = await db.products.find_one({"id": product_id}, {"_id": 0})
+async def get_product(product_id: str, request: Request):
+    product = await product_cache.get(db.products, product_id)
     if not product:
         raise HTTPException(status_code=404, detail="Product not found")
-    product["created_at"] = datetime.fromisoformat(product["created_at"])
     
-    # Increment views
-    await db.products.update_one({"id": product_id}, {"$inc": {"views_count": 1}})
-    return Product(**product)
+    view_counter.record(product_id)
+    if view_counter.full:
+        asyncio.create_task(flush_view_counts())
+    # Weak validator: views_count moves on every hit without changing what the page means.
+    # Counters are part of it because cached copies adjust them ahead of updated_at.
+    modified = product.updated_at or product.created_at
+    etag = f'W/"{product.id}-{int(modified.timestamp() * 1000)}-{product.stock}-{product.sales_count}"'
+    return conditional_response(
+        request, None, etag, modified, PRODUCT_CACHE_CONTROL,
+        render=lambda: render_json(
+            product.model_copy(update={"views_count": product.views_count + view_counter.pending(product_id)})
+        )
+    )
 
 @api_router.post("/products", response_model=Product)
 async def create_product(data: ProductCreate, user: dict = Depends(require_seller)):
@@ -770,12 +1253,89 @@ async def create_product(data: ProductCreate, user: dict = Depends(require_selle
         "seller_id": user["id"],
         "sales_count": 0,
         "views_count": 0,
-        "created_at": datetime.now(timezone.utc).isoformat()
+        "created_at": datetime.now(timezone.utc)
     }
+    product_doc["updated_at"] = product_doc["created_at"]
     await db.products.insert_one(product_doc)
-    product_doc["created_at"] = datetime.fromisoformat(product_doc["created_at"])
+    invalidate_facet_cache()
+    search_index.add(product_doc)
+    suggest_index.add(product_doc)
     return Product(**product_doc)
 
+@api_router.post("/products/bulk")
+async def bulk_create_products(request: Request, format: Optional[str] = None, user: dict = Depends(require_seller)):
+    """Create products from an NDJSON or CSV upload, one ProductCreate per row.
+
+    The body is read as it arrives and inserted in unordered chunks, so good
+    rows are kept when others fail; failures are reported by row number.
+    CSV needs a header row; ``images`` cells are separated with ``|``.
+    """
+    try:
+        fmt = detect_format(request.headers.get("content-type"), format)
+    except ImportFormatError as e:
+        raise HTTPException(status_code=415, detail=str(e))
+    
+    result = {"inserted": 0, "failed": 0, "errors": [], "truncated": False}
+    
+    def report(row: Optional[int], errors: list):
+        result["failed"] += 1
+        if len(result["errors"]) < BULK_IMPORT_MAX_ERRORS:
+            result["errors"].append({"row": row, "errors": errors})
+    
+    async def write(chunk: list):
+        try:
+            await db.products.bulk_write([InsertOne(doc) for _, doc in chunk], ordered=False)
+            failed = {}
+        except BulkWriteError as e:
+            failed = {error["index"]: error["errmsg"] for error in e.details.get("writeErrors", [])}
+        for index, (row, doc) in enumerate(chunk):
+            if index in failed:
+                report(row, [{"loc": [], "msg": failed[index]}])
+                continue
+            doc.pop("_id", None)
+            search_index.add(doc)
+            suggest_index.add(doc)
+            result["inserted"] += 1
+    
+    chunk = []
+    try:
+        async for row, data, error in read_rows(fmt, request.stream()):
+            if row > BULK_IMPORT_MAX_ROWS:
+                result["truncated"] = True
+                break
+            if error:
+                report(row, [{"loc": [], "msg": error}])
+                continue
+            try:
+                product = ProductCreate.model_validate(data)
+            except ValidationError as e:
+                report(row, e.errors(include_url=False, include_context=False, include_input=False))
+                continue
+            now = datetime.now(timezone.utc)
+            chunk.append((row, {
+                "id": str(uuid.uuid4()),
+                **product.model_dump(),
+                "seller_id": user["id"],
+                "sales_count": 0,
+                "views_count": 0,
+                "created_at": now,
+                "updated_at": now
+            }))
+            if len(chunk) >= BULK_IMPORT_CHUNK:
+                await write(chunk)
+                chunk = []
+        if chunk:
+            await write(chunk)
+    except ImportFormatError as e:
+        if not (result["inserted"] or result["failed"]):
+            raise HTTPException(status_code=400, detail=str(e))
+        report(None, [{"loc": [], "msg": str(e)}])
+    finally:
+        if result["inserted"]:
+            invalidate_facet_cache()
+    
+    return result
+
 @api_router.put("/products/{product_id}", response_model=Product)
 async def update_product(product_id: str, data: ProductCreate, user: dict = Depends(require_seller)):
     product = await db.products.find_one({"id": product_id}, {"_id": 0})
@@ -787,13 +1347,17 @@ async def update_product(product_id: str, data: ProductCreate, user: dict = Depe
         raise HTTPException(status_code=403, detail="Not authorized to edit this product")
     
     update_data = data.model_dump()
+    update_data["updated_at"] = datetime.now(timezone.utc)
     await db.products.update_one(
         {"id": product_id},
         {"$set": update_data}
     )
     
     updated_product = await db.products.find_one({"id": product_id}, {"_id": 0})
-    updated_product["created_at"] = datetime.fromisoformat(updated_product["created_at"])
+    product_cache.invalidate([product_id])
+    invalidate_facet_cache()
+    search_index.add(updated_product)
+    suggest_index.add(updated_product)
     return Product(**updated_product)
 
 @api_router.delete("/products/{product_id}")
@@ -807,28 +1371,39 @@ async def delete_product(product_id: str, user: dict = Depends(require_seller)):
         raise HTTPException(status_code=403, detail="Not authorized to delete this product")
     
     await db.products.delete_one({"id": product_id})
+    product_cache.invalidate([product_id])
+    invalidate_facet_cache()
+    search_index.remove(product_id)
+    suggest_index.remove(product_id)
     return {"message": "Product deleted successfully"}
 
 @api_router.get("/products/{product_id}/similar", response_model=List[Product])
 async def get_similar_products(product_id: str, limit: int = 4):
-    product = await db.products.find_one({"id": product_id}, {"_id": 0})
-    if not product:
-        raise HTTPException(status_code=404, detail="Product not found")
-    
-    similar = await db.products.find(
-        {"category_id": product["category_id"], "id": {"$ne": product_id}},
-        {"_id": 0}
-    ).limit(limit).to_list(limit)
-    
-    for p in similar:
-        p["created_at"] = datetime.fromisoformat(p["created_at"])
+    limit = max(1, min(limit, 20))
+    entry = await db.product_similarity.find_one({"product_id": product_id}, {"_id": 0, "neighbors": 1})
+    neighbor_ids = [n["product_id"] for n in (entry or {}).get("neighbors", [])]
+    similar = (await product_cache.get_list(db.products, neighbor_ids))[:limit]
+    
+    if len(similar) < limit:
+        # Not enough co-occurrence data yet: fill up from the same category
+        product = await product_cache.get(db.products, product_id)
+        if not product:
+            raise HTTPException(status_code=404, detail="Product not found")
+        exclude = [product_id] + [p.id for p in similar]
+        filler = await db.products.find(
+            {"category_id": product.category_id, "id": {"$nin": exclude}},
+            {"_id": 0}
+        ).limit(limit - len(similar)).to_list(limit - len(similar))
+        similar += [Product(**p) for p in filler]
     return similar
 
 # === Category Routes ===
 @api_router.get("/categories", response_model=List[Category])
-async def get_categories():
-    categories = await db.categories.find({}, {"_id": 0}).to_list(1000)
-    return categories
+async def get_categories(request: Request):
+    async def build():
+        categories = await db.categories.find({}, {"_id": 0}).to_list(1000)
+        return [Category(**c) for c in categories], {}
+    return await response_cache.respond(request, ("categories",), PUBLIC_CACHE_CONTROL, build)
 
 @api_router.post("/categories", response_model=Category)
 async def create_category(data: CategoryCreate, user: dict = Depends(require_admin)):
@@ -841,34 +1416,84 @@ async def create_category(data: CategoryCreate, user: dict = Depends(require_adm
     
     cat_doc = {"id": cat_id, **data.model_dump(), "level": level}
     await db.categories.insert_one(cat_doc)
+    response_cache.invalidate("categories")
+    await refresh_suggest_categories()
     return Category(**cat_doc)
 
 # === Order Routes ===
 @api_router.post("/orders", response_model=Order)
 async def create_order(data: OrderCreate, user: dict = Depends(get_current_user)):
     order_id = str(uuid.uuid4())
-    total = sum(item.price * item.quantity for item in data.items)
+    quantities = merge_quantities(item.model_dump() for item in data.items)
+    
+    # One cache-backed $in for the products, one for their sellers
+    products = await product_cache.get_many(db.products, quantities)
+    missing = [pid for pid in quantities if pid not in products]
+    if missing:
+        raise HTTPException(status_code=404, detail={"message": "Products not found", "product_ids": missing})
+    sellers = await get_cached_users(product.seller_id for product in products.values())
+    unavailable = [pid for pid, product in products.items() if product.seller_id not in sellers]
+    if unavailable:
+        raise HTTPException(status_code=409, detail={"message": "Products unavailable", "product_ids": unavailable})
+    
+    items, total = [], 0.0
+    for product_id, quantity in quantities.items():
+        product = products[product_id]
+        items.append({
+            "product_id": product_id,
+            "title": product.title,
+            "price": product.price,
+            "quantity": quantity,
+            "seller_id": product.seller_id
+        })
+        total += product.price * quantity
+    total = round(total, 2)
+    
+    try:
+        reserved_until = await stock_reservations.reserve(db, order_id, user["id"], quantities)
+    except OutOfStock as e:
+        raise HTTPException(status_code=409, detail={"message": "Not enough stock", "product_ids": e.product_ids})
+    product_cache.adjust({pid: -qty for pid, qty in quantities.items()})
     
     order_doc = {
         "id": order_id,
         "user_id": user["id"],
-        "items": [item.model_dump() for item in data.items],
+        "items": items,
         "total": total,
         "currency": data.currency,
         "status": "pending",
         "payment_id": None,
-        "created_at": datetime.now(timezone.utc).isoformat()
+        "reserved_until": reserved_until,
+        "created_at": datetime.now(timezone.utc)
     }
-    await db.orders.insert_one(order_doc)
-    order_doc["created_at"] = datetime.fromisoformat(order_doc["created_at"])
+    try:
+        await db.orders.insert_one(order_doc)
+    except BaseException:
+        await release_order_stock(order_id)
+        raise
     return Order(**order_doc)
 
+async def release_order_stock(order_id: str, status: str = "released"):
+    product_cache.adjust(await stock_reservations.release(db, order_id, status=status))
+
+async def sweep_stock_reservations():
+    product_cache.adjust(await stock_reservations.sweep(db))
+
+async def convert_order_stock(order: dict):
+    """Turn a paid order's stock hold into sales (exactly once per order)"""
+    conversion = await stock_reservations.convert(db, order["id"], order["items"])
+    if conversion is None:
+        return
+    product_cache.adjust(merge_quantities(order["items"]), "sales_count")
+    product_cache.adjust({pid: -qty for pid, qty in conversion.taken.items()})
+    if conversion.shortfall:
+        await db.orders.update_one({"id": order["id"]}, {"$set": {"stock_shortfall": conversion.shortfall}})
+
 @api_router.get("/orders/my", response_model=List[Order])
-async def get_my_orders(user: dict = Depends(get_current_user)):
-    orders = await db.orders.find({"user_id": user["id"]}, {"_id": 0}).to_list(1000)
-    for o in orders:
-        o["created_at"] = datetime.fromisoformat(o["created_at"])
-    return orders
+async def get_my_orders(fields: Optional[str] = None, user: dict = Depends(get_current_user)):
+    field_names = parse_response_fields(Order, fields)
+    orders = await db.orders.find({"user_id": user["id"]}, fields_projection(field_names)).to_list(1000)
+    return fast_response(shape(Order, orders, field_names))
 
 @api_router.get("/orders/{order_id}", response_model=Order)
 async def get_order(order_id: str, user: dict = Depends(get_current_user)):
@@ -877,7 +1502,6 @@ async def get_order(order_id: str, user: dict = Depends(get_current_user)):
         raise HTTPException(status_code=404, detail="Order not found")
     if order["user_id"] != user["id"] and user.get("role") != "admin":
         raise HTTPException(status_code=403, detail="Access denied")
-    order["created_at"] = datetime.fromisoformat(order["created_at"])
     return Order(**order)
 
 # === Payment Routes (Stripe) ===
@@ -888,25 +1512,44 @@ async def create_checkout_session(data: PaymentCheckoutRequest, request: Request
         raise HTTPException(status_code=404, detail="Order not found")
     if order["user_id"] != user["id"]:
         raise HTTPException(status_code=403, detail="Access denied")
+    if order["status"] != "pending":
+        raise HTTPException(status_code=400, detail=f"Order is {order['status']}")
+    
+    # Keep the stock held while the buyer is on the payment page
+    reserved_until = await stock_reservations.extend(db, order["id"])
+    if reserved_until is None:
+        # The hold lapsed before checkout started: take the stock again
+        quantities = merge_quantities(order["items"])
+        try:
+            reserved_until = await stock_reservations.reserve(db, order["id"], user["id"], quantities)
+        except OutOfStock as e:
+            raise HTTPException(status_code=409, detail={"message": "Not enough stock", "product_ids": e.product_ids})
+        except HoldExists as e:
+            # A concurrent checkout for this order re-took the stock first
+            if e.status != "active":
+                raise HTTPException(status_code=409, detail=f"Order stock hold is {e.status}")
+            reserved_until = e.expires_at
+        else:
+            product_cache.adjust({pid: -qty for pid, qty in quantities.items()})
+    await db.orders.update_one({"id": order["id"]}, {"$set": {"reserved_until": reserved_until}})
     
     # Get host from frontend
     host_url = str(request.base_url).rstrip('/')
-    webhook_url = f"{host_url}/api/webhook/stripe"
-    
-    stripe_checkout = StripeCheckout(api_key=stripe_api_key, webhook_url=webhook_url)
-    
     success_url = f"{host_url}/checkout/success?session_id={{{{CHECKOUT_SESSION_ID}}}}"
     cancel_url = f"{host_url}/checkout/cancel"
     
-    checkout_request = CheckoutSessionRequest(
-        amount=order["total"],
-        currency=order["currency"],
-        success_url=success_url,
-        cancel_url=cancel_url,
-        metadata={"order_id": order["id"], "user_id": user["id"]}
-    )
-    
-    session = await stripe_checkout.create_checkout_session(checkout_request)
+    try:
+        session = await payment_gateway.create_session(
+            amount=order["total"],
+            currency=order["currency"],
+            success_url=success_url,
+            cancel_url=cancel_url,
+            metadata={"order_id": order["id"], "user_id": user["id"]}
+        )
+    except PaymentUnavailable:
+        raise HTTPException(status_code=503, detail="Payment provider unavailable, please try again")
+    except PaymentRejected:
+        raise HTTPException(status_code=502, detail="Payment provider rejected the checkout")
     
     # Create payment transaction
     transaction_doc = {
@@ -919,75 +1562,120 @@ async def create_checkout_session(data: PaymentCheckoutRequest, request: Request
         "payment_status": "pending",
         "status": "initiated",
         "metadata": {"order_id": order["id"], "user_id": user["id"]},
-        "created_at": datetime.now(timezone.utc).isoformat()
+        "created_at": datetime.now(timezone.utc)
     }
     await db.payment_transactions.insert_one(transaction_doc)
     
     return {"url": session.url, "session_id": session.session_id}
 
+async def fulfill_payment(session_id: str) -> bool:
+    """Mark a session paid and fulfil its order; True for the caller that completes it.
+
+    Flipping the transaction to paid also sets ``fulfilled: False``, which
+    only becomes True once every step has run. A later call that finds the
+    transaction paid but unfulfilled (the first attempt raised or died part
+    way) runs the steps again; each is idempotent, and notifications go out
+    only from the call that sets the flag. Transactions paid before the flag
+    existed have no ``fulfilled`` field and are left alone.
+    """
+    transaction = await db.payment_transactions.find_one_and_update(
+        {"session_id": session_id, "payment_status": {"$ne": "paid"}},
+        {"$set": {"payment_status": "paid", "status": "completed", "fulfilled": False}},
+        projection={"_id": 0, "order_id": 1}
+    )
+    if not transaction:
+        transaction = await db.payment_transactions.find_one(
+            {"session_id": session_id, "payment_status": "paid", "fulfilled": False}, {"_id": 0, "order_id": 1}
+        )
+        if not transaction:
+            return False
+    order = await db.orders.find_one_and_update(
+        {"id": transaction["order_id"]},
+        {"$set": {"status": "paid", "payment_id": session_id}},
+        projection={"_id": 0},
+        return_document=ReturnDocument.AFTER
+    )
+    if order:
+        await ledger.transfer(
+            db, f"order:{order['id']}", "purchase", f"external:{PAYMENT_PROVIDER}", "platform:sales", order["total"],
+            ref=order["id"]
+        )
+        try:
+            await convert_order_stock(order)
+        except ConversionBusy:
+            return False  # a concurrent call is converting the stock and finishes the fulfilment
+    result = await db.payment_transactions.update_one(
+        {"session_id": session_id, "fulfilled": False},
+        {"$set": {"fulfilled": True, "fulfilled_at": datetime.now(timezone.utc)}}
+    )
+    if not result.modified_count:
+        return False  # a concurrent call finished first
+    if order:
+        await notify_order_paid(order)
+    return True
+
+async def notify_order_paid(order: dict):
+    """Queue the sale notices for sellers and the receipt for the buyer"""
+    # Orders placed before items carried seller_id fall back to the product
+    unknown = [item["product_id"] for item in order["items"] if not item.get("seller_id")]
+    products = await product_cache.get_many(db.products, unknown) if unknown else {}
+    seller_ids = {
+        item["product_id"]: item.get("seller_id") or getattr(products.get(item["product_id"]), "seller_id", None)
+        for item in order["items"]
+    }
+    users = await get_cached_users([order["user_id"], *filter(None, seller_ids.values())])
+    buyer = users.get(order["user_id"], {})
+    
+    for item in order["items"]:
+        seller = users.get(seller_ids[item["product_id"]])
+        if seller and seller.get("telegram_id"):
+            notification_queue.enqueue(
+                seller["telegram_id"],
+                f"🎉 <b>Новая продажа!</b>\n\n"
+                f"📦 Товар: {item['title']}\n"
+                f"💰 Сумма: {item['price'] * item['quantity']}₽\n"
+                f"👤 Покупатель: {buyer.get('full_name', 'Пользователь')}\n\n"
+                f"Перейдите в личный кабинет для подробностей."
+            )
+    
+    if buyer.get("telegram_id"):
+        items_text = "\n".join([f"  • {item['title']} x{item['quantity']}" for item in order["items"]])
+        notification_queue.enqueue(
+            buyer["telegram_id"],
+            f"✅ <b>Заказ оплачен!</b>\n\n"
+            f"📦 Товары:\n{items_text}\n\n"
+            f"💰 Итого: {order['total']}₽\n\n"
+            f"Спасибо за покупку!"
+        )
+
 @api_router.get("/payments/checkout/status/{session_id}")
 async def get_checkout_status(session_id: str, user: dict = Depends(get_current_user)):
     transaction = await db.payment_transactions.find_one({"session_id": session_id}, {"_id": 0})
     if not transaction:
         raise HTTPException(status_code=404, detail="Transaction not found")
     
-    host_url = os.environ.get('REACT_APP_BACKEND_URL', 'http://localhost:8001')
-    webhook_url = f"{host_url}/api/webhook/stripe"
-    stripe_checkout = StripeCheckout(api_key=stripe_api_key, webhook_url=webhook_url)
+    if transaction["payment_status"] == "paid":
+        # Settled already (webhook or reconciler): answer without asking the provider,
+        # finishing the fulfilment if an earlier attempt stopped part way
+        if transaction.get("fulfilled") is False:
+            await fulfill_payment(session_id)
+        return {
+            "status": "complete",
+            "payment_status": "paid",
+            "amount_total": int(round(transaction["amount"] * 100)),
+            "currency": transaction["currency"]
+        }
     
-    checkout_status = await stripe_checkout.get_checkout_status(session_id)
+    try:
+        checkout_status = await payment_gateway.get_status(session_id)
+    except PaymentUnavailable:
+        raise HTTPException(status_code=503, detail="Payment provider unavailable, please try again")
+    except PaymentRejected:
+        raise HTTPException(status_code=404, detail="Checkout session not found at the payment provider")
     
     # Update transaction if payment successful and not already processed
     if checkout_status.payment_status == "paid" and transaction["payment_status"] != "paid":
-        await db.payment_transactions.update_one(
-            {"session_id": session_id},
-            {"$set": {"payment_status": "paid", "status": "completed"}}
-        )
-        
-        # Update order status
-        await db.orders.update_one(
-            {"id": transaction["order_id"]},
-            {"$set": {"status": "paid", "payment_id": session_id}}
-        )
-        
-        # Update product sales count and send notifications
-        order = await db.orders.find_one({"id": transaction["order_id"]}, {"_id": 0})
-        if order:
-            # Get buyer info
-            buyer = await db.users.find_one({"id": order["user_id"]}, {"_id": 0})
-            
-            for item in order["items"]:
-                await db.products.update_one(
-                    {"id": item["product_id"]},
-                    {"$inc": {"sales_count": item["quantity"], "stock": -item["quantity"]}}
-                )
-                
-                # Get product and seller info for notification
-                product = await db.products.find_one({"id": item["product_id"]}, {"_id": 0})
-                if product:
-                    seller = await db.users.find_one({"id": product["seller_id"]}, {"_id": 0})
-                    
-                    # Notify seller about sale
-                    if seller and seller.get("telegram_id"):
-                        await send_telegram_notification(
-                            seller["telegram_id"],
-                            f"🎉 <b>Новая продажа!</b>\n\n"
-                            f"📦 Товар: {item['title']}\n"
-                            f"💰 Сумма: {item['price'] * item['quantity']}₽\n"
-                            f"👤 Покупатель: {buyer.get('full_name', 'Пользователь')}\n\n"
-                            f"Перейдите в личный кабинет для подробностей."
-                        )
-            
-            # Notify buyer about successful purchase
-            if buyer and buyer.get("telegram_id"):
-                items_text = "\n".join([f"  • {item['title']} x{item['quantity']}" for item in order["items"]])
-                await send_telegram_notification(
-                    buyer["telegram_id"],
-                    f"✅ <b>Заказ оплачен!</b>\n\n"
-                    f"📦 Товары:\n{items_text}\n\n"
-                    f"💰 Итого: {order['total']}₽\n\n"
-                    f"Спасибо за покупку!"
-                )
+        await fulfill_payment(session_id)
     
     return {
         "status": checkout_status.status,
@@ -996,34 +1684,133 @@ async def get_checkout_status(session_id: str, user: dict = Depends(get_current_
         "currency": checkout_status.currency
     }
 
+async def reconcile_pending_payments():
+    """Settle checkouts still pending after PAYMENT_RECONCILE_AFTER_SECONDS.
+
+    Only the worker holding the job lease runs it, so the provider is asked
+    about each session once per run however many workers there are.
+
+    First finishes payments already marked paid whose fulfilment stopped
+    part way (no need to ask the provider about those). Then walks stale
+    pending transactions oldest first in batches and asks the provider
+    about each, a few at a time. Paid sessions go through the same
+    fulfill_payment transition as polls and webhooks, so whichever gets
+    there first does the work once. Expired sessions are marked so they
+    aren't asked about again (their stock hold lapses on its own); open ones
+    are put off for a while.
+    """
+    if not await claim_job_lease("payment reconciliation", 2 * PAYMENT_RECONCILE_SECONDS):
+        payment_reconcile_stats["skipped"] += 1
+        return
+    payment_reconcile_stats["runs"] += 1
+    now = datetime.now(timezone.utc)
+    window = {
+        "$gte": now - timedelta(hours=PAYMENT_RECONCILE_MAX_AGE_HOURS),
+        "$lte": now - timedelta(seconds=PAYMENT_RECONCILE_AFTER_SECONDS)
+    }
+    
+    unfinished = await db.payment_transactions.find(
+        {"payment_status": "paid", "fulfilled": False, "created_at": {"$lte": window["$lte"]}},
+        {"_id": 0, "session_id": 1}
+    ).sort("created_at", 1).limit(PAYMENT_RECONCILE_BATCH).to_list(PAYMENT_RECONCILE_BATCH)
+    for transaction in unfinished:
+        try:
+            payment_reconcile_stats["resumed"] += await fulfill_payment(transaction["session_id"])
+        except Exception as e:
+            # Left unfulfilled: the next run tries again, without holding up the rest
+            logger.error(f"Resuming fulfilment of {transaction['session_id']} failed: {e}")
+    
+    slots = asyncio.Semaphore(PAYMENT_RECONCILE_CONCURRENCY)
+    
+    async def reconcile(transaction: dict):
+        async with slots:
+            payment_reconcile_stats["checked"] += 1
+            try:
+                checkout_status = await payment_gateway.get_status(transaction["session_id"])
+            except PaymentRejected:
+                # The provider doesn't know the session; back off like an open one
+                payment_reconcile_stats["refused"] += 1
+                checkout_status = None
+            if checkout_status is not None and checkout_status.payment_status == "paid":
+                payment_reconcile_stats["fulfilled"] += await fulfill_payment(transaction["session_id"])
+            elif checkout_status is not None and checkout_status.status == "expired":
+                result = await db.payment_transactions.update_one(
+                    {"session_id": transaction["session_id"], "payment_status": "pending"},
+                    {"$set": {"payment_status": "expired", "status": "expired"}}
+                )
+                payment_reconcile_stats["expired"] += result.modified_count
+            else:
+                # Still open (or unknown): back off in proportion to its age so abandoned checkouts cost little
+                age = now - transaction["created_at"]
+                await db.payment_transactions.update_one(
+                    {"session_id": transaction["session_id"], "payment_status": "pending"},
+                    {"$set": {"reconcile_after": now + max(age / 2, timedelta(seconds=PAYMENT_RECONCILE_AFTER_SECONDS))}}
+                )
+    
+    # Every row checked leaves the filter (paid, expired or put off), so each batch is fresh
+    while True:
+        batch = await db.payment_transactions.find(
+            {"payment_status": "pending", "created_at": window, "reconcile_after": {"$not": {"$gt": now}}},
+            {"_id": 0, "session_id": 1, "created_at": 1}
+        ).sort("created_at", 1).limit(PAYMENT_RECONCILE_BATCH).to_list(PAYMENT_RECONCILE_BATCH)
+        if not batch:
+            return
+        try:
+            await asyncio.gather(*(reconcile(transaction) for transaction in batch))
+        except PaymentUnavailable:
+            # The breaker is open: stop here and pick up from the same point next run
+            payment_reconcile_stats["unavailable"] += 1
+            return
+        if len(batch) < PAYMENT_RECONCILE_BATCH:
+            return
+
 @api_router.post("/webhook/stripe")
 async def stripe_webhook(request: Request):
     body = await request.body()
     signature = request.headers.get("Stripe-Signature")
     
-    host_url = str(request.base_url).rstrip('/')
-    webhook_url = f"{host_url}/api/webhook/stripe"
-    stripe_checkout = StripeCheckout(api_key=stripe_api_key, webhook_url=webhook_url)
-    
     try:
-        event = await stripe_checkout.handle_webhook(body, signature)
-        
-        if event.payment_status == "paid":
-            transaction = await db.payment_transactions.find_one({"session_id": event.session_id}, {"_id": 0})
-            if transaction and transaction["payment_status"] != "paid":
-                await db.payment_transactions.update_one(
-                    {"session_id": event.session_id},
-                    {"$set": {"payment_status": "paid", "status": "completed"}}
-                )
-                
-                await db.orders.update_one(
-                    {"id": transaction["order_id"]},
-                    {"$set": {"status": "paid", "payment_id": event.session_id}}
-                )
-        
-        return {"status": "success"}
-    except Exception as e:
+        event = await payment_gateway.parse_webhook(body, signature)
+    except InvalidWebhook as e:
         raise HTTPException(status_code=400, detail=str(e))
+    
+    # Acknowledge as soon as the event is stored; the inbox worker applies it
+    await webhook_inbox.record(db, event.event_id or event.session_id, {
+        "event_type": event.event_type,
+        "session_id": event.session_id,
+        "payment_status": event.payment_status
+    })
+    return {"status": "success"}
+
+if isinstance(payment_gateway, StubGateway):
+    @api_router.post("/payments/stub/{session_id}")
+    async def pay_stub_session(session_id: str):
+        """Stub provider only: the "hosted payment page". Completes the session and
+        returns the signed webhook for the caller to deliver to /api/webhook/stripe."""
+        signed = await payment_gateway.pay(session_id)
+        if signed is None:
+            raise HTTPException(status_code=404, detail="Checkout session not found")
+        body, signature = signed
+        return {"session_id": session_id, "payload": body.decode(), "signature": signature}
+
+async def apply_webhook_event(event: dict):
+    """Fulfil a paid session.
+
+    Raises while the payment is paid but not yet fulfilled (a step failed
+    here, or a concurrent attempt hasn't finished), so the inbox retries the
+    event, or leaves it failed and visible, instead of acknowledging it.
+    """
+    if event["payment_status"] != "paid":
+        return
+    if await fulfill_payment(event["session_id"]):
+        return
+    transaction = await db.payment_transactions.find_one({"session_id": event["session_id"]}, {"_id": 0, "fulfilled": 1})
+    if transaction and transaction.get("fulfilled") is False:
+        raise RuntimeError(f"Payment {event['session_id']} is paid but its order is not fulfilled yet")
+
+# Verified Stripe events are queued in webhook_events and applied in the background
+webhook_inbox = WebhookInbox(apply_webhook_event, workers=int(os.environ.get('WEBHOOK_WORKERS', '4')))
+WEBHOOK_POLL_SECONDS = float(os.environ.get('WEBHOOK_POLL_SECONDS', '5'))
 
 # === Favorites Routes ===
 @api_router.post("/favorites")
@@ -1036,7 +1823,7 @@ async def add_favorite(product_id: str, user: dict = Depends(get_current_user)):
         "id": str(uuid.uuid4()),
         "user_id": user["id"],
         "product_id": product_id,
-        "created_at": datetime.now(timezone.utc).isoformat()
+        "created_at": datetime.now(timezone.utc)
     }
     await db.favorites.insert_one(fav_doc)
     return {"message": "Added to favorites"}
@@ -1049,53 +1836,82 @@ async def remove_favorite(product_id: str, user: dict = Depends(get_current_user
 @api_router.get("/favorites/my", response_model=List[Product])
 async def get_my_favorites(user: dict = Depends(get_current_user)):
     favorites = await db.favorites.find({"user_id": user["id"]}, {"_id": 0}).to_list(1000)
-    product_ids = [f["product_id"] for f in favorites]
-    
-    products = await db.products.find({"id": {"$in": product_ids}}, {"_id": 0}).to_list(1000)
-    for p in products:
-        p["created_at"] = datetime.fromisoformat(p["created_at"])
-    return products
+    return await product_cache.get_list(db.products, [f["product_id"] for f in favorites])
 
 # === Viewed Products ===
 @api_router.post("/viewed/{product_id}")
 async def add_viewed(product_id: str, user: dict = Depends(get_current_user)):
-    viewed_doc = {
-        "id": str(uuid.uuid4()),
-        "user_id": user["id"],
-        "product_id": product_id,
-        "viewed_at": datetime.now(timezone.utc).isoformat()
-    }
-    await db.viewed_products.insert_one(viewed_doc)
+    # One upsert keeps the last N distinct products, newest first
+    await db.recently_viewed.update_one(
+        {"user_id": user["id"]},
+        [{"$set": {
+            "product_ids": {"$slice": [
+                {"$concatArrays": [
+                    [product_id],
+                    {"$filter": {
+                        "input": {"$ifNull": ["$product_ids", []]},
+                        "cond": {"$ne": ["$$this", product_id]}
+                    }}
+                ]},
+                RECENTLY_VIEWED_LIMIT
+            ]},
+            "updated_at": datetime.now(timezone.utc)
+        }}],
+        upsert=True
+    )
     return {"message": "Added to viewed"}
 
 @api_router.get("/viewed/my", response_model=List[Product])
 async def get_my_viewed(user: dict = Depends(get_current_user), limit: int = 10):
-    viewed = await db.viewed_products.find(
-        {"user_id": user["id"]},
-        {"_id": 0}
-    ).sort("viewed_at", -1).limit(limit).to_list(limit)
-    
-    product_ids = [v["product_id"] for v in viewed]
-    products = await db.products.find({"id": {"$in": product_ids}}, {"_id": 0}).to_list(1000)
-    for p in products:
-        p["created_at"] = datetime.fromisoformat(p["created_at"])
-    return products
+    history = await db.recently_viewed.find_one({"user_id": user["id"]}, {"_id": 0, "product_ids": 1})
+    product_ids = (history or {}).get("product_ids", [])[:max(0, limit)]
+    return await product_cache.get_list(db.products, product_ids)
+
+# === Recommendation Routes ===
+async def get_popular_product_ids() -> List[str]:
+    popular = popular_cache.get("ids")
+    if popular is None:
+        docs = await db.products.find({}, {"_id": 0, "id": 1}).sort(
+            [("sales_count", -1), ("id", -1)]
+        ).limit(50).to_list(50)
+        popular = popular_cache["ids"] = [d["id"] for d in docs]
+    return popular
+
+@api_router.get("/recommendations/my", response_model=List[Product])
+async def get_my_recommendations(user: dict = Depends(get_current_user), limit: int = 12):
+    """Precomputed personal picks, topped up with best sellers"""
+    limit = max(1, min(limit, 50))
+    product_ids = recommendation_cache.get(user["id"])
+    if product_ids is None:
+        entry = await db.user_recommendations.find_one({"user_id": user["id"]}, {"_id": 0, "product_ids": 1})
+        personal = entry["product_ids"] if entry else []
+        product_ids = list(dict.fromkeys(personal + await get_popular_product_ids()))
+        recommendation_cache[user["id"]] = product_ids
+    
+    # Fetch a few spares in case some recommended products were deleted since
+    products = await product_cache.get_list(db.products, product_ids[:limit + 10])
+    return products[:limit]
 
 # === Blog Routes ===
 @api_router.get("/blog", response_model=List[BlogPost])
-async def get_blog_posts(skip: int = 0, limit: int = 10):
-    posts = await db.blog_posts.find({}, {"_id": 0}).skip(skip).limit(limit).to_list(limit)
-    for p in posts:
-        p["published_at"] = datetime.fromisoformat(p["published_at"])
-    return posts
+async def get_blog_posts(request: Request, cursor: Optional[str] = None, skip: int = 0, limit: int = 10):
+    async def build():
+        page = Response()
+        posts = await find_page(
+            db.blog_posts, {}, {"_id": 0}, BLOG_NEWEST_FIRST, page, cursor=cursor, skip=skip, limit=limit
+        )
+        headers = {"X-Next-Cursor": page.headers["X-Next-Cursor"]} if "X-Next-Cursor" in page.headers else {}
+        return [BlogPost(**p) for p in posts], headers
+    return await response_cache.respond(request, ("blog", cursor, skip, limit), PUBLIC_CACHE_CONTROL, build)
 
 @api_router.get("/blog/{slug}", response_model=BlogPost)
-async def get_blog_post(slug: str):
-    post = await db.blog_posts.find_one({"slug": slug}, {"_id": 0})
-    if not post:
-        raise HTTPException(status_code=404, detail="Post not found")
-    post["published_at"] = datetime.fromisoformat(post["published_at"])
-    return BlogPost(**post)
+async def get_blog_post(slug: str, request: Request):
+    async def build():
+        post = await db.blog_posts.find_one({"slug": slug}, {"_id": 0})
+        if not post:
+            raise HTTPException(status_code=404, detail="Post not found")
+        return BlogPost(**post), {}
+    return await response_cache.respond(request, ("blog", slug), PUBLIC_CACHE_CONTROL, build)
 
 @api_router.post("/blog", response_model=BlogPost)
 async def create_blog_post(data: BlogPostCreate, user: dict = Depends(require_admin)):
@@ -1104,10 +1920,10 @@ async def create_blog_post(data: BlogPostCreate, user: dict = Depends(require_ad
         "id": post_id,
         **data.model_dump(),
         "author_id": user["id"],
-        "published_at": datetime.now(timezone.utc).isoformat()
+        "published_at": datetime.now(timezone.utc)
     }
     await db.blog_posts.insert_one(post_doc)
-    post_doc["published_at"] = datetime.fromisoformat(post_doc["published_at"])
+    response_cache.invalidate("blog")
     return BlogPost(**post_doc)
 
 @api_router.put("/blog/{post_id}", response_model=BlogPost)
@@ -1118,9 +1934,9 @@ async def update_blog_post(post_id: str, data: BlogPostCreate, user: dict = Depe
     
     update_data = data.model_dump()
     await db.blog_posts.update_one({"id": post_id}, {"$set": update_data})
+    response_cache.invalidate("blog")
     
     updated_post = await db.blog_posts.find_one({"id": post_id}, {"_id": 0})
-    updated_post["published_at"] = datetime.fromisoformat(updated_post["published_at"])
     return BlogPost(**updated_post)
 
 @api_router.delete("/blog/{post_id}")
@@ -1130,14 +1946,12 @@ async def delete_blog_post(post_id: str, user: dict = Depends(require_admin)):
         raise HTTPException(status_code=404, detail="Blog post not found")
     
     await db.blog_posts.delete_one({"id": post_id})
+    response_cache.invalidate("blog")
     return {"message": "Blog post deleted"}
 
 @api_router.get("/admin/blog")
 async def get_admin_blog_posts(user: dict = Depends(require_admin)):
     posts = await db.blog_posts.find({}, {"_id": 0}).to_list(1000)
-    for p in posts:
-        if "published_at" in p:
-            p["published_at"] = datetime.fromisoformat(p["published_at"]).isoformat()
     return posts
 
 # === Chat Routes ===
@@ -1160,7 +1974,7 @@ async def get_user_chats(user: dict = Depends(get_current_user)):
         # Get product info if exists
         product = None
         if chat.get("product_id"):
-            product = await db.products.find_one({"id": chat["product_id"]}, {"_id": 0})
+            product = await product_cache.get(db.products, chat["product_id"])
         
         # Count unread messages
         unread_count = await db.chat_messages.count_documents({
@@ -1201,7 +2015,7 @@ async def create_or_get_chat(seller_id: str, product_id: Optional[str] = None, u
         "buyer_id": user["id"],
         "seller_id": seller_id,
         "product_id": product_id,
-        "created_at": datetime.now(timezone.utc).isoformat(),
+        "created_at": datetime.now(timezone.utc),
         "last_message": None,
         "last_message_at": None
     }
@@ -1228,7 +2042,7 @@ async def get_chat(chat_id: str, user: dict = Depends(get_current_user)):
     # Get product info
     product = None
     if chat.get("product_id"):
-        product = await db.products.find_one({"id": chat["product_id"]}, {"_id": 0})
+        product = await product_cache.get(db.products, chat["product_id"])
     
     return {**chat, "other_user": other_user, "product": product}
 
@@ -1263,7 +2077,7 @@ async def send_message(chat_id: str, data: ChatMessageCreate, user: dict = Depen
         raise HTTPException(status_code=403, detail="Access denied")
     
     message_id = str(uuid.uuid4())
-    now = datetime.now(timezone.utc).isoformat()
+    now = datetime.now(timezone.utc)
     
     message = {
         "id": message_id,
@@ -1289,11 +2103,11 @@ async def send_message(chat_id: str, data: ChatMessageCreate, user: dict = Depen
         # Get product info if exists
         product_name = ""
         if chat.get("product_id"):
-            product = await db.products.find_one({"id": chat["product_id"]}, {"_id": 0})
+            product = await product_cache.get(db.products, chat["product_id"])
             if product:
-                product_name = f"\n📦 Товар: {product['title']}"
+                product_name = f"\n📦 Товар: {product.title}"
         
-        await send_telegram_notification(
+        notification_queue.enqueue(
             recipient["telegram_id"],
             f"💬 <b>Новое сообщение!</b>\n\n"
             f"👤 От: {user.get('full_name', 'Пользователь')}{product_name}\n\n"
@@ -1307,11 +2121,11 @@ async def send_message(chat_id: str, data: ChatMessageCreate, user: dict = Depen
 
 # === Giveaway Routes ===
 @api_router.get("/giveaways", response_model=List[Giveaway])
-async def get_giveaways():
-    giveaways = await db.giveaways.find({}, {"_id": 0}).to_list(1000)
-    for g in giveaways:
-        g["end_date"] = datetime.fromisoformat(g["end_date"])
-    return giveaways
+async def get_giveaways(request: Request):
+    async def build():
+        giveaways = await db.giveaways.find({}, {"_id": 0}).to_list(1000)
+        return [Giveaway(**g) for g in giveaways], {}
+    return await response_cache.respond(request, ("giveaways",), PUBLIC_CACHE_CONTROL, build)
 
 @api_router.post("/giveaways/enter/{giveaway_id}")
 async def enter_giveaway(giveaway_id: str, user: dict = Depends(get_current_user)):
@@ -1326,6 +2140,7 @@ async def enter_giveaway(giveaway_id: str, user: dict = Depends(get_current_user
         {"id": giveaway_id},
         {"$push": {"entries": user["id"]}}
     )
+    response_cache.invalidate("giveaways")
     return {"message": "Entered giveaway"}
 
 @api_router.post("/giveaways", response_model=Giveaway)
@@ -1334,13 +2149,12 @@ async def create_giveaway(data: GiveawayCreate, user: dict = Depends(require_adm
     giveaway_doc = {
         "id": giveaway_id,
         **data.model_dump(),
-        "end_date": data.end_date.isoformat(),
         "entries": [],
         "winner_id": None,
         "status": "active"
     }
     await db.giveaways.insert_one(giveaway_doc)
-    giveaway_doc["end_date"] = datetime.fromisoformat(giveaway_doc["end_date"])
+    response_cache.invalidate("giveaways")
     return Giveaway(**giveaway_doc)
 
 # === Seller Routes ===
@@ -1352,15 +2166,31 @@ async def get_seller(seller_id: str):
     return seller
 
 @api_router.get("/sellers/{seller_id}/products", response_model=List[Product])
-async def get_seller_products(seller_id: str, skip: int = 0, limit: int = 20):
-    products = await db.products.find(
-        {"seller_id": seller_id},
-        {"_id": 0}
-    ).skip(skip).limit(limit).to_list(limit)
-    
-    for p in products:
-        p["created_at"] = datetime.fromisoformat(p["created_at"])
-    return products
+async def get_seller_products(
+    seller_id: str, response: Response, fields: Optional[str] = None,
+    cursor: Optional[str] = None, skip: int = 0, limit: int = 20
+):
+    field_names = parse_response_fields(Product, fields)
+    products = await find_page(
+        db.products, {"seller_id": seller_id}, fields_projection(field_names, "created_at", "id"),
+        NEWEST_FIRST, response, cursor=cursor, skip=skip, limit=limit
+    )
+    return fast_response(shape(Product, products, field_names), response)
+
+@api_router.get("/sellers/me/products/export")
+async def export_my_products(format: str = "ndjson", user: dict = Depends(require_seller)):
+    """Stream the seller's whole catalogue as NDJSON or CSV, oldest first"""
+    if format not in CONTENT_TYPES:
+        raise HTTPException(status_code=400, detail=f"Unknown format: {format}")
+    fields = list(Product.model_fields)
+    docs = db.products.find(
+        {"seller_id": user["id"]}, fields_projection(fields), batch_size=1000
+    ).sort([("created_at", 1), ("id", 1)])
+    return StreamingResponse(
+        export_rows(format, docs, fields),
+        media_type=CONTENT_TYPES[format],
+        headers={"Content-Disposition": f'attachment; filename="products.{format}"'}
+    )
 
 # === Admin Routes ===
 @api_router.get("/admin/stats", response_model=AdminStats)
@@ -1420,10 +2250,7 @@ async def get_advanced_stats(user: dict = Depends(require_admin)):
             {
                 "$match": {
                     "status": "paid",
-                    "created_at": {
-                        "$gte": start_of_day.isoformat(),
-                        "$lte": end_of_day.isoformat()
-                    }
+                    **date_range("created_at", gte=start_of_day, lte=end_of_day)
                 }
             },
             {"$group": {"_id": None, "total": {"$sum": "$total"}}}
@@ -1488,9 +2315,7 @@ async def get_advanced_stats(user: dict = Depends(require_admin)):
         date = datetime.now(timezone.utc) - timedelta(days=i)
         start_of_day = date.replace(hour=0, minute=0, second=0, microsecond=0)
         
-        count = await db.users.count_documents({
-            "created_at": {"$lte": start_of_day.isoformat()}
-        })
+        count = await db.users.count_documents(date_range("created_at", lte=start_of_day))
         
         user_growth.append({
             "date": date.strftime("%Y-%m-%d"),
@@ -1516,19 +2341,59 @@ async def get_advanced_stats(user: dict = Depends(require_admin)):
     }
 
 @api_router.get("/admin/users")
-async def get_all_users(user: dict = Depends(require_admin), skip: int = 0, limit: int = 50):
-    users = await db.users.find({}, {"_id": 0, "password_hash": 0}).skip(skip).limit(limit).to_list(limit)
-    return users
+async def get_all_users(
+    response: Response, user: dict = Depends(require_admin),
+    cursor: Optional[str] = None, skip: int = 0, limit: int = 50
+):
+    return await find_page(
+        db.users, {}, {"_id": 0, "password_hash": 0}, NEWEST_FIRST, response, cursor=cursor, skip=skip, limit=limit
+    )
 
 @api_router.get("/admin/products")
-async def get_all_products_admin(user: dict = Depends(require_admin), skip: int = 0, limit: int = 50):
-    products = await db.products.find({}, {"_id": 0}).skip(skip).limit(limit).to_list(limit)
-    return products
+async def get_all_products_admin(
+    response: Response, user: dict = Depends(require_admin),
+    cursor: Optional[str] = None, skip: int = 0, limit: int = 50
+):
+    return await find_page(
+        db.products, {}, {"_id": 0}, NEWEST_FIRST, response, cursor=cursor, skip=skip, limit=limit
+    )
 
 @api_router.get("/admin/orders")
-async def get_all_orders(user: dict = Depends(require_admin), skip: int = 0, limit: int = 50):
-    orders = await db.orders.find({}, {"_id": 0}).skip(skip).limit(limit).to_list(limit)
-    return orders
+async def get_all_orders(
+    response: Response, user: dict = Depends(require_admin),
+    cursor: Optional[str] = None, skip: int = 0, limit: int = 50
+):
+    return await find_page(
+        db.orders, {}, {"_id": 0}, NEWEST_FIRST, response, cursor=cursor, skip=skip, limit=limit
+    )
+
+@api_router.get("/admin/metrics")
+async def get_runtime_metrics(user: dict = Depends(require_admin)):
+    """In-process cache and worker counters for this backend instance"""
+    lookups = user_cache_stats["hits"] + user_cache_stats["misses"]
+    return {
+        "password_hasher": password_hasher.metrics(),
+        "revocation": revocation_list.metrics(),
+        "search_index": search_index.metrics(),
+        "suggest_index": suggest_index.metrics(),
+        "view_counter": view_counter.metrics(),
+        "stock_reservations": stock_reservations.metrics(),
+        "notifications": notification_queue.metrics(),
+        "webhook_inbox": webhook_inbox.metrics(),
+        "balances": balances.metrics(),
+        "ledger": ledger.metrics(),
+        "payments": {**payment_gateway.metrics(), "reconciler": payment_reconcile_stats},
+        "product_cache": product_cache.metrics(),
+        "response_cache": response_cache.metrics(),
+        "facet_cache": {"size": len(facet_cache), "ttl_seconds": facet_cache.ttl},
+        "user_cache": {
+            **user_cache_stats,
+            "size": len(user_cache),
+            "maxsize": user_cache.maxsize,
+            "ttl_seconds": user_cache.ttl,
+            "hit_rate": user_cache_stats["hits"] / lookups if lookups else 0.0
+        }
+    }
 
 # === Admin Category Management ===
 @api_router.put("/categories/{category_id}")
@@ -1545,6 +2410,8 @@ async def update_category(category_id: str, data: CategoryCreate, user: dict = D
     
     update_data = {**data.model_dump(), "level": level}
     await db.categories.update_one({"id": category_id}, {"$set": update_data})
+    response_cache.invalidate("categories")
+    await refresh_suggest_categories()
     
     updated = await db.categories.find_one({"id": category_id}, {"_id": 0})
     return Category(**updated)
@@ -1569,14 +2436,18 @@ async def delete_category(category_id: str, force: bool = False, user: dict = De
     # If force delete, remove products category reference
     if force and products_count > 0:
         await db.products.update_many({"category_id": category_id}, {"$set": {"category_id": None}})
+        product_cache.clear()
+        invalidate_facet_cache()
     
     # If force delete, remove subcategories parent reference
     if force and subcategories > 0:
         await db.categories.update_many({"parent_id": category_id}, {"$set": {"parent_id": None}})
     
     result = await db.categories.delete_one({"id": category_id})
+    response_cache.invalidate("categories")
     if result.deleted_count == 0:
         raise HTTPException(status_code=404, detail="Категория не найдена")
+    await refresh_suggest_categories()
     
     return {"message": "Категория удалена"}
 
@@ -1649,6 +2520,7 @@ async def get_site_settings(user: dict = Depends(require_admin)):
             "custom_head_scripts": None
         }
         await db.site_settings.insert_one(default_settings)
+        response_cache.invalidate("settings")
         return default_settings
     return settings
 
@@ -1656,6 +2528,7 @@ async def get_site_settings(user: dict = Depends(require_admin)):
 async def update_site_settings(settings: SiteSettings, user: dict = Depends(require_admin)):
     settings_dict = settings.model_dump()
     await db.site_settings.update_one({}, {"$set": settings_dict}, upsert=True)
+    response_cache.invalidate("settings")
     return {"message": "Settings updated successfully", "settings": settings_dict}
 
 # === Admin User Management ===
@@ -1665,39 +2538,60 @@ async def update_user_role(user_id: str, role: str, admin: dict = Depends(requir
     if role not in ["buyer", "seller", "admin"]:
         raise HTTPException(status_code=400, detail="Invalid role")
     
-    result = await db.users.update_one({"id": user_id}, {"$set": {"role": role}})
+    result = await db.users.update_one(
+        {"id": user_id},
+        {"$set": {"role": role}, "$inc": {"token_version": 1}}
+    )
+    invalidate_user_cache(user_id)
     if result.modified_count == 0:
         raise HTTPException(status_code=404, detail="User not found")
+    await revoke_user_tokens(user_id)
     
     return {"message": f"User role updated to {role}"}
 
 @api_router.put("/admin/users/{user_id}/balance")
 async def adjust_user_balance(user_id: str, amount: float, admin: dict = Depends(require_admin)):
     """Adjust user balance (add or subtract)"""
-    user = await db.users.find_one({"id": user_id}, {"_id": 0})
-    if not user:
-        raise HTTPException(status_code=404, detail="User not found")
-    
-    new_balance = user.get("balance", 0.0) + amount
-    if new_balance < 0:
-        raise HTTPException(status_code=400, detail="Balance cannot be negative")
-    
-    await db.users.update_one({"id": user_id}, {"$set": {"balance": new_balance}})
-    
-    # Create transaction record
+    if amount == 0:
+        raise HTTPException(status_code=400, detail="Amount must not be zero")
+    # A role-claim token resolves to the admin's id only; load them for the email
+    actor = admin if "email" in admin else await get_cached_user(admin["id"]) or {}
     transaction = {
-        "id": str(uuid.uuid4()),
-        "user_id": user_id,
-        "amount": abs(amount),
         "type": "deposit" if amount > 0 else "withdrawal",
-        "status": "completed",
         "method": "admin_adjustment",
-        "description": f"Admin adjustment by {admin['email']}",
-        "created_at": datetime.now(timezone.utc).isoformat()
+        "description": f"Admin adjustment by {actor.get('email', admin['id'])}"
     }
-    await db.transactions.insert_one(transaction)
+    try:
+        transaction = await balances.apply(db, user_id, amount, transaction, "platform:adjustments")
+    except AccountNotFound:
+        raise HTTPException(status_code=404, detail="User not found")
+    except InsufficientBalance:
+        raise HTTPException(status_code=400, detail="Balance cannot be negative")
+    invalidate_user_cache(user_id)
     
-    return {"message": "Balance adjusted", "new_balance": new_balance}
+    return {"message": "Balance adjusted", "new_balance": transaction["balance_after"]}
+
+@api_router.get("/admin/users/{user_id}/balance")
+async def get_user_balance(user_id: str, as_of: Optional[datetime] = None, admin: dict = Depends(require_admin)):
+    """A user's balance next to the ledger's, now or as of a past moment"""
+    user = await db.users.find_one({"id": user_id}, {"_id": 0, "balance": 1})
+    if not user:
+        raise HTTPException(status_code=404, detail="User not found")
+    if as_of is not None and as_of.tzinfo is None:
+        as_of = as_of.replace(tzinfo=timezone.utc)
+    result = {
+        "user_id": user_id,
+        "ledger_balance": await ledger.balance_as_of(db, user_account(user_id), as_of),
+        "as_of": as_of
+    }
+    if as_of is None:
+        result["balance"] = user.get("balance", 0.0)
+    return result
+
+@api_router.post("/admin/ledger/verify")
+async def verify_ledger(admin: dict = Depends(require_admin)):
+    """Check every users.balance against the ledger now"""
+    return await ledger.verify(db)
 
 @api_router.delete("/admin/users/{user_id}")
 async def delete_user(user_id: str, admin: dict = Depends(require_admin)):
@@ -1706,17 +2600,23 @@ async def delete_user(user_id: str, admin: dict = Depends(require_admin)):
         raise HTTPException(status_code=400, detail="Cannot delete your own account")
     
     result = await db.users.delete_one({"id": user_id})
+    invalidate_user_cache(user_id)
     if result.deleted_count == 0:
         raise HTTPException(status_code=404, detail="User not found")
+    await revoke_user_tokens(user_id)
     
     return {"message": "User deleted successfully"}
 
 # === Admin Transaction Management ===
 @api_router.get("/admin/transactions")
-async def get_all_transactions(admin: dict = Depends(require_admin), skip: int = 0, limit: int = 50):
+async def get_all_transactions(
+    response: Response, admin: dict = Depends(require_admin),
+    cursor: Optional[str] = None, skip: int = 0, limit: int = 50
+):
     """Get all transactions"""
-    transactions = await db.transactions.find({}, {"_id": 0}).sort("created_at", -1).skip(skip).limit(limit).to_list(limit)
-    return transactions
+    return await find_page(
+        db.transactions, {}, {"_id": 0}, NEWEST_FIRST, response, cursor=cursor, skip=skip, limit=limit
+    )
 
 @api_router.put("/admin/transactions/{transaction_id}/status")
 async def update_transaction_status(transaction_id: str, status: str, admin: dict = Depends(require_admin)):
@@ -1748,6 +2648,8 @@ async def update_order_status(order_id: str, status: str, admin: dict = Depends(
     
     if result.modified_count == 0:
         raise HTTPException(status_code=404, detail="Order not found")
+    if status == "cancelled":
+        await release_order_stock(order_id)
     
     return {"message": f"Order status updated to {status}"}
 
@@ -1765,6 +2667,7 @@ async def update_giveaway(giveaway_id: str, data: GiveawayCreate, admin: dict =
         {"id": giveaway_id},
         {"$set": data.model_dump()}
     )
+    response_cache.invalidate("giveaways")
     
     if result.modified_count == 0:
         raise HTTPException(status_code=404, detail="Giveaway not found")
@@ -1775,6 +2678,7 @@ async def update_giveaway(giveaway_id: str, data: GiveawayCreate, admin: dict =
 async def delete_giveaway(giveaway_id: str, admin: dict = Depends(require_admin)):
     """Delete giveaway"""
     result = await db.giveaways.delete_one({"id": giveaway_id})
+    response_cache.invalidate("giveaways")
     
     if result.deleted_count == 0:
         raise HTTPException(status_code=404, detail="Giveaway not found")
@@ -1782,33 +2686,35 @@ async def delete_giveaway(giveaway_id: str, admin: dict = Depends(require_admin)
     return {"message": "Giveaway deleted successfully"}
 
 @api_router.get("/settings/public")
-async def get_public_settings():
+async def get_public_settings(request: Request):
     """Public endpoint for frontend to get site settings"""
-    settings = await db.site_settings.find_one({}, {"_id": 0})
-    if not settings:
-        return {
-            "primary_color": "#00ff9d",
-            "secondary_color": "#0d1117",
-            "accent_color": "#00cc7d",
-            "background_color": "#02040a",
-            "text_color": "#ffffff",
-            "site_name": "GameHub",
-            "site_description": "Маркетплейс игровых товаров",
-            "footer_navigation": [
-                {"title": "Каталог", "url": "/catalog"},
-                {"title": "Раздачи", "url": "/giveaways"},
-                {"title": "Блог", "url": "/blog"}
-            ],
-            "footer_support": [
-                {"title": "FAQ", "url": "#"},
-                {"title": "Контакты", "url": "#"}
-            ],
-            "footer_legal": [
-                {"title": "Условия использования", "url": "#"},
-                {"title": "Политика конфиденциальности", "url": "#"}
-            ]
-        }
-    return settings
+    async def build():
+        settings = await db.site_settings.find_one({}, {"_id": 0})
+        if not settings:
+            return {
+                "primary_color": "#00ff9d",
+                "secondary_color": "#0d1117",
+                "accent_color": "#00cc7d",
+                "background_color": "#02040a",
+                "text_color": "#ffffff",
+                "site_name": "GameHub",
+                "site_description": "Маркетплейс игровых товаров",
+                "footer_navigation": [
+                    {"title": "Каталог", "url": "/catalog"},
+                    {"title": "Раздачи", "url": "/giveaways"},
+                    {"title": "Блог", "url": "/blog"}
+                ],
+                "footer_support": [
+                    {"title": "FAQ", "url": "#"},
+                    {"title": "Контакты", "url": "#"}
+                ],
+                "footer_legal": [
+                    {"title": "Условия использования", "url": "#"},
+                    {"title": "Политика конфиденциальности", "url": "#"}
+                ]
+            }, {}
+        return settings, {}
+    return await response_cache.respond(request, ("settings",), PUBLIC_CACHE_CONTROL, build)
 
 # === Chat Routes (Simple) ===
 @api_router.post("/chats")
@@ -1828,7 +2734,7 @@ async def create_chat(seller_id: str, product_id: str, user: dict = Depends(get_
         "buyer_id": user["id"],
         "product_id": product_id,
         "messages": [],
-        "last_message_at": datetime.now(timezone.utc).isoformat()
+        "last_message_at": datetime.now(timezone.utc)
     }
     await db.chats.insert_one(chat_doc)
     return {"chat_id": chat_id}
@@ -1846,7 +2752,7 @@ async def send_message(chat_id: str, message: str, user: dict = Depends(get_curr
         "id": str(uuid.uuid4()),
         "sender_id": user["id"],
         "message": message,
-        "sent_at": datetime.now(timezone.utc).isoformat()
+        "sent_at": datetime.now(timezone.utc)
     }
     
     await db.chats.update_one(
@@ -1883,6 +2789,7 @@ app.add_middleware(
     allow_origins=os.environ.get('CORS_ORIGINS', '*').split(','),
     allow_methods=["*"],
     allow_headers=["*"],
+    expose_headers=["X-Next-Cursor", "ETag", "Last-Modified"],
 )
 
 # Configure logging
@@ -1892,6 +2799,207 @@ logging.basicConfig(
 )
 logger = logging.getLogger(__name__)
 
+background_tasks: List[asyncio.Task] = []
+
+# Identifies this process as the holder of cluster-wide job leases
+JOB_LEASE_HOLDER = f"{os.getpid()}-{uuid.uuid4().hex[:8]}"
+
+async def run_periodically(interval_seconds: float, job, name: str, exclusive: bool = False):
+    """Run an async job forever, logging (not propagating) its failures.
+
+    An ``exclusive`` job runs on one worker at a time: each run first takes
+    the job's lease and is skipped while another worker holds it.
+    """
+    while True:
+        await asyncio.sleep(interval_seconds)
+        try:
+            if exclusive and not await claim_job_lease(name, 2 * interval_seconds):
+                continue
+            await job()
+        except Exception as e:
+            logger.error(f"Background job {name} failed: {e}")
+
+async def claim_job_lease(name: str, seconds: float) -> bool:
+    """Take (or renew) the lease on a job every worker schedules; False while
+    another worker holds it. The holder renews on each run; if it stops, the
+    lease runs out after ``seconds`` and the next worker to ask takes over."""
+    now = datetime.now(timezone.utc)
+    try:
+        await db.job_leases.find_one_and_update(
+            {"name": name, "$or": [{"leased_until": {"$lte": now}}, {"holder": JOB_LEASE_HOLDER}]},
+            {"$set": {"holder": JOB_LEASE_HOLDER, "leased_until": now + timedelta(seconds=seconds)}},
+            upsert=True
+        )
+    except DuplicateKeyError:
+        return False  # held by another worker, so the upsert hit the unique name
+    return True
+
+async def rebuild_search_index():
+    """Rebuild the product search index from Mongo without blocking requests.
+
+    Tokenizing runs in a worker thread batch by batch; writes that land
+    meanwhile are recorded by the live index and replayed after the swap.
+    """
+    if search_index.rebuilding:
+        return
+    builder = search_index.begin_rebuild()
+    try:
+        batch = []
+        async for doc in db.products.find({}, {"_id": 0, "id": 1, "title": 1, "description": 1}):
+            batch.append(doc)
+            if len(batch) >= 5000:
+                await asyncio.to_thread(builder.add_batch, batch)
+                batch = []
+        await asyncio.to_thread(builder.add_batch, batch)
+        built = await asyncio.to_thread(builder.finish)
+    except BaseException:
+        search_index.abort_rebuild()
+        raise
+    search_index.finish_rebuild(built)
+    logger.info(f"Search index rebuilt with {len(search_index)} products")
+
+async def flush_view_counts():
+    try:
+        flushed = await view_counter.flush(db.products)
+        # Cached copies would otherwise lose the views just moved out of the counter
+        product_cache.invalidate(flushed)
+    except Exception as e:
+        logger.error(f"View counter flush failed: {e}")
+
+async def refresh_recommendation_feed():
+    await refresh_recommendations(db, recommendation_executor)
+    recommendation_cache.clear()
+
+async def refresh_suggest_categories():
+    categories = await db.categories.find({}, {"_id": 0, "id": 1, "name": 1, "slug": 1}).to_list(1000)
+    suggest_index.set_categories(categories)
+
+async def rebuild_suggest_index():
+    """Rebuild the autocomplete prefix table from products and categories"""
+    await refresh_suggest_categories()
+    if suggest_index.rebuilding:
+        return
+    builder = suggest_index.begin_rebuild()
+    try:
+        batch = []
+        projection = {"_id": 0, "id": 1, "title": 1, "sales_count": 1, "views_count": 1}
+        async for doc in db.products.find({}, projection):
+            batch.append(doc)
+            if len(batch) >= 5000:
+                await asyncio.to_thread(builder.add_batch, batch)
+                batch = []
+        await asyncio.to_thread(builder.add_batch, batch)
+        built = await asyncio.to_thread(builder.finish)
+    except BaseException:
+        suggest_index.abort_rebuild()
+        raise
+    suggest_index.finish_rebuild(built)
+
+async def create_indexes():
+    await db.revoked_tokens.create_index([("kind", 1), ("key", 1)], unique=True)
+    await db.revoked_tokens.create_index("expires_at", expireAfterSeconds=0)
+    await db.telegram_auth_tokens.create_index("token", unique=True)
+    await db.telegram_auth_tokens.create_index("expires_at", expireAfterSeconds=0)
+    # Rows written before expires_at became a date are invisible to the TTL monitor
+    await db.telegram_auth_tokens.delete_many({"expires_at": {"$type": "string"}})
+    # Keyset pagination: equality filter first, then the sort key, then id as tie-breaker
+    newest_first = [("created_at", -1), ("id", -1)]
+    await db.products.create_index(newest_first)
+    await db.products.create_index([("category_id", 1)] + newest_first)
+    await db.products.create_index([("seller_id", 1)] + newest_first)
+    await db.products.create_index([("product_type", 1)] + newest_first)
+    for sort_key in ([("price", 1), ("id", 1)], [("sales_count", -1), ("id", -1)]):
+        await db.products.create_index(sort_key)
+        await db.products.create_index([("category_id", 1)] + sort_key)
+    await db.transactions.create_index(newest_first)
+    await db.transactions.create_index([("user_id", 1)] + newest_first)
+    await db.transactions.create_index("id", unique=True)
+    await db.transactions.create_index([("status", 1), ("created_at", 1)])
+    await db.ledger_entries.create_index([("entry_id", 1), ("account", 1)], unique=True)
+    await db.ledger_entries.create_index([("account", 1), ("created_at", 1)])
+    await db.ledger_entries.create_index("created_at")
+    await db.ledger_snapshots.create_index([("account", 1), ("as_of", -1)], unique=True)
+    await db.ledger_checkpoints.create_index("as_of")
+    await db.users.create_index(newest_first)
+    await db.orders.create_index(newest_first)
+    await db.orders.create_index([("status", 1), ("created_at", 1)])
+    await db.blog_posts.create_index([("published_at", -1), ("id", -1)])
+    await db.recently_viewed.create_index("user_id", unique=True)
+    await db.product_similarity.create_index("product_id", unique=True)
+    await db.user_recommendations.create_index("user_id", unique=True)
+    await db.payment_transactions.create_index("session_id")
+    await db.payment_transactions.create_index([("payment_status", 1), ("created_at", 1)])
+    await db.webhook_events.create_index("event_id", unique=True)
+    await db.job_leases.create_index("name", unique=True)
+    await db.webhook_events.create_index([("status", 1), ("received_at", 1)])
+    # Applied events are kept a month for auditing; failed ones stay until looked at
+    await db.webhook_events.create_index(
+        "processed_at", expireAfterSeconds=30 * 24 * 3600, partialFilterExpression={"status": "done"}
+    )
+    await db.stock_reservations.create_index("order_id", unique=True)
+    await db.stock_reservations.create_index([("status", 1), ("expires_at", 1)])
+    # Closed reservations are only kept for a week of auditing
+    await db.stock_reservations.create_index("closed_at", expireAfterSeconds=7 * 24 * 3600)
+    if isinstance(payment_gateway, StubGateway):
+        await db.stub_payment_sessions.create_index("session_id", unique=True)
+        await db.stub_payment_sessions.create_index("expires_at", expireAfterSeconds=0)
+
+@app.on_event("startup")
+async def startup():
+    await create_indexes()
+    await revocation_list.load(db.revoked_tokens)
+    background_tasks.append(asyncio.create_task(run_periodically(
+        REVOCATION_REFRESH_SECONDS, lambda: revocation_list.load(db.revoked_tokens), "revocation refresh"
+    )))
+    # The first build runs in the background; searches use $regex until it's ready
+    background_tasks.append(asyncio.create_task(rebuild_search_index()))
+    background_tasks.append(asyncio.create_task(rebuild_suggest_index()))
+    background_tasks.append(asyncio.create_task(run_periodically(
+        SEARCH_REBUILD_SECONDS, rebuild_search_index, "search index rebuild"
+    )))
+    # Periodic rebuilds also pick up sales/views changes in completion weights
+    background_tasks.append(asyncio.create_task(run_periodically(
+        SEARCH_REBUILD_SECONDS, rebuild_suggest_index, "suggest index rebuild"
+    )))
+    background_tasks.append(asyncio.create_task(run_periodically(
+        VIEW_FLUSH_SECONDS, flush_view_counts, "view counter flush"
+    )))
+    background_tasks.append(asyncio.create_task(run_periodically(
+        RESERVATION_SWEEP_SECONDS, sweep_stock_reservations, "stock reservation sweep"
+    )))
+    background_tasks.append(asyncio.create_task(run_periodically(
+        PAYMENT_RECONCILE_SECONDS, reconcile_pending_payments, "payment reconciliation"
+    )))
+    background_tasks.append(asyncio.create_task(run_periodically(
+        BALANCE_RECOVERY_SECONDS, lambda: balances.recover(db), "balance transaction recovery"
+    )))
+    background_tasks.append(asyncio.create_task(run_periodically(
+        LEDGER_CHECKPOINT_SECONDS, lambda: ledger.checkpoint(db), "ledger checkpoint", exclusive=True
+    )))
+    if LEDGER_VERIFY_SECONDS > 0:
+        background_tasks.append(asyncio.create_task(run_periodically(
+            LEDGER_VERIFY_SECONDS, lambda: ledger.verify(db), "ledger verification", exclusive=True
+        )))
+    if SIMILARITY_REBUILD_SECONDS > 0:
+        background_tasks.append(asyncio.create_task(run_periodically(
+            SIMILARITY_REBUILD_SECONDS, lambda: build_product_similarity(db), "product similarity rebuild",
+            exclusive=True
+        )))
+    if RECOMMENDATIONS_REFRESH_SECONDS > 0:
+        background_tasks.append(asyncio.create_task(run_periodically(
+            RECOMMENDATIONS_REFRESH_SECONDS, refresh_recommendation_feed, "recommendations refresh", exclusive=True
+        )))
+    notification_queue.start()
+    background_tasks.append(asyncio.create_task(webhook_inbox.run(db, WEBHOOK_POLL_SECONDS)))
+    if BCRYPT_TARGET_MS > 0:
+        await password_hasher.calibrate(BCRYPT_TARGET_MS)
+
 @app.on_event("shutdown")
 async def shutdown_db_client():
+    for task in background_tasks:
+        task.cancel()
+    await flush_view_counts()
+    await notification_queue.stop()
+    password_hasher.shutdown()
+    recommendation_executor.shutdown(wait=False, cancel_futures=True)
     client.close()
\ No newline at end of file
@@ -0,0 +1,192 @@
+"""
+Item-to-item similarity for GameHub Marketplace
+Products that the same users buy, favorite and view together are neighbours.
+Co-occurrence counts are accumulated as a sparse COO matrix in NumPy (pair
+keys reduced with np.unique), cosine-normalised, and the top K neighbours per
+product are stored in `product_similarity` for /products/{id}/similar.
+
+Usage: python similarity.py [--top-k 20]
+"""
+import argparse
+import asyncio
+import logging
+import os
+from datetime import datetime, timezone
+from typing import Dict, Iterable, Iterator, List, Tuple
+
+import numpy as np
+from pymongo import ReplaceOne
+
+logger = logging.getLogger(__name__)
+
+SIGNAL_WEIGHTS = {"purchase": 3.0, "favorite": 2.0, "view": 1.0}
+TOP_K = 20
+MAX_BASKET = 50          # larger baskets are truncated; pair count grows quadratically
+COMPACT_PAIRS = 20_000_000  # fold duplicate pair keys once this many are buffered
+SHRINKAGE = 5.0          # damps scores backed by only a co-occurrence or two
+
+
+class CooccurrenceBuilder:
+    """Accumulates weighted baskets into pair keys ``(a << 32) | b`` with a < b"""
+
+    def __init__(self):
+        self.product_ids: List[str] = []
+        self._index: Dict[str, int] = {}
+        self._pair_keys: List[np.ndarray] = []
+        self._pair_weights: List[np.ndarray] = []
+        self._buffered = 0
+        self._items: List[np.ndarray] = []
+        self._item_weights: List[np.ndarray] = []
+        self.baskets = 0
+
+    def _encode(self, basket: Iterable[str]) -> List[int]:
+        encoded = []
+        for product_id in dict.fromkeys(basket):
+            index = self._index.get(product_id)
+            if index is None:
+                index = self._index[product_id] = len(self.product_ids)
+                self.product_ids.append(product_id)
+            encoded.append(index)
+            if len(encoded) == MAX_BASKET:
+                break
+        return encoded
+
+    def add_baskets(self, baskets: Iterable[Iterable[str]], weight: float):
+        by_size: Dict[int, List[List[int]]] = {}
+        for basket in baskets:
+            encoded = self._encode(basket)
+            if encoded:
+                by_size.setdefault(len(encoded), []).append(encoded)
+                self.baskets += 1
+
+        for size, rows in by_size.items():
+            matrix = np.array(rows, dtype=np.int64)
+            self._items.append(matrix.ravel())
+            self._item_weights.append(np.full(matrix.size, weight))
+            if size < 2:
+                continue
+            # Every basket of this size yields the same upper-triangle of pairs
+            left, right = np.triu_indices(size, k=1)
+            a, b = matrix[:, left].ravel(), matrix[:, right].ravel()
+            keys = (np.minimum(a, b) << 32) | np.maximum(a, b)
+            self._pair_keys.append(keys)
+            self._pair_weights.append(np.full(keys.size, weight))
+            self._buffered += keys.size
+
+        if self._buffered > COMPACT_PAIRS:
+            self._compact()
+
+    def _compact(self):
+        if not self._pair_keys:
+            return
+        keys, inverse = np.unique(np.concatenate(self._pair_keys), return_inverse=True)
+        weights = np.bincount(inverse, weights=np.concatenate(self._pair_weights))
+        self._pair_keys, self._pair_weights = [keys], [weights]
+        self._buffered = keys.size
+
+    def finish(self, top_k: int = TOP_K) -> dict:
+        """Cosine-normalised top-K neighbours as flat arrays grouped by product"""
+        n = len(self.product_ids)
+        self._compact()
+        if not self._pair_keys:
+            empty = np.zeros(0, dtype=np.int64)
+            return {"product_ids": self.product_ids, "rows": empty, "cols": empty, "scores": np.zeros(0)}
+
+        keys, weights = self._pair_keys[0], self._pair_weights[0]
+        a, b = keys >> 32, keys & 0xFFFFFFFF
+        occurrences = np.bincount(
+            np.concatenate(self._items), weights=np.concatenate(self._item_weights), minlength=n
+        )
+        scores = weights / (np.sqrt(occurrences[a] * occurrences[b]) + SHRINKAGE)
+
+        rows = np.concatenate([a, b])
+        cols = np.concatenate([b, a])
+        scores = np.concatenate([scores, scores])
+        order = np.lexsort((-scores, rows))
+        rows, cols, scores = rows[order], cols[order], scores[order]
+        starts = np.searchsorted(rows, np.arange(n))
+        keep = np.arange(rows.size) - starts[rows] < top_k
+        return {"product_ids": self.product_ids, "rows": rows[keep], "cols": cols[keep], "scores": scores[keep]}
+
+
+def iter_neighbors(built: dict) -> Iterator[Tuple[str, List[dict]]]:
+    product_ids, rows, cols, scores = built["product_ids"], built["rows"], built["cols"], built["scores"]
+    bounds = np.flatnonzero(np.diff(rows)) + 1
+    for start, end in zip(np.concatenate([[0], bounds]), np.concatenate([bounds, [rows.size]])):
+        if start == end:
+            continue
+        yield product_ids[rows[start]], [
+            {"product_id": product_ids[col], "score": round(float(score), 6)}
+            for col, score in zip(cols[start:end], scores[start:end])
+        ]
+
+
+async def _feed(builder: CooccurrenceBuilder, cursor, field: str, weight: float, batch_size: int = 5000):
+    batch = []
+    async for doc in cursor:
+        batch.append(doc[field])
+        if len(batch) >= batch_size:
+            await asyncio.to_thread(builder.add_baskets, batch, weight)
+            batch = []
+    await asyncio.to_thread(builder.add_baskets, batch, weight)
+
+
+async def build_product_similarity(db, top_k: int = TOP_K) -> dict:
+    """Recompute `product_similarity` from paid orders, favorites and view history"""
+    started = datetime.now(timezone.utc)
+    builder = CooccurrenceBuilder()
+
+    await _feed(builder, db.orders.aggregate([
+        {"$match": {"status": "paid"}},
+        {"$unwind": "$items"},
+        {"$group": {"_id": "$user_id", "product_ids": {"$addToSet": "$items.product_id"}}}
+    ], allowDiskUse=True), "product_ids", SIGNAL_WEIGHTS["purchase"])
+    await _feed(builder, db.favorites.aggregate([
+        {"$group": {"_id": "$user_id", "product_ids": {"$push": "$product_id"}}}
+    ], allowDiskUse=True), "product_ids", SIGNAL_WEIGHTS["favorite"])
+    await _feed(
+        builder, db.recently_viewed.find({}, {"_id": 0, "product_ids": 1}), "product_ids", SIGNAL_WEIGHTS["view"]
+    )
+
+    built = await asyncio.to_thread(builder.finish, top_k)
+    written = 0
+    batch = []
+    for product_id, neighbors in iter_neighbors(built):
+        batch.append(ReplaceOne(
+            {"product_id": product_id},
+            {"product_id": product_id, "neighbors": neighbors, "updated_at": started},
+            upsert=True
+        ))
+        if len(batch) >= 1000:
+            await db.product_similarity.bulk_write(batch, ordered=False)
+            written += len(batch)
+            batch = []
+    if batch:
+        await db.product_similarity.bulk_write(batch, ordered=False)
+        written += len(batch)
+    # Products that lost every co-occurrence fall back to their category
+    stale = await db.product_similarity.delete_many({"updated_at": {"$lt": started}})
+
+    stats = {"baskets": builder.baskets, "products": written, "removed": stale.deleted_count}
+    logger.info(f"Product similarity rebuilt: {stats}")
+    return stats
+
+
+if __name__ == "__main__":
+    from pathlib import Path
+
+    from dotenv import load_dotenv
+    from motor.motor_asyncio import AsyncIOMotorClient
+
+    load_dotenv(Path(__file__).parent / '.env')
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--top-k", type=int, default=TOP_K)
+    args = parser.parse_args()
+
+    async def main():
+        client = AsyncIOMotorClient(os.environ['MONGO_URL'])
+        await client[os.environ['DB_NAME']].product_similarity.create_index("product_id", unique=True)
+        print(await build_product_similarity(client[os.environ['DB_NAME']], args.top_k))
+        client.close()
+
+    asyncio.run(main())
@@ -0,0 +1,259 @@
+"""
+Search-as-you-type suggestions for GameHub Marketplace
+Edge n-grams of product titles kept as one sorted byte-string array, so a
+prefix is a binary-searched range whose best entries are picked by weight.
+"""
+import math
+import re
+from typing import Dict, Iterable, List, Optional, Set
+
+import numpy as np
+
+from search import normalize
+
+WORD_RE = re.compile(r"[0-9a-zа-я]+")
+KEY_BYTES = 32          # phrase keys are truncated to this many UTF-8 bytes
+MAX_WORD_POSITIONS = 4  # a title is reachable from the start of its first N words
+TITLE_START_BONUS = 1.0
+COMPACT_AFTER = 1000    # products written since the last rebuild before they're merged into the array
+
+
+def normalize_query(text: str) -> str:
+    return " ".join(WORD_RE.findall(normalize(text)))
+
+
+def product_weight(doc: dict) -> float:
+    """Popularity used to order completions: sales dominate views"""
+    return 3 * math.log1p(doc.get("sales_count") or 0) + math.log1p(doc.get("views_count") or 0)
+
+
+def _upper_bound(prefix: bytes) -> Optional[bytes]:
+    """The smallest key above every key starting with ``prefix`` (None: no such key).
+
+    Incrementing the last byte keeps the bound within KEY_BYTES, unlike
+    appending one, which the fixed-width key type would truncate away.
+    """
+    stripped = prefix.rstrip(b"\xff")
+    if not stripped:
+        return None
+    return stripped[:-1] + bytes([stripped[-1] + 1])
+
+
+def _phrase_keys(title: str) -> List[bytes]:
+    words = WORD_RE.findall(normalize(title))
+    return [
+        " ".join(words[i:]).encode("utf-8")[:KEY_BYTES]
+        for i in range(min(len(words), MAX_WORD_POSITIONS))
+    ]
+
+
+class SuggestBuilder:
+    def __init__(self):
+        self.keys: List[bytes] = []
+        self.slots: List[int] = []
+        self.bonus: List[float] = []
+        self.ids: List[str] = []
+        self.titles: List[str] = []
+        self.weights: List[float] = []
+
+    def add_batch(self, docs: Iterable[dict]):
+        for doc in docs:
+            slot = len(self.ids)
+            self.ids.append(doc["id"])
+            self.titles.append(doc.get("title") or "")
+            self.weights.append(product_weight(doc))
+            for position, key in enumerate(_phrase_keys(doc.get("title") or "")):
+                self.keys.append(key)
+                self.slots.append(slot)
+                self.bonus.append(TITLE_START_BONUS if position == 0 else 0.0)
+
+    def finish(self) -> dict:
+        keys = np.array(self.keys, dtype=f"S{KEY_BYTES}")
+        order = np.argsort(keys, kind="stable")
+        slots = np.array(self.slots, dtype=np.int32)[order]
+        doc_weights = np.array(self.weights, dtype=np.float32)
+        return {
+            "keys": keys[order],
+            "slots": slots,
+            "weights": doc_weights[slots] + np.array(self.bonus, dtype=np.float32)[order],
+            "ids": self.ids,
+            "titles": self.titles
+        }
+
+
+class SuggestIndex:
+    """Prefix completions over product titles plus category names.
+
+    Products written since the last rebuild live in a small delta list that
+    is scanned linearly; replaced or deleted products are masked by id. Once
+    COMPACT_AFTER products have been written, the delta is merged into the
+    sorted array and the masked entries dropped, so neither grows until the
+    next full rebuild.
+    """
+
+    def __init__(self):
+        self.ready = False
+        self._replay: Optional[list] = None
+        self._load(SuggestBuilder().finish())
+        self.categories: List[dict] = []
+        self.stats = {"queries": 0, "rebuilds": 0, "compactions": 0}
+
+    def _load(self, built: dict):
+        self._keys = built["keys"]
+        self._slots = built["slots"]
+        self._weights = built["weights"]
+        self._ids = built["ids"]
+        self._titles = built["titles"]
+        self._hidden: Set[str] = set()
+        self._delta: Dict[str, dict] = {}  # id -> {"title", "keys", "weight"}
+
+    # --- Rebuild ---
+    @property
+    def rebuilding(self) -> bool:
+        return self._replay is not None
+
+    def begin_rebuild(self) -> SuggestBuilder:
+        self._replay = []
+        return SuggestBuilder()
+
+    def abort_rebuild(self):
+        self._replay = None
+
+    def finish_rebuild(self, built: dict):
+        replay, self._replay = self._replay or [], None
+        self._load(built)
+        for op, payload in replay:
+            if op == "add":
+                self.add(payload)
+            else:
+                self.remove(payload)
+        self.ready = True
+        self.stats["rebuilds"] += 1
+
+    def set_categories(self, categories: List[dict]):
+        self.categories = [
+            {**category, "_key": normalize_query(category.get("name") or "")}
+            for category in categories
+        ]
+
+    # --- Incremental updates ---
+    def add(self, doc: dict):
+        if self._replay is not None:
+            self._replay.append(("add", {
+                key: doc.get(key) for key in ("id", "title", "sales_count", "views_count")
+            }))
+        self._hidden.add(doc["id"])
+        self._delta[doc["id"]] = {
+            "title": doc.get("title") or "",
+            "keys": _phrase_keys(doc.get("title") or ""),
+            "weight": product_weight(doc)
+        }
+        if len(self._hidden) >= COMPACT_AFTER:
+            self._compact()
+
+    def remove(self, doc_id: str):
+        if self._replay is not None:
+            self._replay.append(("remove", doc_id))
+        self._hidden.add(doc_id)
+        self._delta.pop(doc_id, None)
+        if len(self._hidden) >= COMPACT_AFTER:
+            self._compact()
+
+    def _compact(self):
+        """Fold the delta into the sorted array and drop masked entries.
+
+        New keys are sorted on their own and spliced in by binary search, a
+        linear copy rather than a re-sort. A masked product keeps its slot in
+        ids/titles (nothing points at it any more) until the next rebuild.
+        """
+        hidden_slots = [slot for slot, doc_id in enumerate(self._ids) if doc_id in self._hidden]
+        keep = ~np.isin(self._slots, np.array(hidden_slots, dtype=np.int32))
+        keys, slots, weights = self._keys[keep], self._slots[keep], self._weights[keep]
+
+        new_keys, new_slots, new_weights = [], [], []
+        for doc_id, entry in self._delta.items():
+            slot = len(self._ids)
+            self._ids.append(doc_id)
+            self._titles.append(entry["title"])
+            for position, key in enumerate(entry["keys"]):
+                new_keys.append(key)
+                new_slots.append(slot)
+                new_weights.append(entry["weight"] + (TITLE_START_BONUS if position == 0 else 0.0))
+        if new_keys:
+            added = np.array(new_keys, dtype=f"S{KEY_BYTES}")
+            order = np.argsort(added, kind="stable")
+            at = np.searchsorted(keys, added[order], side="right")
+            keys = np.insert(keys, at, added[order])
+            slots = np.insert(slots, at, np.array(new_slots, dtype=np.int32)[order])
+            weights = np.insert(weights, at, np.array(new_weights, dtype=np.float32)[order])
+
+        self._keys, self._slots, self._weights = keys, slots, weights
+        self._hidden = set()
+        self._delta = {}
+        self.stats["compactions"] += 1
+
+    # --- Querying ---
+    def suggest(self, query: str, limit: int = 8) -> List[dict]:
+        """Best title completions for a prefix, most popular first"""
+        self.stats["queries"] += 1
+        prefix = normalize_query(query).encode("utf-8")[:KEY_BYTES]
+        if not prefix:
+            return []
+
+        candidates = {}  # id -> (weight, title)
+        lo = int(np.searchsorted(self._keys, prefix, side="left"))
+        bound = _upper_bound(prefix)
+        hi = len(self._keys) if bound is None else int(np.searchsorted(self._keys, bound, side="left"))
+        if hi > lo:
+            weights = self._weights[lo:hi]
+            # A product can match at several word positions, and some may be
+            # masked: rank the best few, widening only if they run out
+            wanted = limit * MAX_WORD_POSITIONS
+            while True:
+                wanted = min(wanted, hi - lo)
+                top = np.argpartition(-weights, wanted - 1)[:wanted] if wanted < hi - lo else np.arange(hi - lo)
+                for index in top[np.argsort(-weights[top], kind="stable")]:
+                    slot = int(self._slots[lo + index])
+                    doc_id = self._ids[slot]
+                    if doc_id in self._hidden or doc_id in candidates:
+                        continue
+                    candidates[doc_id] = (float(weights[index]), self._titles[slot])
+                    if len(candidates) == limit:
+                        break
+                if len(candidates) == limit or wanted == hi - lo:
+                    break
+                wanted *= 4
+
+        for doc_id, entry in self._delta.items():
+            for position, key in enumerate(entry["keys"]):
+                if key.startswith(prefix):
+                    weight = entry["weight"] + (TITLE_START_BONUS if position == 0 else 0.0)
+                    if weight > candidates.get(doc_id, (-1.0, None))[0]:
+                        candidates[doc_id] = (weight, entry["title"])
+                    break
+
+        ranked = sorted(candidates.items(), key=lambda item: -item[1][0])[:limit]
+        return [{"id": doc_id, "title": title} for doc_id, (_, title) in ranked]
+
+    def suggest_categories(self, query: str, limit: int = 5) -> List[dict]:
+        prefix = normalize_query(query)
+        if not prefix:
+            return []
+        matches = [
+            category for category in self.categories
+            if category["_key"].startswith(prefix) or f" {prefix}" in f" {category['_key']}"
+        ]
+        return [
+            {key: value for key, value in category.items() if key != "_key"}
+            for category in matches[:limit]
+        ]
+
+    def metrics(self) -> dict:
+        return {
+            **self.stats,
+            "ready": self.ready,
+            "entries": len(self._keys),
+            "delta": len(self._delta),
+            "hidden": len(self._hidden),
+            "categories": len(self.categories)
+        }
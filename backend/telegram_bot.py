@@ -20,7 +20,7 @@ load_dotenv(ROOT_DIR / '.env')
 # Get MongoDB connection
 MONGO_URL = os.environ.get('MONGO_URL', 'mongodb://localhost:27017')
 DB_NAME = os.environ.get('DB_NAME', 'test_database')
-client = AsyncIOMotorClient(MONGO_URL)
+client = AsyncIOMotorClient(MONGO_URL, tz_aware=True)
 db = client[DB_NAME]
 
 # Get bot token and frontend URL
@@ -32,12 +32,13 @@ async def generate_auth_token(user_id: str, telegram_id: int) -> str:
     token = secrets.token_urlsafe(32)
     
     # Store token in database with expiration (5 minutes)
+    # expires_at is a real date so the TTL index on it purges stale tokens
     token_doc = {
         "token": token,
         "user_id": user_id,
         "telegram_id": telegram_id,
-        "created_at": datetime.now(timezone.utc).isoformat(),
-        "expires_at": (datetime.now(timezone.utc) + timedelta(minutes=5)).isoformat(),
+        "created_at": datetime.now(timezone.utc),
+        "expires_at": datetime.now(timezone.utc) + timedelta(minutes=5),
         "used": False
     }
     await db.telegram_auth_tokens.insert_one(token_doc)
@@ -83,7 +84,7 @@ async def start(update: Update, context: ContextTypes.DEFAULT_TYPE):
             "balance": 0.0,
             "telegram_id": telegram_id,
             "telegram_username": tg_user.username,
-            "created_at": datetime.now(timezone.utc).isoformat()
+            "created_at": datetime.now(timezone.utc)
         }
         
         await db.users.insert_one(new_user)
@@ -0,0 +1,81 @@
+"""
+Write-behind product view counters for GameHub Marketplace
+Page hits only bump an in-memory tally; the tallies are written back as one
+unordered bulk of $inc updates, so a hot product costs one write per flush.
+"""
+import asyncio
+import time
+from typing import Dict, Optional
+
+from pymongo import UpdateOne
+
+
+class ViewCounter:
+    def __init__(self, max_pending: int = 5000):
+        self.max_pending = max_pending
+        self._pending: Dict[str, int] = {}
+        self._oldest: Optional[float] = None  # monotonic time of the oldest unflushed view
+        self._lock = asyncio.Lock()
+        self.stats = {
+            "recorded": 0,
+            "flushes": 0,
+            "failures": 0,
+            "flushed_views": 0,
+            "last_flush_products": 0,
+            "max_flush_products": 0,
+            "last_lag_ms": 0.0,
+            "max_lag_ms": 0.0
+        }
+
+    @property
+    def full(self) -> bool:
+        return len(self._pending) >= self.max_pending
+
+    def record(self, product_id: str, count: int = 1):
+        if self._oldest is None:
+            self._oldest = time.monotonic()
+        self._pending[product_id] = self._pending.get(product_id, 0) + count
+        self.stats["recorded"] += count
+
+    def pending(self, product_id: str) -> int:
+        """Views recorded for a product but not yet written"""
+        return self._pending.get(product_id, 0)
+
+    async def flush(self, collection) -> Dict[str, int]:
+        """Write all pending increments and return them by product id.
+
+        On failure the increments are kept for the next flush.
+        """
+        async with self._lock:
+            if not self._pending:
+                return {}
+            batch, self._pending = self._pending, {}
+            oldest, self._oldest = self._oldest, None
+            try:
+                await collection.bulk_write(
+                    [UpdateOne({"id": pid}, {"$inc": {"views_count": count}}) for pid, count in batch.items()],
+                    ordered=False
+                )
+            except Exception:
+                self.stats["failures"] += 1
+                for pid, count in batch.items():
+                    self._pending[pid] = self._pending.get(pid, 0) + count
+                self._oldest = min(filter(None, (oldest, self._oldest)), default=None)
+                raise
+
+            lag_ms = (time.monotonic() - oldest) * 1000 if oldest is not None else 0.0
+            self.stats["flushes"] += 1
+            self.stats["flushed_views"] += sum(batch.values())
+            self.stats["last_flush_products"] = len(batch)
+            self.stats["max_flush_products"] = max(self.stats["max_flush_products"], len(batch))
+            self.stats["last_lag_ms"] = lag_ms
+            self.stats["max_lag_ms"] = max(self.stats["max_lag_ms"], lag_ms)
+            return batch
+
+    def metrics(self) -> dict:
+        return {
+            **self.stats,
+            "pending_products": len(self._pending),
+            "pending_views": sum(self._pending.values()),
+            "oldest_pending_ms": (time.monotonic() - self._oldest) * 1000 if self._oldest is not None else 0.0
+        }
@@ -0,0 +1,104 @@
+"""
+Webhook inbox for GameHub Marketplace
+A verified provider event is stored in `webhook_events` (unique on its event
+id) and acknowledged at once; background workers apply it afterwards. Retried
+deliveries hit the unique index and cost one failed insert.
+"""
+import asyncio
+import logging
+from datetime import datetime, timezone, timedelta
+from typing import Awaitable, Callable, Optional
+
+from pymongo import ReturnDocument
+from pymongo.errors import DuplicateKeyError
+
+logger = logging.getLogger(__name__)
+
+
+class WebhookInbox:
+    """Events in `webhook_events` go pending -> processing -> done | failed.
+
+    A worker claims an event by leasing it; if the handler raises (or the
+    process dies mid-way) the lease runs out and another worker retries it,
+    up to ``max_attempts``. Handlers must therefore be idempotent, and must
+    raise rather than return while the event's effects are incomplete:
+    returning marks the event done for good.
+    """
+
+    def __init__(self, handle: Callable[[dict], Awaitable[None]], workers: int = 4,
+                 lease_seconds: float = 60, max_attempts: int = 10):
+        self._handle = handle
+        self.workers = workers
+        self.lease = timedelta(seconds=lease_seconds)
+        self.max_attempts = max_attempts
+        self._wake = asyncio.Event()
+        self.stats = {"received": 0, "duplicates": 0, "processed": 0, "retries": 0, "failed": 0}
+
+    async def record(self, db, event_id: str, event: dict) -> bool:
+        """Store a verified event; False if this event id was already received"""
+        now = datetime.now(timezone.utc)
+        try:
+            await db.webhook_events.insert_one({
+                "event_id": event_id,
+                **event,
+                "status": "pending",
+                "attempts": 0,
+                "received_at": now,
+                "leased_until": now
+            })
+        except DuplicateKeyError:
+            self.stats["duplicates"] += 1
+            return False
+        self.stats["received"] += 1
+        self._wake.set()
+        return True
+
+    async def _claim(self, db) -> Optional[dict]:
+        now = datetime.now(timezone.utc)
+        return await db.webhook_events.find_one_and_update(
+            {"status": {"$in": ["pending", "processing"]}, "leased_until": {"$lte": now}},
+            {"$set": {"status": "processing", "leased_until": now + self.lease}, "$inc": {"attempts": 1}},
+            projection={"_id": 0},
+            sort=[("received_at", 1)],
+            return_document=ReturnDocument.AFTER
+        )
+
+    async def _work(self, db):
+        while (event := await self._claim(db)) is not None:
+            try:
+                await self._handle(event)
+            except Exception as e:
+                failed = event["attempts"] >= self.max_attempts
+                self.stats["failed" if failed else "retries"] += 1
+                logger.error(f"Webhook event {event['event_id']} failed (attempt {event['attempts']}): {e}")
+                update = {"error": str(e)}
+                if failed:
+                    update.update(status="failed", processed_at=datetime.now(timezone.utc))
+                # Otherwise the event stays leased and is retried once the lease runs out
+                await db.webhook_events.update_one({"event_id": event["event_id"]}, {"$set": update})
+                continue
+            self.stats["processed"] += 1
+            await db.webhook_events.update_one(
+                {"event_id": event["event_id"]},
+                {"$set": {"status": "done", "processed_at": datetime.now(timezone.utc)}, "$unset": {"error": ""}}
+            )
+
+    async def drain(self, db):
+        """Apply every claimable event, ``workers`` at a time"""
+        await asyncio.gather(*(self._work(db) for _ in range(self.workers)))
+
+    async def run(self, db, poll_seconds: float = 5):
+        """Drain whenever an event arrives, and every ``poll_seconds`` for retries"""
+        while True:
+            self._wake.clear()
+            try:
+                await self.drain(db)
+            except Exception as e:
+                logger.error(f"Webhook inbox drain failed: {e}")
+            try:
+                await asyncio.wait_for(self._wake.wait(), poll_seconds)
+            except asyncio.TimeoutError:
+                pass
+
+    def metrics(self) -> dict:
+        return {**self.stats, "workers": self.workers}
@@ -56,6 +56,41 @@ function App() {
     site_name: 'GameHub'
   });
 
+  // Access tokens are short-lived: on a 401, trade the refresh token for a new
+  // pair once (shared by every request that failed meanwhile) and retry
+  useEffect(() => {
+    let refreshing = null;
+    const interceptor = axios.interceptors.response.use(null, async (error) => {
+      const original = error.config;
+      const refreshToken = localStorage.getItem('refresh_token');
+      // Only requests that carried a token can have failed for its expiry
+      if (error.response?.status !== 401 || !refreshToken || !original?.headers?.Authorization
+          || original._retried) {
+        return Promise.reject(error);
+      }
+      original._retried = true;
+      if (!refreshing) {
+        refreshing = axios.post(`${API}/auth/refresh`, { refresh_token: refreshToken })
+          .then((response) => {
+            login(response.data.access_token, response.data.user, response.data.refresh_token);
+            return response.data.access_token;
+          })
+          .catch(() => {
+            logout();
+            return null;
+          })
+          .finally(() => { refreshing = null; });
+      }
+      const newToken = await refreshing;
+      if (!newToken) {
+        return Promise.reject(error);
+      }
+      original.headers.Authorization = `Bearer ${newToken}`;
+      return axios(original);
+    });
+    return () => axios.interceptors.response.eject(interceptor);
+  }, []);
+
   useEffect(() => {
     fetchSiteSettings();
     if (token) {
@@ -100,14 +135,18 @@ function App() {
     }
   };
 
-  const login = (newToken, newUser) => {
+  const login = (newToken, newUser, refreshToken) => {
     localStorage.setItem('token', newToken);
+    if (refreshToken) {
+      localStorage.setItem('refresh_token', refreshToken);
+    }
     setToken(newToken);
     setUser(newUser);
   };
 
   const logout = () => {
     localStorage.removeItem('token');
+    localStorage.removeItem('refresh_token');
     setToken(null);
     setUser(null);
   };
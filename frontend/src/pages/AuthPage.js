@@ -28,7 +28,7 @@ export default function AuthPage() {
     setLoading(true);
     try {
       const response = await axios.post(`${API}/auth/login`, loginData);
-      login(response.data.access_token, response.data.user);
+      login(response.data.access_token, response.data.user, response.data.refresh_token);
       toast.success('Успешный вход!');
       navigate('/profile');
     } catch (error) {
@@ -43,7 +43,7 @@ export default function AuthPage() {
     setLoading(true);
     try {
       const response = await axios.post(`${API}/auth/register`, registerData);
-      login(response.data.access_token, response.data.user);
+      login(response.data.access_token, response.data.user, response.data.refresh_token);
       toast.success('Регистрация успешна!');
       navigate('/profile');
     } catch (error) {
@@ -66,7 +66,7 @@ export default function AuthPage() {
         hash: telegramUser.hash
       });
       
-      login(response.data.access_token, response.data.user);
+      login(response.data.access_token, response.data.user, response.data.refresh_token);
       toast.success('Вход через Telegram успешен!');
       navigate('/profile');
     } catch (error) {
@@ -20,12 +20,10 @@ export default function CheckoutPage() {
   const handleCheckout = async () => {
     setLoading(true);
     try {
-      // Create order
+      // Create order (titles and prices are filled in by the server)
       const orderData = {
         items: cart.map(item => ({
           product_id: item.id,
-          title: item.title,
-          price: item.price,
           quantity: item.quantity
         })),
         currency: currency
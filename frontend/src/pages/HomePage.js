@@ -25,7 +25,12 @@ export default function HomePage() {
 
   const fetchProducts = async () => {
     try {
-      const response = await axios.get(`${API}/products?limit=8`);
+      // Signed-in users get their personal feed (best sellers until there is history)
+      const response = user && token
+        ? await axios.get(`${API}/recommendations/my?limit=8`, {
+            headers: { Authorization: `Bearer ${token}` }
+          })
+        : await axios.get(`${API}/products?limit=8`);
       setProducts(response.data);
     } catch (error) {
       console.error('Failed to fetch products:', error);
@@ -30,7 +30,7 @@ export default function TelegramAuthPage() {
       const response = await axios.post(`${API}/auth/telegram/bot-token?token=${token}`);
       
       // Login successful
-      login(response.data.access_token, response.data.user);
+      login(response.data.access_token, response.data.user, response.data.refresh_token);
       setStatus('success');
       toast.success('Добро пожаловать!');
       
@@ -43,7 +43,7 @@ async def seed_database():
             "role": "admin",
             "avatar": None,
             "balance": 0.0,
-            "created_at": datetime.now(timezone.utc).isoformat()
+            "created_at": datetime.now(timezone.utc)
         },
         {
             "id": seller_id,
@@ -53,7 +53,7 @@ async def seed_database():
             "role": "seller",
             "avatar": None,
             "balance": 0.0,
-            "created_at": datetime.now(timezone.utc).isoformat()
+            "created_at": datetime.now(timezone.utc)
         },
         {
             "id": buyer_id,
@@ -63,7 +63,7 @@ async def seed_database():
             "role": "buyer",
             "avatar": None,
             "balance": 0.0,
-            "created_at": datetime.now(timezone.utc).isoformat()
+            "created_at": datetime.now(timezone.utc)
         }
     ]
     
@@ -124,7 +124,7 @@ async def seed_database():
             "stock": 50 - i,
             "sales_count": i * 5,
             "views_count": i * 50,
-            "created_at": datetime.now(timezone.utc).isoformat()
+            "created_at": datetime.now(timezone.utc)
         })
     
     await db.products.insert_many(products)
@@ -139,7 +139,7 @@ async def seed_database():
             "content": "Discover the most exciting games released this year. From epic RPGs to intense shooters, we've compiled the ultimate list of must-play titles that have defined gaming in 2025.",
             "author_id": admin_id,
             "image": product_images[0],
-            "published_at": datetime.now(timezone.utc).isoformat()
+            "published_at": datetime.now(timezone.utc)
         },
         {
             "id": str(uuid.uuid4()),
@@ -148,7 +148,7 @@ async def seed_database():
             "content": "Learn how to create the perfect gaming environment. We cover everything from choosing the right hardware to optimizing your space for maximum comfort and performance.",
             "author_id": admin_id,
             "image": product_images[1],
-            "published_at": datetime.now(timezone.utc).isoformat()
+            "published_at": datetime.now(timezone.utc)
         },
         {
             "id": str(uuid.uuid4()),
@@ -157,7 +157,7 @@ async def seed_database():
             "content": "Check out the hottest gaming deals available right now. Save big on popular titles and exclusive bundles. Don't miss these limited-time offers!",
             "author_id": admin_id,
             "image": product_images[2],
-            "published_at": datetime.now(timezone.utc).isoformat()
+            "published_at": datetime.now(timezone.utc)
         }
     ]
     
@@ -173,7 +173,7 @@ async def seed_database():
             "products": [products[0]["id"], products[1]["id"], products[2]["id"]],
             "entries": [],
             "winner_id": None,
-            "end_date": (datetime.now(timezone.utc) + timedelta(days=7)).isoformat(),
+            "end_date": datetime.now(timezone.utc) + timedelta(days=7),
             "status": "active"
         },
         {
@@ -183,7 +183,7 @@ async def seed_database():
             "products": [products[3]["id"], products[4]["id"]],
             "entries": [],
             "winner_id": None,
-            "end_date": (datetime.now(timezone.utc) + timedelta(days=14)).isoformat(),
+            "end_date": datetime.now(timezone.utc) + timedelta(days=14),
             "status": "active"
         }
     ]
@@ -0,0 +1,57 @@
+import os
+import sys
+from pathlib import Path
+
+import pytest
+
+# The backend modules import each other as top-level modules
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent / "backend"))
+
+# server reads its configuration at import time
+os.environ.setdefault("MONGO_URL", "mongodb://localhost:27017")
+os.environ.setdefault("DB_NAME", "test_database")
+os.environ.setdefault("PAYMENT_PROVIDER", "stub")
+os.environ.setdefault("BCRYPT_TARGET_MS", "0")
+
+
+@pytest.fixture
+def anyio_backend():
+    return "asyncio"
+
+
+def _returning_the_updated_document(find_and_modify):
+    """mongomock re-reads a find_one_and_update(..., AFTER) result with the
+    original filter when ``_id`` is projected away, so an update that moves
+    the document out of its own filter returns None; Mongo returns it."""
+
+    def patched(self, query, projection=None, *args, **kwargs):
+        if not isinstance(projection, dict) or projection.get("_id", 1):
+            return find_and_modify(self, query, projection, *args, **kwargs)
+        fields = {name: value for name, value in projection.items() if name != "_id"}
+        if any(fields.values()):
+            fields["_id"] = 1
+        doc = find_and_modify(self, query, fields or None, *args, **kwargs)
+        if doc is not None:
+            doc.pop("_id", None)
+        return doc
+
+    return patched
+
+
+@pytest.fixture
+def db(monkeypatch):
+    """A fresh in-memory database"""
+    mongomock_motor = pytest.importorskip("mongomock_motor")
+    from mongomock.collection import Collection
+
+    monkeypatch.setattr(Collection, "_find_and_modify", _returning_the_updated_document(Collection._find_and_modify))
+    return mongomock_motor.AsyncMongoMockClient(tz_aware=True)["test_database"]
+
+
+@pytest.fixture
+def server(monkeypatch, db):
+    """The backend app module, talking to a fresh in-memory database"""
+    import server as module
+
+    monkeypatch.setattr(module, "db", db)
+    return module
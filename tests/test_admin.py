@@ -0,0 +1,36 @@
+from datetime import datetime, timezone
+
+import httpx
+import pytest
+
+pytestmark = pytest.mark.anyio
+
+
+async def add_user(server, user_id, role="buyer", balance=0.0):
+    user = {
+        "id": user_id, "email": f"{user_id}@example.com", "name": user_id, "role": role, "balance": balance,
+        "token_version": 0, "created_at": datetime.now(timezone.utc)
+    }
+    await server.db.users.insert_one(dict(user))
+    return user
+
+
+async def test_balance_adjustment_with_a_role_claim_token(server, monkeypatch):
+    monkeypatch.setattr(server, "JWT_ROLE_CLAIMS", True)
+    await server.create_indexes()
+    admin = await add_user(server, "admin-1", role="admin")
+    await add_user(server, "buyer-1", balance=10.0)
+    access_token, _ = server.issue_tokens(admin)
+    assert server.decode_token(access_token)["role"] == "admin"
+
+    transport = httpx.ASGITransport(app=server.app)
+    async with httpx.AsyncClient(transport=transport, base_url="http://test") as http:
+        response = await http.put(
+            "/api/admin/users/buyer-1/balance", params={"amount": 5},
+            headers={"Authorization": f"Bearer {access_token}"}
+        )
+
+    assert response.status_code == 200, response.text
+    assert response.json()["new_balance"] == 15.0
+    record = await server.db.transactions.find_one({"user_id": "buyer-1"})
+    assert record["description"] == "Admin adjustment by admin-1@example.com"
@@ -0,0 +1,104 @@
+from datetime import datetime, timezone
+
+import httpx
+import pytest
+
+from balances import Balances, InsufficientBalance
+from ledger import Ledger
+
+pytestmark = pytest.mark.anyio
+
+
+async def add_user(db, user_id, balance=0.0):
+    await db.users.insert_one({
+        "id": user_id, "email": f"{user_id}@example.com", "name": user_id, "role": "buyer", "balance": balance,
+        "token_version": 0, "created_at": datetime.now(timezone.utc)
+    })
+
+
+async def api(server, method, path, user_id, **kwargs):
+    access_token, _ = server.issue_tokens({"id": user_id, "role": "buyer"})
+    transport = httpx.ASGITransport(app=server.app)
+    async with httpx.AsyncClient(transport=transport, base_url="http://test") as http:
+        return await http.request(method, path, headers={"Authorization": f"Bearer {access_token}"}, **kwargs)
+
+
+@pytest.mark.parametrize("path,method", [
+    ("/api/balance/deposit", "platform:sales"),
+    ("/api/balance/withdrawal", "anything-goes"),
+])
+async def test_unknown_payment_methods_are_refused(server, path, method):
+    await server.create_indexes()
+    await add_user(server.db, "buyer-1", balance=50.0)
+
+    response = await api(server, "POST", path, "buyer-1", json={"amount": 5, "method": method})
+
+    assert response.status_code == 422
+    assert await server.db.ledger_entries.count_documents({}) == 0
+    assert (await server.db.users.find_one({"id": "buyer-1"}))["balance"] == 50.0
+
+
+async def test_a_deposit_moves_money_in_from_its_method(server):
+    await server.create_indexes()
+    await add_user(server.db, "buyer-1")
+
+    response = await api(server, "POST", "/api/balance/deposit", "buyer-1", json={"amount": 5, "method": "card"})
+
+    assert response.status_code == 200, response.text
+    lines = await server.db.ledger_entries.find({}, {"_id": 0, "account": 1, "amount": 1}).to_list(10)
+    assert sorted((line["account"], line["amount"]) for line in lines) == [("external:card", -5.0), ("user:buyer-1", 5.0)]
+
+
+async def test_a_debit_that_would_overdraw_is_refused_without_a_trace(db):
+    balances = Balances(Ledger())
+    await add_user(db, "buyer-1", balance=10.0)
+
+    with pytest.raises(InsufficientBalance):
+        await balances.apply(db, "buyer-1", -10.01, {"type": "withdrawal", "method": "card"}, "external:card")
+    paid = await balances.apply(db, "buyer-1", -10.0, {"type": "withdrawal", "method": "card"}, "external:card")
+
+    user = await db.users.find_one({"id": "buyer-1"})
+    assert (user["balance"], user["pending_transactions"]) == (0.0, [])
+    assert [record["id"] for record in await db.transactions.find({}).to_list(10)] == [paid["id"]]
+    assert await db.ledger_entries.count_documents({}) == 2
+
+
+@pytest.mark.parametrize("crash_in", ["_post", "_finalize"])
+async def test_recover_settles_a_change_interrupted_after_its_inc(db, monkeypatch, crash_in):
+    await db.ledger_entries.create_index([("entry_id", 1), ("account", 1)], unique=True)
+    balances = Balances(Ledger())
+    await add_user(db, "buyer-1", balance=10.0)
+
+    async def crash(*args):
+        raise RuntimeError("process died")
+
+    with monkeypatch.context() as patch:  # before the ledger entry, or between it and finalizing
+        patch.setattr(balances, crash_in, crash)
+        with pytest.raises(RuntimeError):
+            await balances.apply(db, "buyer-1", -4.0, {"type": "withdrawal", "method": "card"}, "external:card")
+    assert (await db.users.find_one({"id": "buyer-1"}))["balance"] == 6.0
+
+    assert await balances.recover(db, older_than_seconds=0) == 1
+    assert await balances.recover(db, older_than_seconds=0) == 0
+
+    record = await db.transactions.find_one({})
+    user = await db.users.find_one({"id": "buyer-1"})
+    lines = await db.ledger_entries.find({"entry_id": record["id"]}).to_list(10)
+    assert record["status"] == "completed"
+    assert (user["balance"], user["pending_transactions"]) == (6.0, [])
+    assert sorted((line["account"], line["amount"]) for line in lines) == [("external:card", 4.0), ("user:buyer-1", -4.0)]
+
+
+async def test_recover_drops_a_change_that_never_applied(db):
+    balances = Balances(Ledger())
+    await add_user(db, "buyer-1", balance=10.0)
+    await db.transactions.insert_one({
+        "id": "tx-1", "user_id": "buyer-1", "type": "deposit", "amount": 5.0, "status": "processing",
+        "final_status": "completed", "counterparty": "external:card", "created_at": datetime.now(timezone.utc)
+    })
+
+    assert await balances.recover(db, older_than_seconds=0) == 1
+
+    assert await db.transactions.count_documents({}) == 0
+    assert await db.ledger_entries.count_documents({}) == 0
+    assert (await db.users.find_one({"id": "buyer-1"}))["balance"] == 10.0
@@ -0,0 +1,41 @@
+import json
+from datetime import datetime, timezone
+from typing import List, Optional
+
+from bson.tz_util import utc as bson_utc
+from fastapi.encoders import jsonable_encoder
+from fastapi.responses import JSONResponse
+from pydantic import BaseModel
+
+from fast_json import fast_response, shape
+
+
+class Listing(BaseModel):
+    id: str
+    created_at: datetime
+    updated_at: Optional[datetime] = None
+    tags: List[str] = []
+
+
+DOCS = [
+    {"id": "a", "created_at": datetime(2024, 3, 1, 12, 30, 5, 123456, tzinfo=timezone.utc)},
+    # What a tz_aware Motor client hands back
+    {"id": "b", "created_at": datetime(2024, 3, 1, 12, 30, 5, 123000, tzinfo=bson_utc),
+     "updated_at": datetime(2024, 3, 2, tzinfo=bson_utc)},
+    {"id": "c", "created_at": datetime(2024, 3, 1, 12, 30, 5), "tags": ["x"]},
+]
+
+
+def test_fast_response_matches_the_response_model_path():
+    validated = JSONResponse(jsonable_encoder([Listing(**doc) for doc in DOCS])).body
+    fast = fast_response(shape(Listing, DOCS, tuple(Listing.model_fields))).body
+
+    assert json.loads(fast) == json.loads(validated)
+
+
+def test_utc_timestamps_end_in_z():
+    body = json.loads(fast_response(shape(Listing, DOCS, ("id", "created_at"))).body)
+
+    assert [row["created_at"] for row in body] == [
+        "2024-03-01T12:30:05.123456Z", "2024-03-01T12:30:05.123000Z", "2024-03-01T12:30:05"
+    ]
@@ -0,0 +1,223 @@
+from datetime import datetime, timedelta, timezone
+
+import pytest
+
+pytestmark = pytest.mark.anyio
+
+
+async def place_paid_checkout(server, session_id="cs_test_1", stock=5, quantity=2, product_ids=("product-1",)):
+    """Products, a pending order holding their stock and the order's checkout session"""
+    db = server.db
+    await server.create_indexes()
+    now = datetime.now(timezone.utc)
+    await db.products.insert_many([{
+        "id": product_id, "title": "Key", "description": "", "price": 10.0, "product_type": "key",
+        "images": [], "category_id": "games", "seller_id": "seller-1", "stock": stock, "sales_count": 0,
+        "views_count": 0, "created_at": now
+    } for product_id in product_ids])
+    items = [
+        {"product_id": product_id, "title": "Key", "price": 10.0, "quantity": quantity, "seller_id": "seller-1"}
+        for product_id in product_ids
+    ]
+    total = 10.0 * quantity * len(product_ids)
+    await server.stock_reservations.reserve(db, "order-1", "buyer-1", {product_id: quantity for product_id in product_ids})
+    await db.orders.insert_one({
+        "id": "order-1", "user_id": "buyer-1", "items": items, "total": total, "currency": "usd",
+        "status": "pending", "payment_id": None, "created_at": now
+    })
+    await db.payment_transactions.insert_one({
+        "id": "tx-1", "session_id": session_id, "order_id": "order-1", "user_id": "buyer-1",
+        "amount": total, "currency": "usd", "payment_status": "pending", "status": "initiated",
+        "created_at": now
+    })
+    return session_id
+
+
+def fail_once(monkeypatch, server, name):
+    original = getattr(server, name)
+    calls = []
+
+    async def flaky(*args, **kwargs):
+        calls.append(args)
+        if len(calls) == 1:
+            raise RuntimeError(f"{name} failed")
+        return await original(*args, **kwargs)
+
+    monkeypatch.setattr(server, name, flaky)
+    return calls
+
+
+async def assert_fulfilled_once(server, stock=5, quantity=2, product_ids=("product-1",)):
+    db = server.db
+    order = await db.orders.find_one({"id": "order-1"})
+    reservation = await db.stock_reservations.find_one({"order_id": "order-1"})
+    transaction = await db.payment_transactions.find_one({"id": "tx-1"})
+    assert order["status"] == "paid"
+    assert reservation["status"] == "converted"
+    for product_id in product_ids:
+        product = await db.products.find_one({"id": product_id})
+        assert (product["stock"], product["sales_count"]) == (stock - quantity, quantity)
+        assert "updated_at" not in product  # stock moves aren't catalogue edits
+    assert await db.ledger_entries.count_documents({"entry_id": "order:order-1"}) == 2
+    assert (transaction["payment_status"], transaction["fulfilled"]) == ("paid", True)
+
+
+async def test_retry_completes_a_fulfilment_that_failed_part_way(server, monkeypatch):
+    session_id = await place_paid_checkout(server)
+    fail_once(monkeypatch, server, "convert_order_stock")
+
+    with pytest.raises(RuntimeError):
+        await server.fulfill_payment(session_id)
+    transaction = await server.db.payment_transactions.find_one({"session_id": session_id})
+    assert (transaction["payment_status"], transaction["fulfilled"]) == ("paid", False)
+
+    assert await server.fulfill_payment(session_id) is True
+    await assert_fulfilled_once(server)
+    assert await server.fulfill_payment(session_id) is False
+    await assert_fulfilled_once(server)
+
+
+def fail_once_on_sales_count(monkeypatch, product_id):
+    """Make the first write counting ``product_id``'s sales fail, part way through converting the hold"""
+    from mongomock.collection import Collection
+    update_one, bulk_write = Collection.update_one, Collection.bulk_write
+    failed = []
+
+    def check(collection, filter, update):
+        counts_sales = "sales_count" in update.get("$inc", {})
+        if collection.name == "products" and filter.get("id") == product_id and counts_sales and not failed:
+            failed.append(filter)
+            raise RuntimeError("products write failed")
+
+    def flaky_update_one(self, filter, update, *args, **kwargs):
+        check(self, filter, update)
+        return update_one(self, filter, update, *args, **kwargs)
+
+    def flaky_bulk_write(self, requests, *args, **kwargs):
+        for request in requests:
+            check(self, request._filter, request._doc)
+        return bulk_write(self, requests, *args, **kwargs)
+
+    monkeypatch.setattr(Collection, "update_one", flaky_update_one)
+    monkeypatch.setattr(Collection, "bulk_write", flaky_bulk_write)
+    return failed
+
+
+@pytest.mark.parametrize("late", [False, True])
+async def test_retry_resumes_a_stock_conversion_that_failed_part_way(server, monkeypatch, late):
+    products = ("product-1", "product-2")
+    session_id = await place_paid_checkout(server, product_ids=products)
+    if late:  # the hold lapsed before payment, so conversion takes the stock again
+        await server.db.stock_reservations.update_one({}, {"$set": {"expires_at": datetime.now(timezone.utc)}})
+        await server.sweep_stock_reservations()
+    failed = fail_once_on_sales_count(monkeypatch, "product-2")
+
+    with pytest.raises(RuntimeError):
+        await server.fulfill_payment(session_id)
+    assert failed
+    reservation = await server.db.stock_reservations.find_one({"order_id": "order-1"})
+    assert reservation["status"] == "converting"
+
+    assert await server.fulfill_payment(session_id) is True
+    await assert_fulfilled_once(server, product_ids=products)
+    assert await server.fulfill_payment(session_id) is False
+    await assert_fulfilled_once(server, product_ids=products)
+
+
+async def test_sweep_leaves_a_retried_order_sold(server, monkeypatch):
+    session_id = await place_paid_checkout(server)
+    fail_once(monkeypatch, server, "convert_order_stock")
+    with pytest.raises(RuntimeError):
+        await server.fulfill_payment(session_id)
+
+    await server.fulfill_payment(session_id)
+    await server.db.stock_reservations.update_many({}, {"$set": {"expires_at": datetime.now(timezone.utc)}})
+    await server.sweep_stock_reservations()
+
+    await assert_fulfilled_once(server)
+
+
+async def test_status_poll_finishes_an_unfulfilled_payment(server, monkeypatch):
+    session_id = await place_paid_checkout(server)
+    fail_once(monkeypatch, server, "convert_order_stock")
+    with pytest.raises(RuntimeError):
+        await server.fulfill_payment(session_id)
+
+    status = await server.get_checkout_status(session_id, user={"id": "buyer-1"})
+
+    assert status["payment_status"] == "paid"
+    await assert_fulfilled_once(server)
+
+
+async def test_payments_settled_before_the_fulfilled_flag_are_left_alone(server):
+    session_id = await place_paid_checkout(server)
+    await server.db.payment_transactions.update_one(
+        {"session_id": session_id}, {"$set": {"payment_status": "paid", "status": "completed"}}
+    )
+
+    assert await server.fulfill_payment(session_id) is False
+    assert (await server.db.orders.find_one({"id": "order-1"}))["status"] == "pending"
+
+
+async def test_webhook_event_is_not_acknowledged_until_the_order_is_fulfilled(server, monkeypatch):
+    session_id = await place_paid_checkout(server)
+    fail_once(monkeypatch, server, "convert_order_stock")
+    event = {"event_id": "evt_1", "event_type": "checkout.session.completed", "session_id": session_id,
+             "payment_status": "paid"}
+
+    with pytest.raises(RuntimeError):
+        await server.apply_webhook_event(event)
+    await server.apply_webhook_event(event)
+
+    await assert_fulfilled_once(server)
+
+
+async def test_webhook_event_finishes_a_fulfilment_left_unfinished(server):
+    session_id = await place_paid_checkout(server)
+    await server.db.payment_transactions.update_one(
+        {"session_id": session_id}, {"$set": {"payment_status": "paid", "fulfilled": False}}
+    )
+    event = {"event_id": "evt_1", "session_id": session_id, "payment_status": "paid"}
+
+    await server.apply_webhook_event(event)  # picks the unfinished fulfilment up and completes it
+    await assert_fulfilled_once(server)
+    await server.apply_webhook_event(event)  # already fulfilled: acknowledged
+
+
+async def leave_paid_but_unfulfilled(server, session_id):
+    """The state a fulfilment that died after taking the payment leaves behind"""
+    await server.db.payment_transactions.update_one({"session_id": session_id}, {"$set": {
+        "payment_status": "paid", "status": "completed", "fulfilled": False,
+        "created_at": datetime.now(timezone.utc) - timedelta(hours=1)
+    }})
+
+
+async def test_reconciler_finishes_a_paid_order_left_pending(server, monkeypatch):
+    session_id = await place_paid_checkout(server)
+    await leave_paid_but_unfulfilled(server, session_id)
+
+    async def no_provider(session_id):
+        raise AssertionError("the provider was asked about a paid session")
+
+    monkeypatch.setattr(server.payment_gateway, "get_status", no_provider)
+    await server.reconcile_pending_payments()
+
+    await assert_fulfilled_once(server)
+
+
+async def test_reconciler_runs_only_on_the_worker_holding_the_lease(server):
+    session_id = await place_paid_checkout(server)
+    await leave_paid_but_unfulfilled(server, session_id)
+    await server.db.job_leases.insert_one({
+        "name": "payment reconciliation", "holder": "another-worker",
+        "leased_until": datetime.now(timezone.utc) + timedelta(minutes=1)
+    })
+
+    await server.reconcile_pending_payments()
+    assert (await server.db.orders.find_one({"id": "order-1"}))["status"] == "pending"
+
+    await server.db.job_leases.update_one({}, {"$set": {"leased_until": datetime.now(timezone.utc)}})
+    await server.reconcile_pending_payments()
+    await assert_fulfilled_once(server)
+    lease = await server.db.job_leases.find_one({"name": "payment reconciliation"})
+    assert lease["holder"] == server.JOB_LEASE_HOLDER
@@ -0,0 +1,31 @@
+import asyncio
+from datetime import datetime, timedelta, timezone
+
+import pytest
+
+pytestmark = pytest.mark.anyio
+
+
+async def test_an_exclusive_job_runs_only_on_the_lease_holder(server):
+    await server.create_indexes()
+    await server.db.job_leases.insert_one({
+        "name": "ledger checkpoint", "holder": "another-worker",
+        "leased_until": datetime.now(timezone.utc) + timedelta(minutes=1)
+    })
+    runs = []
+
+    async def job():
+        runs.append(server.JOB_LEASE_HOLDER)
+
+    task = asyncio.create_task(server.run_periodically(0.01, job, "ledger checkpoint", exclusive=True))
+    try:
+        await asyncio.sleep(0.05)
+        assert runs == []
+
+        await server.db.job_leases.update_one({}, {"$set": {"leased_until": datetime.now(timezone.utc)}})
+        await asyncio.sleep(0.05)
+        assert runs
+    finally:
+        task.cancel()
+    lease = await server.db.job_leases.find_one({"name": "ledger checkpoint"})
+    assert lease["holder"] == server.JOB_LEASE_HOLDER
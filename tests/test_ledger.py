@@ -0,0 +1,74 @@
+from datetime import datetime, timedelta, timezone
+
+import pytest
+
+from ledger import Ledger, user_account
+
+pytestmark = pytest.mark.anyio
+
+
+@pytest.fixture
+async def ledger_db(db):
+    await db.ledger_entries.create_index([("entry_id", 1), ("account", 1)], unique=True)
+    return db
+
+
+async def post_at(ledger, db, entry_id, user_id, amount, at):
+    """A deposit posted as if at ``at``"""
+    await ledger.transfer(db, entry_id, "deposit", "external:card", user_account(user_id), amount)
+    await db.ledger_entries.update_many({"entry_id": entry_id}, {"$set": {"created_at": at}})
+
+
+async def resum(db, account, at=None):
+    query = {"account": account, **({"created_at": {"$lte": at}} if at else {})}
+    return round(sum(line["amount"] for line in await db.ledger_entries.find(query).to_list(None)), 2)
+
+
+async def test_transfer_is_recorded_once_however_often_it_is_retried(ledger_db):
+    ledger = Ledger()
+
+    results = [await ledger.transfer(ledger_db, "order:1", "purchase", "external:stripe", "platform:sales", 25.0)
+               for _ in range(3)]
+
+    assert results == [True, False, False]
+    assert await ledger_db.ledger_entries.count_documents({"entry_id": "order:1"}) == 2
+    assert await ledger.balance_as_of(ledger_db, "platform:sales") == 25.0
+    assert ledger.stats["duplicates"] == 2
+
+
+async def test_checkpointed_balances_match_a_full_resum(ledger_db):
+    now = datetime.now(timezone.utc)
+    hours_ago = lambda hours: now - timedelta(hours=hours)  # noqa: E731
+    account = user_account("buyer-1")
+    for i, (amount, hours) in enumerate([(10.0, 5), (2.5, 4), (-3.0, 3)]):
+        await post_at(Ledger(), ledger_db, f"e{i}", "buyer-1", amount, hours_ago(hours))
+    assert await Ledger(lag_seconds=2.5 * 3600).checkpoint(ledger_db) == 2  # the user and external:card
+
+    for i, (amount, hours) in enumerate([(7.25, 2), (-1.0, 1), (0.1, 0.5)], start=3):
+        await post_at(Ledger(), ledger_db, f"e{i}", "buyer-1", amount, hours_ago(hours))
+    await Ledger(lag_seconds=1.5 * 3600).checkpoint(ledger_db)
+    await post_at(Ledger(), ledger_db, "e6", "buyer-1", 4.0, hours_ago(0.1))
+
+    ledger = Ledger()
+    for at in (None, hours_ago(4.5), hours_ago(2.5), hours_ago(1.75), hours_ago(0.75), hours_ago(0.2)):
+        assert await ledger.balance_as_of(ledger_db, account, at) == await resum(ledger_db, account, at), at
+    assert await ledger.balance_as_of(ledger_db, account) == 19.85
+
+
+async def test_verify_reports_a_mismatch_and_skips_changes_in_flight(ledger_db):
+    ledger = Ledger(lag_seconds=0)
+    await ledger_db.users.insert_many([
+        {"id": "a", "balance": 11.0},                                   # 10 snapshotted + 1 since
+        {"id": "b", "balance": 6.0},                                    # the ledger says 5
+        {"id": "c", "balance": 99.0, "pending_transactions": ["tx-9"]},  # mid-change: not compared
+        {"id": "d", "balance": 0.0},
+    ])
+    for user_id, amount in (("a", 10.0), ("b", 5.0), ("c", 1.0)):
+        await ledger.transfer(ledger_db, f"deposit:{user_id}", "deposit", "external:card", user_account(user_id), amount)
+    await ledger.checkpoint(ledger_db)
+    await ledger.transfer(ledger_db, "deposit:a2", "deposit", "external:card", user_account("a"), 1.0)
+
+    report = await ledger.verify(ledger_db)
+
+    assert (report["checked"], report["skipped"], report["mismatched"], report["orphaned"]) == (3, 1, 1, 0)
+    assert report["mismatches"] == [{"user_id": "b", "balance": 6.0, "ledger": 5.0}]
@@ -0,0 +1,55 @@
+from datetime import datetime, timezone
+
+import pytest
+
+from pagination import Keyset
+
+mongomock = pytest.importorskip("mongomock")
+
+
+def paginate(collection, keyset: Keyset, limit: int) -> list:
+    seen, cursor = [], None
+    while True:
+        page = list(collection.find(keyset.after({}, cursor), {"_id": 0}).sort(keyset.sort).limit(limit))
+        seen.extend(doc["id"] for doc in page)
+        cursor = keyset.next_cursor(page, limit)
+        if cursor is None:
+            return seen
+
+
+@pytest.mark.parametrize("direction", [1, -1])
+@pytest.mark.parametrize("limit", [1, 2, 3, 7])
+def test_pages_cover_rows_missing_the_sort_key(direction, limit):
+    collection = mongomock.MongoClient().db.products
+    collection.insert_many(
+        [{"id": f"p{i:02d}", "sales_count": i % 4} for i in range(10)]
+        + [{"id": f"q{i:02d}"} for i in range(5)]            # legacy rows without the field
+        + [{"id": f"r{i:02d}", "sales_count": None} for i in range(2)]
+    )
+    keyset = Keyset(("sales_count", direction), ("id", direction))
+    expected = [doc["id"] for doc in collection.find({}, {"_id": 0, "id": 1}).sort(keyset.sort)]
+
+    assert paginate(collection, keyset, limit) == expected
+
+
+def test_cursor_on_a_missing_key_round_trips():
+    keyset = Keyset(("sales_count", -1), ("id", -1))
+    cursor = keyset.next_cursor([{"id": "q01"}], 1)
+
+    assert keyset.after({}, cursor) == {"sales_count": None, "id": {"$lt": "q01"}}
+
+
+@pytest.mark.parametrize("direction", [1, -1])
+@pytest.mark.parametrize("limit", [1, 2, 4])
+def test_pages_continue_from_dates_into_legacy_string_dates(direction, limit):
+    collection = mongomock.MongoClient(tz_aware=True).db.products
+    collection.insert_many(
+        [{"id": f"d{i}", "created_at": datetime(2024, 1, 1 + i % 3, tzinfo=timezone.utc)} for i in range(6)]
+        + [{"id": f"s{i}", "created_at": f"2023-06-0{1 + i % 2}T00:00:00+00:00"} for i in range(4)]  # not migrated yet
+        + [{"id": "n0"}]
+    )
+    keyset = Keyset(("created_at", direction), ("id", direction))
+    expected = [doc["id"] for doc in collection.find({}, {"_id": 0, "id": 1}).sort(keyset.sort)]
+
+    assert len(expected) == 11
+    assert paginate(collection, keyset, limit) == expected
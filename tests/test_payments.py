@@ -0,0 +1,64 @@
+import pytest
+
+from payments import PaymentGateway, PaymentRejected, PaymentUnavailable, StubGateway
+
+pytestmark = pytest.mark.anyio
+
+
+class ProviderError(Exception):
+    def __init__(self, http_status):
+        super().__init__(f"HTTP {http_status}")
+        self.http_status = http_status
+
+
+class TransportError(Exception):
+    """Named like httpx's, which the gateway recognises without importing it"""
+
+
+class FailingGateway(PaymentGateway):
+    name = "failing"
+
+    def __init__(self, error: Exception):
+        super().__init__(failure_threshold=2)
+        self.error = error
+
+    async def _status(self, session_id):
+        raise self.error
+
+
+@pytest.mark.parametrize("error", [ProviderError(400), ProviderError(404), KeyError("cs_1"), ValueError("bad amount")])
+async def test_rejected_requests_leave_the_breaker_closed(error):
+    gateway = FailingGateway(error)
+
+    for _ in range(5):
+        with pytest.raises(PaymentRejected):
+            await gateway.get_status("cs_1")
+
+    assert gateway.breaker.state == "closed"
+    assert (gateway.stats["refused"], gateway.stats["failures"]) == (5, 0)
+
+
+@pytest.mark.parametrize("error", [ProviderError(500), ProviderError(429), TransportError("reset"), ConnectionError()])
+async def test_provider_failures_open_the_breaker(error):
+    gateway = FailingGateway(error)
+
+    for _ in range(2):
+        with pytest.raises(PaymentUnavailable):
+            await gateway.get_status("cs_1")
+
+    assert gateway.breaker.state == "open"
+
+
+async def test_stub_sessions_are_shared_between_workers():
+    mongomock_motor = pytest.importorskip("mongomock_motor")
+    sessions = mongomock_motor.AsyncMongoMockClient(tz_aware=True)["test_database"].stub_payment_sessions
+    one, other = (StubGateway("http://shop", sessions, secret="shared") for _ in range(2))
+
+    session = await one.create_session(12.5, "usd", "http://shop/ok", "http://shop/cancel", {"order_id": "order-1"})
+    body, signature = await other.pay(session.session_id)
+    status = await one.get_status(session.session_id)
+    event = await one.parse_webhook(body, signature)
+
+    assert (status.payment_status, status.amount_total, status.metadata) == ("paid", 1250, {"order_id": "order-1"})
+    assert (event.session_id, event.payment_status) == (session.session_id, "paid")
+    assert await one.pay("cs_stub_unknown") is None